@@ -0,0 +1,410 @@
+import asyncio
+import functools
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from downloader import (download_stage, find_stored_output, get_playlist_urls, get_video_id, get_video_info,
+                        is_playlist, job_percent, merge_streams, plan_encode, record_encode, remove_files,
+                        resolve_video, select_video_codec, track_encode_progress)
+from encode_scheduler import POLL_INTERVAL, get_encode_scheduler
+from instrumentation import span
+from watermark import (add_moving_watermark, build_watermark_command, choose_engine, parse_progress_block,
+                       probe_duration)
+
+# Threads running blocking yt_dlp, range download and ffprobe calls for every job on the loop
+DEFAULT_BLOCKING_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def configure_blocking_executor(max_workers=DEFAULT_BLOCKING_WORKERS):
+    """
+    Replaces the shared executor that blocking calls run on. Calls beyond
+    `max_workers` wait for a free thread instead of starting new ones.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ytdwm-blocking")
+        return _executor
+
+def get_blocking_executor():
+    """
+    Returns the shared executor, creating it with the defaults on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_BLOCKING_WORKERS, thread_name_prefix="ytdwm-blocking")
+        return _executor
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking function on the shared executor and awaits its result.
+
+    Cancelling the awaiting task stops waiting but cannot interrupt the
+    thread; the call runs to completion in the background.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(func, *args, **kwargs))
+
+class JobCancelled(Exception):
+    """
+    Raised inside blocking download and encode code to stop a job whose task was cancelled.
+    """
+
+async def get_video_info_async(video_url):
+    """
+    Async `downloader.get_video_info`, sharing its info cache.
+    """
+    return await run_blocking(get_video_info, video_url)
+
+async def get_playlist_urls_async(playlist_url):
+    """
+    Async `downloader.get_playlist_urls`.
+    """
+    return await run_blocking(get_playlist_urls, playlist_url)
+
+async def resolve_video_async(video_url):
+    """
+    Async `downloader.resolve_video`: errors end up in the entry's status.
+    """
+    return await run_blocking(resolve_video, video_url)
+
+async def process_url_async(url, output_path, watermark=True, watermark_text="LIMITLESS MEDIA", progress_callback=None,
+                            max_concurrency=8):
+    """
+    Async `downloader.process_url`. Playlist entries are resolved
+    concurrently, at most `max_concurrency` at a time, and reported through
+    `progress_callback` as each finishes; the result keeps playlist order.
+    """
+    result = {
+        'is_playlist': False,
+        'videos': [],
+        'watermark': watermark
+    }
+    try:
+        if is_playlist(url):
+            result['is_playlist'] = True
+            video_urls = await get_playlist_urls_async(url)
+        else:
+            video_urls = [url]
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def resolve(video_url):
+            async with semaphore:
+                video_info = await resolve_video_async(video_url)
+            if progress_callback:
+                progress_callback({
+                    'type': 'video_processed',
+                    'video': video_info,
+                    'total_videos': len(video_urls)
+                })
+            return video_info
+
+        result['videos'] = list(await asyncio.gather(*(resolve(video_url) for video_url in video_urls)))
+        return result
+    except Exception as e:
+        raise Exception(f"Error processing URL: {str(e)}")
+
+async def run_ffmpeg_async(command, duration=None, progress_callback=None, allocation=None):
+    """
+    Async `watermark.run_ffmpeg`: runs ffmpeg with `asyncio.create_subprocess_exec`
+    and reports the same progress events. If the awaiting task is cancelled
+    or anything else goes wrong while it runs (including an exception from
+    `progress_callback`), ffmpeg is killed before the error propagates.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg exits with an error
+    """
+    command = [command[0], "-progress", "pipe:1", "-nostats", *command[1:]]
+    process = await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    if allocation:
+        allocation.apply_to(process.pid)
+
+    stderr_tail = deque(maxlen=50)
+    async def drain_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', 'replace'))
+    stderr_task = asyncio.ensure_future(drain_stderr())
+
+    try:
+        fields = {}
+        async for line in process.stdout:
+            key, _, value = line.decode('utf-8', 'replace').strip().partition("=")
+            if key != "progress":
+                fields[key] = value
+                continue
+            if progress_callback:
+                progress_callback(parse_progress_block(fields, value, duration))
+            fields = {}
+        returncode = await process.wait()
+        await stderr_task
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr="".join(stderr_tail))
+
+async def acquire_encode_slots(scheduler=None, threads=None):
+    """
+    Async `EncodeScheduler.acquire`: polls for free CPU slots without
+    blocking the loop. Release the returned allocation when done.
+    """
+    scheduler = scheduler or get_encode_scheduler()
+    while True:
+        allocation = scheduler.try_acquire(threads)
+        if allocation:
+            return allocation
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def add_moving_watermark_async(input_file, output_file, watermark_text, video_codec="libx264", video_bitrate=None,
+                                     audio_file=None, metadata_args=None, segments=None, workers=None,
+                                     threads_per_worker=None, engine="drawtext", windows=None, source_codec=None,
+                                     encoder_profile=None, progress_callback=None, scheduler=None):
+    """
+    Async `watermark.add_moving_watermark`.
+
+    Single-pass encodes run ffmpeg directly on the loop and are killed when
+    the task is cancelled. Segmented and windowed encodes coordinate several
+    ffmpeg processes from threads, so they run on the blocking executor; their
+    progress is passed back to the loop, and on cancellation each ffmpeg is
+    killed at its next progress update.
+
+    Args:
+        progress_callback (function, optional): Called on the loop with the
+            `run_ffmpeg` progress events
+
+    Raises:
+        RuntimeError: If FFmpeg fails to add the watermark
+    """
+    options = {'encoder_profile': encoder_profile} if encoder_profile else {}
+    if segments or workers or windows:
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+
+        def threaded_progress(event):
+            # Runs on the encode threads
+            if cancelled.is_set():
+                raise JobCancelled(input_file)
+            if progress_callback:
+                loop.call_soon_threadsafe(progress_callback, event)
+
+        try:
+            await run_blocking(
+                add_moving_watermark, input_file, output_file, watermark_text, video_codec=video_codec,
+                video_bitrate=video_bitrate, audio_file=audio_file, metadata_args=metadata_args, segments=segments,
+                workers=workers, threads_per_worker=threads_per_worker, engine=engine, windows=windows,
+                source_codec=source_codec, progress_callback=threaded_progress, scheduler=scheduler, **options
+            )
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return
+
+    engine = await run_blocking(choose_engine, engine, watermark_text)
+    duration = await run_blocking(probe_duration, input_file) if progress_callback else None
+    allocation = await acquire_encode_slots(scheduler, threads_per_worker)
+    try:
+        command = build_watermark_command(
+            input_file, output_file, watermark_text, video_codec, video_bitrate, audio_file, metadata_args,
+            engine, source_codec, threads=allocation.threads, **options
+        )
+        await run_ffmpeg_async(command, duration=duration, progress_callback=progress_callback,
+                               allocation=allocation)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to add watermark: {e}")
+    except asyncio.CancelledError:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    finally:
+        allocation.release()
+
+async def encode_stage_async(downloaded, watermark=True, watermark_text="LIMITLESS MEDIA", video_codec=None,
+                             watermark_options=None, progress_callback=None):
+    """
+    Async `downloader.encode_stage`, sharing its plan (`downloader.plan_encode`).
+
+    Returns:
+        str: Path of the finished video
+    """
+    plan = plan_encode(downloaded)
+    final_output = plan['final_output']
+
+    if watermark:
+        if video_codec is None:
+            video_codec = await run_blocking(select_video_codec, prefer_cpu=False)
+
+        last_progress, encode_progress = track_encode_progress(progress_callback)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        with span("watermark", video_id=get_video_id(downloaded['url']), encoder=video_codec) as timing:
+            await add_moving_watermark_async(
+                output_file=final_output,
+                watermark_text=watermark_text,
+                video_codec=video_codec,
+                progress_callback=encode_progress,
+                **plan['watermark_args'],
+                **(watermark_options or {})
+            )
+            record_encode(downloaded, final_output, last_progress, loop.time() - started, timing)
+    elif plan['separate_streams']:
+        await run_blocking(merge_streams, downloaded['video_file'], downloaded['audio_file'], final_output,
+                           downloaded['metadata_args'])
+    else:
+        os.rename(downloaded['merged_input'], final_output)
+        return final_output
+
+    remove_files(plan['temp_files'])
+    return final_output
+
+async def download_video_async(video_url, video_format_id, audio_format_id, output_path, watermark=True,
+                               watermark_text="LIMITLESS MEDIA", progress_callback=None, info=None,
+                               watermark_options=None, download_options=None, output_store=None):
+    """
+    Async `downloader.download_video`. Unlike the blocking version, errors
+    are raised rather than returned as False.
+
+    Cancelling the task kills a running ffmpeg and stops a running download
+    at its next progress update.
+
+    Args:
+        progress_callback (function, optional): Called on the loop with
+            {'type': 'progress', 'stage': 'download' or 'watermark', 'percent': ...};
+            watermark events also carry ffmpeg's fps, speed and eta.
+            `percent` covers the whole job, weighted as in `download_video`
+
+    See `downloader.download_video` for the other arguments.
+
+    Returns:
+        dict: {'output': path of the finished video, 'cached': True if it came from the output store}
+    """
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+
+    def report(event):
+        if progress_callback:
+            progress_callback(event)
+
+    if output_store:
+        key, output = await run_blocking(find_stored_output, output_store, video_url, video_format_id,
+                                         audio_format_id, output_path, info, watermark, watermark_text,
+                                         watermark_options)
+        if output:
+            report({'type': 'progress', 'stage': 'download', 'percent': 100.0})
+            return {'output': output, 'cached': True}
+
+    def download_progress(percentage):
+        # Runs on a download thread
+        if cancelled.is_set():
+            raise JobCancelled(video_url)
+        loop.call_soon_threadsafe(report, {'type': 'progress', 'stage': 'download',
+                                           'percent': job_percent('download', percentage, watermark)})
+
+    def encode_progress(event):
+        if event['percent'] is not None:
+            report({**event, 'type': 'progress', 'stage': 'watermark',
+                    'percent': job_percent('watermark', event['percent'], watermark)})
+
+    try:
+        # Watermarked videos skip the temporary merge; the watermark pass muxes the streams
+        downloaded = await run_blocking(
+            download_stage, video_url, video_format_id, audio_format_id, output_path,
+            progress_callback=download_progress, info=info, merge=not watermark, download_options=download_options
+        )
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    output = await encode_stage_async(downloaded, watermark=watermark, watermark_text=watermark_text,
+                                      watermark_options=watermark_options, progress_callback=encode_progress)
+    if output_store:
+        await run_blocking(output_store.put, key, output)
+    return {'output': output, 'cached': False}
+
+# Events after which a job sends nothing more
+TERMINAL_EVENTS = ('done', 'error', 'cancelled')
+
+class DownloadJob:
+    """
+    A download running as a task on the event loop, made by `start_download`.
+
+    Iterate it with `async for` to receive its events until it ends:
+        - {'type': 'progress', 'stage': ..., 'percent': ...} (see `download_video_async`)
+        - {'type': 'done', 'output': path, 'cached': bool}
+        - {'type': 'error', 'error': message}
+        - {'type': 'cancelled'}
+
+    Progress events are coalesced, so a slow consumer only sees the latest
+    one and a job nobody listens to does not pile them up. `cancel()` cancels
+    the task; `await job.result()` returns the `download_video_async` result.
+    """
+
+    def __init__(self, video_url):
+        self.video_url = video_url
+        self.task = None
+        self._pending = deque()
+        self._ready = asyncio.Event()
+
+    def _post(self, event):
+        if event['type'] == 'progress' and self._pending and self._pending[-1]['type'] == 'progress':
+            self._pending[-1] = event
+        else:
+            self._pending.append(event)
+        self._ready.set()
+
+    async def _run(self, coroutine):
+        try:
+            result = await coroutine
+        except asyncio.CancelledError:
+            self._post({'type': 'cancelled'})
+            raise
+        except Exception as e:
+            self._post({'type': 'error', 'error': str(e)})
+            raise
+        self._post({'type': 'done', **result})
+        return result
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        while True:
+            if not self._pending:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            event = self._pending.popleft()
+            yield event
+            if event['type'] in TERMINAL_EVENTS:
+                return
+
+    def cancel(self):
+        return self.task.cancel()
+
+    async def result(self):
+        return await self.task
+
+def start_download(video_url, video_format_id, audio_format_id, output_path, **options):
+    """
+    Starts `download_video_async` as a task on the running loop and returns
+    its `DownloadJob`. `options` are passed on to `download_video_async`.
+    """
+    job = DownloadJob(video_url)
+    job.task = asyncio.ensure_future(job._run(download_video_async(
+        video_url, video_format_id, audio_format_id, output_path, progress_callback=job._post, **options
+    )))
+    # The outcome is also delivered as an event, so an unawaited failure is not an error
+    job.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return job
@@ -0,0 +1,88 @@
+"""
+Compares aggregate watermark throughput for different job/thread splits.
+
+Watermarks several copies of a synthetic clip at once and reports the total
+frames per second across all of them:
+    - unscheduled: every ffmpeg picks its own thread count (the old behaviour)
+    - scheduled: the encode scheduler gives each job `threads` CPU slots out
+      of the budget, queueing jobs that do not fit
+
+    python benchmarks/bench_encode_scheduler.py --jobs 4 --splits 1x8 2x4 4x2 8x1
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_watermark_engines import make_test_clip
+from encode_scheduler import EncodeScheduler
+from watermark import add_moving_watermark
+
+def run_jobs(clip, work_dir, jobs, codec, scheduler=None, threads=None):
+    """
+    Watermarks `jobs` copies of the clip at once; returns the wall time.
+    """
+    def job(index):
+        output = os.path.join(work_dir, f"out_{index}.mp4")
+        add_moving_watermark(clip, output, "LIMITLESS MEDIA", video_codec=codec,
+                             threads_per_worker=threads, scheduler=scheduler)
+        os.remove(output)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(job, index) for index in range(jobs)]:
+            future.result()
+    return time.perf_counter() - start
+
+def parse_split(split):
+    concurrent, threads = split.lower().split("x")
+    return int(concurrent), int(threads)
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark encode scheduler job/thread splits")
+    parser.add_argument("--size", default="1280x720", help="Clip resolution (default: 1280x720)")
+    parser.add_argument("--rate", type=int, default=30, help="Clip frame rate (default: 30)")
+    parser.add_argument("--duration", type=int, default=10, help="Clip length in seconds (default: 10)")
+    parser.add_argument("--codec", default="libx264", help="Encoder passed to add_moving_watermark")
+    parser.add_argument("--jobs", type=int, default=4, help="Videos watermarked in each run (default: 4)")
+    parser.add_argument("--budget", type=int, default=cpu_count, help="CPU slots (default: CPU cores)")
+    parser.add_argument("--splits", nargs="+",
+                        default=[f"{n}x{max(1, cpu_count // n)}" for n in (1, 2, 4) if n <= cpu_count],
+                        help="Concurrent jobs x threads per job, e.g. 2x4")
+    parser.add_argument("--pin", action="store_true", help="Pin each ffmpeg process to its CPUs")
+    args = parser.parse_args()
+
+    frames = args.rate * args.duration * args.jobs
+    work_dir = tempfile.mkdtemp(prefix="bench_sched_")
+    try:
+        clip = os.path.join(work_dir, "clip.mp4")
+        make_test_clip(clip, args.size, args.rate, args.duration)
+
+        print(f"{args.jobs} jobs of {args.size} @ {args.rate} fps, {args.duration} s; budget {args.budget} slots")
+        print(f"{'split':<14} {'seconds':>8} {'total fps':>10}")
+
+        # Every job runs at once with a thread per core, as ffmpeg does on its own
+        unlimited = EncodeScheduler(cpu_budget=cpu_count * args.jobs, threads_per_job=cpu_count,
+                                    slot_dir=os.path.join(work_dir, "free"))
+        elapsed = run_jobs(clip, work_dir, args.jobs, args.codec, scheduler=unlimited, threads=cpu_count)
+        print(f"{'unscheduled':<14} {elapsed:>8.2f} {frames / elapsed:>10.1f}")
+
+        for split in args.splits:
+            concurrent, threads = parse_split(split)
+            scheduler = EncodeScheduler(
+                cpu_budget=min(args.budget, concurrent * threads), threads_per_job=threads, min_threads=threads,
+                pin=args.pin, slot_dir=os.path.join(work_dir, f"slots_{split}")
+            )
+            elapsed = run_jobs(clip, work_dir, args.jobs, args.codec, scheduler=scheduler, threads=threads)
+            print(f"{split:<14} {elapsed:>8.2f} {frames / elapsed:>10.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Offline end-to-end benchmark of resolving, downloading and watermarking.
+
+Nothing touches YouTube. A synthetic info provider stands in for yt_dlp and
+returns YouTube-shaped info dicts whose formats point at a local HTTP
+server. That server serves lavfi-generated AVC, VP9 and AAC streams with a
+per-connection bandwidth cap and a fixed latency. Each scenario runs the
+real `process_url` and `run_pipeline` against it:
+    - single / single-nowm: one video, with and without the watermark
+    - playlist-100 / playlist-100-nowm / playlist-1000: every entry is
+      resolved; the first --downloads entries are downloaded and encoded
+
+Reported per scenario: videos/hour, download MB/s per video, encode fps,
+resolved entries/s and peak RSS (Python process and ffmpeg children).
+Results are compared against the stored baseline.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --scenarios single playlist-100 --rate-kb 2048 --latency 0.1
+    python benchmarks/bench_pipeline.py --update-baseline
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_range_download import make_handler
+import downloader
+from downloader import configure_info_provider, get_video_id, process_url
+from format_policy import THROUGHPUT_FILE, choose_formats, configure_throughput_stats, get_policy
+from instrumentation import recorder
+from pipeline import run_pipeline
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.json")
+
+# entries: playlist length (1 = a single video URL), watermark: add the watermark
+SCENARIOS = {
+    'single': {'entries': 1, 'watermark': True},
+    'single-nowm': {'entries': 1, 'watermark': False},
+    'playlist-100': {'entries': 100, 'watermark': True},
+    'playlist-100-nowm': {'entries': 100, 'watermark': False},
+    'playlist-1000': {'entries': 1000, 'watermark': True},
+}
+
+# Metrics compared against the baseline, and whether higher is better
+METRICS = {
+    'videos_per_hour': True,
+    'download_mb_s': True,
+    'encode_fps': True,
+    'resolved_per_s': True,
+    'peak_rss_mb': False,
+}
+
+# YouTube's itags for video-only streams at each height
+AVC_ITAGS = {144: '160', 240: '133', 360: '134', 480: '135', 720: '136', 1080: '137', 1440: '264', 2160: '266'}
+VP9_ITAGS = {144: '278', 240: '242', 360: '243', 480: '244', 720: '247', 1080: '248', 1440: '271', 2160: '313'}
+
+def generate_media(work_dir, heights, rate, duration):
+    """
+    Encodes the synthetic streams with ffmpeg's lavfi sources.
+
+    Returns:
+        dict: (codec, height) -> file path, with (audio, None) for the audio
+            stream. VP9 is skipped if ffmpeg has no libvpx-vp9
+    """
+    media = {}
+    for height in heights:
+        size = f"{(height * 16 // 9) // 2 * 2}x{height}"
+        source = ["-f", "lavfi", "-i", f"testsrc2=size={size}:rate={rate}:duration={duration}"]
+        encodes = {
+            'avc': (["-c:v", "libx264", "-preset", "ultrafast", "-g", str(rate * 2)], "mp4"),
+            'vp9': (["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "0", "-crf", "40",
+                     "-g", str(rate * 2)], "webm"),
+        }
+        for codec, (options, ext) in encodes.items():
+            path = os.path.join(work_dir, f"{codec}_{height}.{ext}")
+            try:
+                subprocess.run(["ffmpeg", "-y", "-v", "error", *source, *options, "-an", path], check=True)
+            except subprocess.CalledProcessError:
+                print(f"Could not encode {codec} {height}p; leaving it out", file=sys.stderr)
+                continue
+            media[(codec, height)] = path
+
+    path = os.path.join(work_dir, "audio.m4a")
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                    "-c:a", "aac", "-b:a", "128k", "-vn", path], check=True)
+    media[('audio', None)] = path
+    return media
+
+class FakeInfoProvider:
+    """
+    Synthetic stand-in for yt_dlp (see `downloader.configure_info_provider`).
+
+    Every video gets the same YouTube-shaped info dict, including the
+    storyboard and muxed formats real extractions return. The stream URLs
+    point at the local media server. Playlist URLs of the form
+    `...playlist?list=BENCH<n>` expand to n entries.
+
+    Args:
+        base_url (str): Address of the local media server
+        media (dict): Result of `generate_media`
+        paths (dict): (codec, height) -> URL path on the server
+        duration (int): Stream length in seconds
+        rate (int): Frame rate of the video streams
+        extract_delay (float): Seconds each extraction takes, like a real yt_dlp round trip
+    """
+
+    def __init__(self, base_url, media, paths, duration, rate, extract_delay=0.0):
+        self.base_url = base_url
+        self.media = media
+        self.paths = paths
+        self.duration = duration
+        self.rate = rate
+        self.extract_delay = extract_delay
+
+    def _format(self, key, **fields):
+        size = os.path.getsize(self.media[key])
+        return {
+            'url': self.base_url + self.paths[key],
+            'protocol': 'http',
+            'filesize': size,
+            'tbr': round(size * 8 / 1000 / self.duration, 3),
+            'http_headers': {'User-Agent': 'bench', 'Accept': '*/*'},
+            **fields,
+        }
+
+    def formats(self):
+        formats = [{
+            'format_id': 'sb0', 'format_note': 'storyboard', 'ext': 'mhtml', 'protocol': 'mhtml',
+            'vcodec': 'none', 'acodec': 'none', 'url': self.base_url + "/storyboard", 'width': 160, 'height': 90,
+        }]
+        audio = self._format(('audio', None), format_id='140', format_note='medium', ext='m4a', acodec='mp4a.40.2',
+                             vcodec='none', abr=128, asr=44100, audio_channels=2, container='m4a_dash')
+        formats.append(audio)
+        for (codec, height) in sorted(key for key in self.media if key[0] != 'audio'):
+            width = (height * 16 // 9) // 2 * 2
+            common = {'width': width, 'height': height, 'fps': self.rate, 'acodec': 'none', 'dynamic_range': 'SDR',
+                      'format_note': f"{height}p", 'resolution': f"{width}x{height}"}
+            if codec == 'avc':
+                formats.append(self._format((codec, height), format_id=AVC_ITAGS.get(height, f"avc{height}"),
+                                            ext='mp4', vcodec='avc1.4d401f', container='mp4_dash', **common))
+            else:
+                formats.append(self._format((codec, height), format_id=VP9_ITAGS.get(height, f"vp9{height}"),
+                                            ext='webm', vcodec='vp09.00.31.08', container='webm_dash', **common))
+        lowest_avc = min((key for key in self.media if key[0] == 'avc'), default=None)
+        if lowest_avc:
+            # Muxed 360p format; never picked, since it carries audio
+            formats.append(self._format(lowest_avc, format_id='18', ext='mp4', vcodec='avc1.42001E',
+                                        acodec='mp4a.40.2', height=lowest_avc[1], fps=self.rate))
+        return formats
+
+    def extract_info(self, video_url):
+        if self.extract_delay:
+            time.sleep(self.extract_delay)
+        video_id = get_video_id(video_url)
+        return {
+            'id': video_id,
+            'title': f"Bench video {video_id}",
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'duration': self.duration,
+            'description': "Synthetic benchmark video. " * 80,
+            'tags': [f"tag{index}" for index in range(20)],
+            'thumbnails': [{'url': f"{self.base_url}/thumb/{index}.jpg", 'preference': index} for index in range(40)],
+            'formats': self.formats(),
+        }
+
+    def playlist_entries(self, playlist_url):
+        listing = parse_qs(urlparse(playlist_url).query).get('list', ['BENCH1'])[0]
+        count = int(listing[len("BENCH"):] or 1)
+        return [f"https://www.youtube.com/watch?v=bench{index:06d}" for index in range(count)]
+
+class RssSampler:
+    """
+    Tracks the peak resident set size of this process while it runs.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm", 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            if resource is None:
+                return 0
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+        return False
+
+def children_peak_rss_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((maxrss if sys.platform == "darwin" else maxrss * 1024) / 1024 / 1024, 1)
+
+def stage_delta(before, after, stage, key):
+    return after.get(stage, {}).get(key, 0) - before.get(stage, {}).get(key, 0)
+
+def run_scenario(name, scenario, args, output_dir):
+    """
+    Resolves and processes one scenario; returns its metrics.
+    """
+    if scenario['entries'] == 1:
+        url = "https://www.youtube.com/watch?v=bench000000"
+    else:
+        url = f"https://www.youtube.com/playlist?list=BENCH{scenario['entries']}"
+    watermark = scenario['watermark']
+    policy = get_policy(args.format_policy)
+    downloader.info_cache.clear()
+    totals_before = recorder.totals()
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        result = process_url(url, output_dir, watermark=watermark, max_workers=args.resolve_workers)
+        resolve_seconds = time.perf_counter() - started
+
+        jobs = []
+        for video in result['videos'][:args.downloads]:
+            video_format_id, audio_format_id = choose_formats(video['formats'], policy, duration=video['duration'],
+                                                              watermark=watermark)
+            jobs.append({
+                'url': video['url'], 'video_format_id': video_format_id, 'audio_format_id': audio_format_id,
+                'output_path': output_dir, 'watermark': watermark,
+                'watermark_options': {'engine': args.engine},
+                'download_options': {'connections': args.connections},
+            })
+
+        started = time.perf_counter()
+        results = run_pipeline(jobs, download_workers=args.download_workers, encode_workers=args.encode_workers)
+        pipeline_seconds = time.perf_counter() - started
+
+    failures = [r['error'] for r in results if not r['success']]
+    if failures:
+        raise RuntimeError(f"{name}: {len(failures)} videos failed, e.g. {failures[0]}")
+
+    totals_after = recorder.totals()
+    download_bytes = stage_delta(totals_before, totals_after, 'download', 'bytes')
+    download_seconds = stage_delta(totals_before, totals_after, 'download', 'wall_seconds')
+    encode_seconds = stage_delta(totals_before, totals_after, 'watermark', 'wall_seconds')
+    frames = sum(span.get('frames') or 0 for span in recorder.recent_spans('watermark')[-len(jobs):]) if watermark else 0
+    return {
+        'entries': len(result['videos']),
+        'videos': len(jobs),
+        'resolve_seconds': round(resolve_seconds, 3),
+        'pipeline_seconds': round(pipeline_seconds, 3),
+        'videos_per_hour': round(len(jobs) / pipeline_seconds * 3600, 1) if pipeline_seconds else None,
+        'download_mb_s': round(download_bytes / 1024 / 1024 / download_seconds, 2) if download_seconds else None,
+        'encode_fps': round(frames / encode_seconds, 1) if encode_seconds and frames else None,
+        'resolved_per_s': round(len(result['videos']) / resolve_seconds, 1) if resolve_seconds else None,
+        'peak_rss_mb': round(rss.peak / 1024 / 1024, 1),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each metric against the baseline; returns True if any regressed.
+    """
+    regressed = False
+    print(f"{'scenario':<18} {'metric':<16} {'value':>10} {'baseline':>10} {'change':>8}")
+    for name, metrics in results.items():
+        for metric, higher_is_better in METRICS.items():
+            value = metrics.get(metric)
+            if value is None:
+                continue
+            reference = (baseline or {}).get(name, {}).get(metric)
+            if not reference:
+                print(f"{name:<18} {metric:<16} {value:>10} {'-':>10} {'':>8}")
+                continue
+            change = (value - reference) / reference
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            regressed = regressed or worse
+            status = "  REGRESSION" if worse else ""
+            print(f"{name:<18} {metric:<16} {value:>10} {reference:>10} {change:>+8.1%}{status}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="Scenarios to run (default: all)")
+    parser.add_argument("--heights", type=int, nargs="+", default=[360, 720],
+                        help="Video heights to generate streams for (default: 360 720)")
+    parser.add_argument("--rate", type=int, default=30, help="Stream frame rate (default: 30)")
+    parser.add_argument("--duration", type=int, default=10, help="Stream length in seconds (default: 10)")
+    parser.add_argument("--rate-kb", type=int, default=4096, help="Per-connection limit in KB/s (default: 4096)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before each response (default: 0.05)")
+    parser.add_argument("--extract-ms", type=float, default=0, help="Simulated extraction time per video in ms")
+    parser.add_argument("--downloads", type=int, default=4,
+                        help="Playlist entries downloaded and encoded per scenario (default: 4)")
+    parser.add_argument("--format-policy", default="best", help="Format policy (default: best)")
+    parser.add_argument("--engine", default="drawtext", help="Watermark engine (default: drawtext)")
+    parser.add_argument("--connections", type=int, default=4, help="Connections per stream (default: 4)")
+    parser.add_argument("--resolve-workers", type=int, default=8, help="Playlist entries resolved at once")
+    parser.add_argument("--download-workers", type=int, default=2, help="Videos downloaded at once")
+    parser.add_argument("--encode-workers", type=int, default=1, help="Videos watermarked at once")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed change against the baseline (default: 0.15 = 15%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    server = None
+    try:
+        media = generate_media(work_dir, args.heights, args.rate, args.duration)
+        paths = {key: "/" + os.path.basename(path) for key, path in media.items()}
+        files = {}
+        for key, path in media.items():
+            with open(path, 'rb') as f:
+                files[paths[key]] = f.read()
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(files, args.rate_kb * 1024, args.latency))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        configure_info_provider(FakeInfoProvider(base_url, media, paths, args.duration, args.rate,
+                                                 extract_delay=args.extract_ms / 1000))
+        # Measurements against the throttled local server must not reach the
+        # user's stats, which rank real formats
+        configure_throughput_stats(stats_file=None)
+
+        results = {}
+        for name in args.scenarios:
+            output_dir = os.path.join(work_dir, "out", name)
+            os.makedirs(output_dir)
+            log = None if args.verbose else open(os.devnull, 'w')
+            try:
+                with contextlib.redirect_stdout(log or sys.stdout):
+                    results[name] = run_scenario(name, SCENARIOS[name], args, output_dir)
+            finally:
+                if log:
+                    log.close()
+            shutil.rmtree(output_dir, ignore_errors=True)
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    finally:
+        configure_info_provider(None)
+        configure_throughput_stats(THROUGHPUT_FILE)
+        if server:
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"ffmpeg peak RSS: {children_peak_rss_mb()} MB")
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        compare(results, None, args.tolerance)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+
+    baseline = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    return 1 if compare(results, baseline, args.tolerance) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Compares download strategies against a local throttled HTTP server.
+
+Starts a server on 127.0.0.1 that serves a random "video" and "audio" file,
+supports Range requests and caps every connection at a fixed rate, the way
+YouTube throttles single connections. Then times:
+    - one connection per stream, video then audio (the old behaviour)
+    - one connection per stream, both streams at once
+    - N connections per stream, both streams at once
+
+    python benchmarks/bench_range_download.py --rate-kb 512 --video-mb 16 --connections 1 4 8
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from range_downloader import download_ranges
+
+def make_handler(files, rate, latency):
+    """
+    Returns a request handler serving `files` (path -> bytes) at `rate` bytes
+    per second per connection, after `latency` seconds.
+    """
+    class ThrottledHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            data = files.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            start, end = 0, len(data) - 1
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+            time.sleep(latency)
+            block = max(1, rate // 20)  # 50 ms worth of data per write
+            position = start
+            try:
+                while position <= end:
+                    chunk = data[position:min(position + block, end + 1)]
+                    self.wfile.write(chunk)
+                    position += len(chunk)
+                    time.sleep(len(chunk) / rate)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return ThrottledHandler
+
+def fetch_streams(base_url, files, output_dir, connections, parallel, chunk_size):
+    """
+    Downloads every file and returns the elapsed seconds.
+    """
+    def fetch(path):
+        download_ranges(base_url + path, os.path.join(output_dir, path.strip("/")), len(files[path]),
+                        connections=connections, chunk_size=chunk_size)
+
+    started = time.perf_counter()
+    if parallel:
+        threads = [threading.Thread(target=fetch, args=(path,)) for path in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for path in files:
+            fetch(path)
+    elapsed = time.perf_counter() - started
+
+    for path, data in files.items():
+        with open(os.path.join(output_dir, path.strip("/")), 'rb') as f:
+            if f.read() != data:
+                raise RuntimeError(f"{path} was corrupted")
+        os.remove(os.path.join(output_dir, path.strip("/")))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ranged and parallel stream downloads")
+    parser.add_argument("--rate-kb", type=int, default=512, help="Per-connection limit in KB/s (default: 512)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before each response (default: 0.05)")
+    parser.add_argument("--video-mb", type=float, default=8, help="Video stream size in MB (default: 8)")
+    parser.add_argument("--audio-mb", type=float, default=1, help="Audio stream size in MB (default: 1)")
+    parser.add_argument("--chunk-mb", type=float, default=1, help="Range request size in MB (default: 1)")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8],
+                        help="Connections per stream to try (default: 1 4 8)")
+    args = parser.parse_args()
+
+    files = {
+        '/video.webm': os.urandom(int(args.video_mb * 1024 * 1024)),
+        '/audio.m4a': os.urandom(int(args.audio_mb * 1024 * 1024)),
+    }
+    total_mb = sum(len(data) for data in files.values()) / 1024 / 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(files, args.rate_kb * 1024, args.latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    output_dir = tempfile.mkdtemp(prefix="bench_range_")
+    chunk_size = int(args.chunk_mb * 1024 * 1024)
+    try:
+        runs = [("sequential streams", 1, False)]
+        runs += [("parallel streams", connections, True) for connections in args.connections]
+        print(f"{total_mb:.1f} MB at {args.rate_kb} KB/s per connection")
+        print(f"{'strategy':<20} {'connections':>11} {'seconds':>8} {'MB/s':>7}")
+        for name, connections, parallel in runs:
+            elapsed = fetch_streams(base_url, files, output_dir, connections, parallel, chunk_size)
+            print(f"{name:<20} {connections:>11} {elapsed:>8.2f} {total_mb / elapsed:>7.2f}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Measures cold-start time and fails if it regresses.
+
+Each measurement runs in a fresh interpreter:
+    - import time of downloader and cli (python -X importtime), and whether
+      they pull in yt_dlp eagerly (they must not)
+    - time until `cli.py --help` has printed
+    - time until the GUI window has appeared (needs a display)
+    - time until the first extraction could start: importing downloader,
+      loading yt_dlp and creating a YoutubeDL instance (no network)
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --update-baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+
+# Budgets in milliseconds, used when there is no baseline to compare against
+DEFAULT_BUDGETS_MS = {
+    'import_downloader': 150,
+    'import_cli': 200,
+    'cli_help': 500,
+    'first_window': 1500,
+    'first_extraction': 3000,
+}
+
+def run_timed(args, env=None, wait_for=None):
+    """
+    Runs a command from the repository root and returns the wall time in ms
+    until it exits (or prints `wait_for`), plus its stdout and stderr.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=REPO_DIR, env={**os.environ, **(env or {})},
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if wait_for:
+        for line in process.stdout:
+            if wait_for in line:
+                break
+        elapsed = (time.perf_counter() - start) * 1000
+        stdout, stderr = process.communicate()
+    else:
+        stdout, stderr = process.communicate()
+        elapsed = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed: {stderr.strip()[-500:]}")
+    return elapsed, stdout, stderr
+
+def measure_import(module):
+    """
+    Returns (cumulative import time in ms, whether yt_dlp was imported).
+    """
+    _, _, stderr = run_timed([sys.executable, "-X", "importtime", "-c", f"import {module}"])
+    cumulative_us = None
+    imported = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        name = parts[2]
+        imported.add(name.split(".")[0])
+        if name == module and parts[1].isdigit():
+            cumulative_us = int(parts[1])
+    return (cumulative_us or 0) / 1000, "yt_dlp" in imported
+
+def measure(runs):
+    results = {}
+    samples = {key: [] for key in DEFAULT_BUDGETS_MS}
+    eager_imports = []
+
+    for _ in range(runs):
+        for module in ("downloader", "cli"):
+            elapsed, eager = measure_import(module)
+            samples[f'import_{module}'].append(elapsed)
+            if eager:
+                eager_imports.append(module)
+
+        samples['cli_help'].append(run_timed([sys.executable, "cli.py", "--help"])[0])
+
+        try:
+            samples['first_window'].append(run_timed(
+                [sys.executable, "main.py"], env={"YTDWM_EXIT_AFTER_STARTUP": "1"}, wait_for="window-shown"
+            )[0])
+        except RuntimeError as e:
+            print(f"Skipping first_window: {e}", file=sys.stderr)
+
+        try:
+            samples['first_extraction'].append(run_timed([
+                sys.executable, "-c",
+                "import downloader; downloader.load_yt_dlp()({'quiet': True})"
+            ])[0])
+        except RuntimeError as e:
+            print(f"Skipping first_extraction: {e}", file=sys.stderr)
+
+    for key, values in samples.items():
+        if values:
+            results[key] = round(statistics.median(values), 1)
+    return results, sorted(set(eager_imports))
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement; the median is used")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    args = parser.parse_args()
+
+    results, eager_imports = measure(args.runs)
+
+    baseline = None
+    if os.path.exists(BASELINE_FILE) and not args.update_baseline:
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    failed = False
+    print(f"{'measurement':<18} {'median ms':>10} {'limit ms':>10}")
+    for key, value in results.items():
+        limit = baseline[key] * (1 + args.tolerance) if baseline and key in baseline else DEFAULT_BUDGETS_MS[key]
+        status = "" if value <= limit else "  REGRESSION"
+        failed = failed or bool(status)
+        print(f"{key:<18} {value:>10.1f} {limit:>10.1f}{status}")
+
+    if eager_imports:
+        print(f"yt_dlp is imported eagerly by: {', '.join(eager_imports)}")
+        failed = True
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Compares watermark engines on a synthetic clip.
+
+Generates a test clip with ffmpeg's lavfi `testsrc2` source, watermarks it
+with each engine and prints the frames per second each one reaches.
+
+    python benchmarks/bench_watermark_engines.py --size 1920x1080 --duration 20
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watermark import WATERMARK_ENGINES, add_moving_watermark
+
+def make_test_clip(path, size, rate, duration):
+    """
+    Writes a synthetic H.264 clip with a sine-wave audio track.
+    """
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={rate}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", str(rate * 2),
+        "-c:a", "aac",
+        path
+    ]
+    subprocess.run(command, check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark watermark engines")
+    parser.add_argument("--size", default="1280x720", help="Clip resolution (default: 1280x720)")
+    parser.add_argument("--rate", type=int, default=30, help="Clip frame rate (default: 30)")
+    parser.add_argument("--duration", type=int, default=10, help="Clip length in seconds (default: 10)")
+    parser.add_argument("--codec", default="libx264", help="Encoder passed to add_moving_watermark")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per engine; the best is reported")
+    args = parser.parse_args()
+
+    frames = args.rate * args.duration
+    work_dir = tempfile.mkdtemp(prefix="bench_wm_")
+    try:
+        clip = os.path.join(work_dir, "clip.mp4")
+        make_test_clip(clip, args.size, args.rate, args.duration)
+
+        print(f"Clip: {args.size} @ {args.rate} fps, {args.duration} s ({frames} frames)")
+        print(f"{'engine':<10} {'best s':>8} {'fps':>8}")
+        for engine in WATERMARK_ENGINES:
+            timings = []
+            for run in range(args.runs):
+                output = os.path.join(work_dir, f"{engine}_{run}.mp4")
+                start = time.perf_counter()
+                add_moving_watermark(clip, output, "LIMITLESS MEDIA", video_codec=args.codec, engine=engine)
+                timings.append(time.perf_counter() - start)
+                os.remove(output)
+            best = min(timings)
+            print(f"{engine:<10} {best:>8.2f} {frames / best:>8.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from downloader import get_playlist_entries, get_video_id, is_playlist, resolve_video
+from encode_scheduler import DEFAULT_CONCURRENT_JOBS, configure_encode_scheduler
+from encoder_policy import DEFAULT_PROFILE, ENCODER_PROFILES
+from format_policy import FORMAT_POLICIES, choose_formats, get_policy
+from instrumentation import configure_instrumentation, recorder
+from journal import JobJournal
+from output_store import DEFAULT_MAX_BYTES, OUTPUT_STORE_DIR, OutputStore
+from range_downloader import DEFAULT_DOWNLOAD_OPTIONS
+from pipeline import run_pipeline
+from sync_archive import SyncArchive, get_playlist_id, settings_key
+from watermark import WATERMARK_ENGINES
+
+# Headless batch entry point. Nothing here may import tkinter, so it runs on
+# servers, under cron and in containers.
+
+def read_urls(urls, input_file=None):
+    """
+    Returns the URLs given on the command line followed by those in input_file
+    (one per line, blank lines and # comments ignored, "-" reads stdin).
+    """
+    collected = list(urls)
+    if input_file:
+        handle = sys.stdin if input_file == "-" else open(input_file, 'r', encoding='utf-8')
+        try:
+            for line in handle:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    collected.append(line)
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+    return collected
+
+class ResultWriter:
+    """
+    Writes one JSON object per line, flushed immediately; safe to call from worker threads.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Download and watermark YouTube videos and playlists without the GUI. "
+                    "Writes one JSON result per video."
+    )
+    parser.add_argument("urls", nargs="*", help="Video or playlist URLs")
+    parser.add_argument("-i", "--input-file", help="File with one URL per line ('-' for stdin)")
+    parser.add_argument("-o", "--output-dir", default="Videos", help="Folder for finished videos (default: Videos)")
+    parser.add_argument("--watermark-text", default="LIMITLESS MEDIA", help="Watermark text")
+    parser.add_argument("--no-watermark", action="store_true", help="Download without watermarking")
+    parser.add_argument("--watermark-engine", choices=WATERMARK_ENGINES, default="drawtext")
+    parser.add_argument("--encoder-profile", choices=ENCODER_PROFILES, default=DEFAULT_PROFILE)
+    parser.add_argument("--format-policy", choices=sorted(FORMAT_POLICIES), default="best",
+                        help="How the video format is picked (default: best)")
+    parser.add_argument("--max-minutes", type=float,
+                        help="Pick formats whose estimated download and watermark time fits this budget")
+    parser.add_argument("--max-mb", type=float, help="Pick formats whose download fits this size")
+    parser.add_argument("--resolve-workers", type=int, default=8, help="URLs and playlist entries resolved at once")
+    parser.add_argument("--download-workers", type=int, default=2, help="Videos downloaded at once")
+    parser.add_argument("--encode-workers", type=int, default=1, help="Videos watermarked at once")
+    parser.add_argument("--cpu-budget", type=int,
+                        help="CPU slots shared by all encodes on this machine (default: CPU cores)")
+    parser.add_argument("--encode-threads", type=int, help="CPU slots each encode asks for (default: an equal share of the budget)")
+    parser.add_argument("--pin-encodes", action="store_true", help="Pin each ffmpeg process to its CPU slots")
+    parser.add_argument("--encode-nice", type=int, help="Niceness increment for ffmpeg processes")
+    parser.add_argument("--connections", type=int, default=DEFAULT_DOWNLOAD_OPTIONS['connections'],
+                        help="HTTP connections per stream for ranged downloads")
+    parser.add_argument("--results", help="Write JSON-lines results here instead of stdout")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="Do not record progress in the output folder's job journal")
+    parser.add_argument("--metrics", help="Append per-video, per-stage timing spans to this JSON-lines file")
+    parser.add_argument("--prometheus", help="Write per-stage totals in Prometheus text format here when done")
+    parser.add_argument("--profile", help="Profile the Python side with cProfile and write the stats here")
+    parser.add_argument("--sync", action="store_true",
+                        help="Only download playlist videos not yet delivered with these watermark settings")
+    parser.add_argument("--archive", help="Sync archive file (default: .sync_archive.sqlite3 in the output folder)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not reuse or keep finished videos in the output store")
+    parser.add_argument("--store-dir", default=OUTPUT_STORE_DIR, help="Output store folder")
+    parser.add_argument("--store-max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3,
+                        help="Evict the least recently used videos beyond this size")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    urls = read_urls(args.urls, args.input_file)
+    if not urls:
+        print("No URLs given.", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    configure_instrumentation(jsonl_path=args.metrics, profile=bool(args.profile))
+    results_stream = open(args.results, 'a', encoding='utf-8') if args.results else sys.stdout
+    try:
+        # Log output goes to stderr so stdout only carries JSON lines
+        with contextlib.redirect_stdout(sys.stderr):
+            return run_batch(args, urls, ResultWriter(results_stream))
+    finally:
+        if results_stream is not sys.stdout:
+            results_stream.close()
+        if args.prometheus:
+            recorder.write_prometheus(args.prometheus)
+        if args.profile and not recorder.write_profile(args.profile):
+            print("Nothing was profiled.", file=sys.stderr)
+
+def sync_playlist(url, archive, key, writer):
+    """
+    Diffs a playlist's flat listing against the sync archive and reports what
+    was added, changed and removed.
+
+    Returns:
+        list: The flat entries of the videos that are due, in playlist order,
+            each tagged with its 'playlist_id'. An unchanged playlist returns
+            nothing, so nothing is resolved.
+    """
+    playlist_id = get_playlist_id(url)
+    entries = [{**entry, 'video_id': get_video_id(entry['url'])} for entry in get_playlist_entries(url)]
+    diff = archive.diff(playlist_id, entries, key)
+    archive.update_members(playlist_id, entries)
+    writer.write({
+        'url': url,
+        'playlist_id': playlist_id,
+        'status': 'sync',
+        'added': [entry['video_id'] for entry in diff['added']],
+        'changed': [entry['video_id'] for entry in diff['changed']],
+        'removed': [entry['video_id'] for entry in diff['removed']],
+        'unchanged': len(diff['unchanged']),
+    })
+
+    due_ids = {entry['video_id'] for entry in diff['added'] + diff['changed']}
+    return [{**entry, 'playlist_id': playlist_id} for entry in entries if entry['video_id'] in due_ids]
+
+def run_batch(args, urls, writer):
+    """
+    Resolves, downloads and watermarks every URL, writing one result per video.
+
+    Returns:
+        int: Process exit code, 1 if any video failed
+    """
+    watermark = not args.no_watermark
+    configure_encode_scheduler(cpu_budget=args.cpu_budget, threads_per_job=args.encode_threads,
+                               pin=args.pin_encodes, nice=args.encode_nice,
+                               concurrent_jobs=max(args.encode_workers, DEFAULT_CONCURRENT_JOBS))
+    policy = get_policy(args.format_policy, max_minutes=args.max_minutes, max_mb=args.max_mb)
+    watermark_options = {'engine': args.watermark_engine, 'encoder_profile': args.encoder_profile}
+    failures = 0
+
+    archive = None
+    if args.sync:
+        archive = SyncArchive(args.archive) if args.archive else SyncArchive.for_output_dir(args.output_dir)
+        sync_key = settings_key(watermark, args.watermark_text, watermark_options)
+
+    def list_videos(url):
+        """
+        Returns (video URL, playlist ID) pairs for a URL without resolving them.
+        """
+        if not is_playlist(url):
+            return [(url, None)]
+        if archive:
+            return [(entry['url'], entry['playlist_id']) for entry in sync_playlist(url, archive, sync_key, writer)]
+        return [(entry['url'], None) for entry in get_playlist_entries(url)]
+
+    def make_job(video, playlist_id):
+        """
+        Returns the download job for a resolved video, or None after reporting why it is unusable.
+        """
+        nonlocal failures
+        record = {'url': video['url'], 'video_id': get_video_id(video['url']), 'title': video['title']}
+        if video['status'] != 'ready' or not video['formats']:
+            writer.write({**record, 'status': 'failed', 'error': video['status']})
+            failures += 1
+            return None
+        try:
+            video_format_id, audio_format_id = choose_formats(
+                video['formats'], policy, duration=video.get('duration'), watermark=watermark
+            )
+        except Exception as e:
+            writer.write({**record, 'status': 'failed', 'error': f"No usable formats: {e}"})
+            failures += 1
+            return None
+        return {
+            'url': video['url'],
+            'title': video['title'],
+            'video_format_id': video_format_id,
+            'audio_format_id': audio_format_id,
+            'output_path': args.output_dir,
+            'watermark': watermark,
+            'watermark_text': args.watermark_text,
+            'watermark_options': watermark_options,
+            'download_options': {'connections': args.connections},
+            'playlist_id': playlist_id,
+        }
+
+    # Jobs in the order the pipeline received them, so pipeline indexes point in here
+    jobs = []
+
+    def resolve_jobs():
+        """
+        Yields download jobs as their videos resolve.
+
+        Playlists are listed and every video resolved in one shared pool, and
+        each job goes to the pipeline as soon as it is ready, so the first
+        downloads start while the rest of the batch is still resolving.
+        """
+        nonlocal failures
+        with ThreadPoolExecutor(max_workers=max(1, args.resolve_workers)) as executor:
+            pending = {executor.submit(list_videos, url): ('list', url) for url in urls}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, value = pending.pop(future)
+                    if kind == 'resolve':
+                        job = make_job(future.result(), value)
+                        if job:
+                            jobs.append(job)
+                            yield job
+                        continue
+                    try:
+                        videos = future.result()
+                    except Exception as e:
+                        writer.write({'url': value, 'status': 'failed', 'error': str(e)})
+                        failures += 1
+                        continue
+                    for video_url, playlist_id in videos:
+                        pending[executor.submit(resolve_video, video_url)] = ('resolve', playlist_id)
+
+    def report(event):
+        nonlocal failures
+        if event['type'] in ('video_downloaded', 'video_progress'):
+            return
+        job = jobs[event['index']]
+        result = event['result']
+        status = {'video_done': 'done', 'video_skipped': 'skipped', 'video_failed': 'failed'}[event['type']]
+        if result.get('cached'):
+            status = 'cached'
+        if status == 'failed':
+            failures += 1
+        elif archive and job['playlist_id']:
+            archive.record_delivered(job['playlist_id'], get_video_id(job['url']), sync_key, job['url'],
+                                     job['title'], result['output'])
+        writer.write({
+            'url': job['url'],
+            'video_id': get_video_id(job['url']),
+            'title': job['title'],
+            'status': status,
+            'video_format_id': job['video_format_id'],
+            'audio_format_id': job['audio_format_id'],
+            'output': result['output'],
+            'error': result['error'],
+        })
+
+    journal = None if args.no_journal else JobJournal(args.output_dir)
+    output_store = None if args.no_store else OutputStore(args.store_dir, int(args.store_max_gb * 1024 ** 3))
+    try:
+        run_pipeline(resolve_jobs(), download_workers=args.download_workers, encode_workers=args.encode_workers,
+                     progress_callback=report, journal=journal, output_store=output_store)
+    finally:
+        if journal:
+            journal.close()
+        if output_store:
+            output_store.close()
+        if archive:
+            archive.close()
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,240 @@
-from yt_dlp import YoutubeDL
 import subprocess
 import os
 import re
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from watermark import add_moving_watermark
+from ffmpeg_caps import encoder_works
+from format_policy import get_throughput_stats
+from instrumentation import span
+from output_store import store_key
+from range_downloader import build_ydl_tuning, download_ranges, resolve_download_options, supports_ranges
 import time
 
 
+# yt_dlp pulls in hundreds of extractor modules, so it is only imported when
+# first needed (or warmed up in the background) to keep startup fast
+_YoutubeDL = None
+_yt_dlp_lock = threading.Lock()
+
+def load_yt_dlp():
+    """
+    Imports yt_dlp on first use and returns its YoutubeDL class.
+    """
+    global _YoutubeDL
+    with _yt_dlp_lock:
+        if _YoutubeDL is None:
+            from yt_dlp import YoutubeDL
+            _YoutubeDL = YoutubeDL
+        return _YoutubeDL
+
+def warm_up_yt_dlp():
+    """
+    Starts importing yt_dlp on a background thread so the first extraction
+    does not pay for it.
+    """
+    thread = threading.Thread(target=load_yt_dlp, daemon=True)
+    thread.start()
+    return thread
+
 #another url longer https://youtu.be/CdTtTCK2EPU?feature=shared
 # playlist url https://www.youtube.com/playlist?list=PLEIVUdJziotqs7DrYItyA-xhI07-1AJFx
 # or https://www.youtube.com/playlist?list=PLHc88y3ww4WCWc4kcXdQkEyo7zoGj7_uh
 #testing url https://youtu.be/wpJnigMKFmQ?feature=shared
 
+# Patterns used to pull the 11 character video ID out of the URL shapes we accept
+VIDEO_ID_PATTERNS = [
+    r'[?&]v=([0-9A-Za-z_-]{11})',                  # youtube.com/watch?v=ID
+    r'youtu\.be/([0-9A-Za-z_-]{11})',              # youtu.be/ID
+    r'youtube\.com/(?:shorts|embed|live|v)/([0-9A-Za-z_-]{11})',
+]
+
+def get_video_id(video_url):
+    """
+    Returns the canonical YouTube video ID for a URL.
+
+    Args:
+        video_url (str): YouTube video URL (or a bare video ID)
+
+    Returns:
+        str: The video ID, or the URL itself if no ID could be found
+    """
+    for pattern in VIDEO_ID_PATTERNS:
+        match = re.search(pattern, video_url)
+        if match:
+            return match.group(1)
+    return video_url
+
+class InfoCache:
+    """
+    Thread-safe cache of yt_dlp info dicts keyed by canonical video ID.
+
+    Entries expire after `ttl` seconds (YouTube stream URLs stop working after a
+    few hours) and the least recently used entry is evicted once `max_entries`
+    is reached. If `cache_dir` is set, entries are also written there as JSON so
+    they survive restarts.
+    """
+
+    def __init__(self, ttl=3600, max_entries=512, cache_dir=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()  # video_id -> (stored_at, info)
+        self._lock = threading.Lock()
+        self._key_locks = {}  # video_id -> lock, so one ID is only extracted once at a time
+
+    def _disk_path(self, video_id):
+        name = hashlib.sha1(video_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _read_disk(self, video_id):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(video_id), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry['stored_at'], entry['info']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, video_id, stored_at, info):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._disk_path(video_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'stored_at': stored_at, 'info': info}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write info cache entry for {video_id}: {e}")
+
+    def get(self, video_id):
+        """
+        Returns the cached info dict for a video ID, or None if missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(video_id)
+                return entry[1]
+            self._entries.pop(video_id, None)
+
+        entry = self._read_disk(video_id)
+        if entry and now - entry[0] < self.ttl:
+            self._store(video_id, entry[0], entry[1])
+            return entry[1]
+        return None
+
+    def put(self, video_id, info):
+        """
+        Stores an info dict under a video ID.
+        """
+        stored_at = time.time()
+        self._store(video_id, stored_at, info)
+        self._write_disk(video_id, stored_at, info)
+
+    def _store(self, video_id, stored_at, info):
+        with self._lock:
+            self._entries[video_id] = (stored_at, info)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def key_lock(self, video_id):
+        """
+        Returns the lock that serialises extraction of a single video ID.
+        """
+        with self._lock:
+            return self._key_locks.setdefault(video_id, threading.Lock())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+# Shared cache used by every extraction in this module
+info_cache = InfoCache()
+
+def configure_info_cache(ttl=3600, max_entries=512, cache_dir=None):
+    """
+    Replaces the shared info cache, e.g. to enable the on-disk store.
+
+    Args:
+        ttl (int): Seconds an entry stays valid
+        max_entries (int): Entries kept in memory before LRU eviction
+        cache_dir (str, optional): Directory for the on-disk backing store
+    """
+    global info_cache
+    info_cache = InfoCache(ttl=ttl, max_entries=max_entries, cache_dir=cache_dir)
+    return info_cache
+
+# Stand-in for yt_dlp's extraction, e.g. the synthetic provider the offline
+# benchmarks use. None extracts with yt_dlp.
+_info_provider = None
+
+def configure_info_provider(provider=None):
+    """
+    Replaces yt_dlp as the source of video info and playlist entries.
+
+    Args:
+        provider (object, optional): Has `extract_info(video_url)`, returning a
+            yt_dlp-style info dict, and `playlist_entries(playlist_url)`,
+            returning the entries' video URLs. None goes back to yt_dlp.
+    """
+    global _info_provider
+    _info_provider = provider
+    return provider
+
+def get_video_info(video_url):
+    """
+    Returns the full yt_dlp info dict for a video, extracting it at most once
+    per cache lifetime.
+
+    Args:
+        video_url (str): YouTube video URL
+
+    Returns:
+        dict: yt_dlp info dict
+
+    Raises:
+        Exception: If yt_dlp fails to extract the video
+    """
+    video_id = get_video_id(video_url)
+    info = info_cache.get(video_id)
+    if info is not None:
+        return info
+
+    with info_cache.key_lock(video_id):
+        # Another thread may have finished extracting while we waited
+        info = info_cache.get(video_id)
+        if info is not None:
+            return info
+
+        with span("extract_info", video_id=video_id):
+            if _info_provider:
+                info = _info_provider.extract_info(video_url)
+            else:
+                with load_yt_dlp()({'quiet': True}) as ydl:
+                    info = ydl.sanitize_info(ydl.extract_info(video_url, download=False))
+        if not info:
+            raise ValueError(f"Could not extract video information for {video_url}")
+        info_cache.put(video_id, info)
+        return info
+
 def extract_video_info(video_url):
     """
     Extracts video information and formats using yt_dlp.
     """
     try:
-        with YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            return info.get('formats', [])
+        info = get_video_info(video_url)
+        return info.get('formats', [])
     except Exception as e:
         print(f"An error occurred while extracting info: {e}")
         return None
@@ -58,7 +274,8 @@ def get_best_video_format(formats):
 def filter_matching_video_formats(formats, best_video):
     """
     Filters video formats matching the best video's FPS and codec.
-    Excludes formats with audio and formats without a file size.
+    Excludes formats with audio and formats with neither a file size nor an
+    approximate one.
     """
     matching_formats = [
         f for f in formats
@@ -69,7 +286,7 @@ def filter_matching_video_formats(formats, best_video):
                if best_video.get('vcodec', '').lower().startswith("vp")
                else "avc1" in f.get('vcodec', '').lower()  # Match avc1 codec
            ) and
-           f.get('filesize') is not None  # Ensure file size exists
+           (f.get('filesize') or f.get('filesize_approx')) is not None  # Ensure a (possibly approximate) size exists
     ]
     return matching_formats
 
@@ -96,15 +313,17 @@ def is_playlist(url):
     # Check if URL matches any playlist pattern
     return any(re.search(pattern, url_lower) for pattern in playlist_patterns)
 
-def get_playlist_urls(playlist_url):
+def get_playlist_entries(playlist_url):
     """
-    Extract URLs of all videos in a playlist.
-    
+    Lists a playlist's videos with a single flat extraction: URL, plus the
+    title and duration where the playlist page provides them. No formats
+    are resolved.
+
     Args:
         playlist_url (str): URL of the YouTube playlist
-        
+
     Returns:
-        list: List of video URLs in the playlist
+        list: Dictionaries with url, title and duration (None when unknown)
     """
     ydl_opts = {
         'extract_flat': True,  # Don't download videos, just get metadata
@@ -112,27 +331,51 @@ def get_playlist_urls(playlist_url):
         'no_warnings': True,
         'ignoreerrors': True,  # Skip unavailable videos
     }
-    
+
+    if _info_provider:
+        with span("playlist_expand", url=playlist_url) as timing:
+            entries = [
+                entry if isinstance(entry, dict) else {'url': entry, 'title': None, 'duration': None}
+                for entry in _info_provider.playlist_entries(playlist_url)
+            ]
+            timing.set(entries=len(entries))
+        return entries
+
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        with span("playlist_expand", url=playlist_url) as timing, load_yt_dlp()(ydl_opts) as ydl:
             playlist_info = ydl.extract_info(playlist_url, download=False)
             
             if not playlist_info:
                 raise ValueError("Could not extract playlist information")
             
-            # Extract just the video URLs
-            video_urls = []
+            entries = []
             for entry in playlist_info['entries']:
                 if entry and entry.get('url') or entry.get('webpage_url'):
                     # Prefer direct URL if available, fallback to webpage_url
-                    url = entry.get('url') or entry.get('webpage_url')
-                    video_urls.append(url)
+                    entries.append({
+                        'url': entry.get('url') or entry.get('webpage_url'),
+                        'title': entry.get('title'),
+                        'duration': entry.get('duration'),
+                    })
             
-            return video_urls
+            timing.set(entries=len(entries))
+            return entries
             
     except Exception as e:
         raise Exception(f"Error extracting playlist URLs: {str(e)}")
 
+def get_playlist_urls(playlist_url):
+    """
+    Extract URLs of all videos in a playlist.
+    
+    Args:
+        playlist_url (str): URL of the YouTube playlist
+        
+    Returns:
+        list: List of video URLs in the playlist
+    """
+    return [entry['url'] for entry in get_playlist_entries(playlist_url)]
+
 def get_video_formats(video_url):
     """
     Extracts video formats for a given video URL.
@@ -144,19 +387,11 @@ def get_video_formats(video_url):
         raise Exception(f"Error extracting video formats: {str(e)}")
 
 def is_encoder_available(encoder):
-    try:
-        result = subprocess.run(['ffmpeg', '-encoders'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        encoders_list = result.stdout.decode('utf-8')
-        
-        # Print the list of available encoders
-        #print(encoders_list)
-        
-        # Pause execution until the user presses Enter
-        #input("Press Enter to continue...")
-        
-        return encoder in encoders_list
-    except FileNotFoundError:
-        return False
+    """
+    Returns True if ffmpeg has the encoder and a short test encode with it succeeds.
+    ffmpeg is only probed once per process (see `ffmpeg_caps`).
+    """
+    return encoder_works(encoder)
 
 def select_video_codec(prefer_cpu=False):
     if prefer_cpu:
@@ -181,95 +416,432 @@ def select_video_codec(prefer_cpu=False):
     # Default to CPU if no GPU is available
     return 'libx264'
 
-def download_video(video_url, video_format_id, audio_format_id, output_path, watermark=True, watermark_text="LIMITLESS MEDIA", progress_callback=None):
+def get_output_file(output_path, info):
     """
-    Downloads the selected video and audio formats, merges them, applies a watermark if enabled,
-    and removes the temporary merged file after successfully creating the watermarked file.
-    Also adds audio bitrate metadata to the output file.
+    Returns the path the finished video for an info dict is written to.
     """
-    try:
-        # Progress hook function for yt_dlp
-        def progress_hook(d):
-            if d['status'] == 'downloading':
-                downloaded_bytes = d.get('downloaded_bytes', 0)
-                total_bytes = d.get('total_bytes', 1)
-                percentage = (downloaded_bytes / total_bytes) * 100
-                if progress_callback:
-                    progress_callback(percentage)  # Update the progress bar
-            elif d['status'] == 'finished':
-                if progress_callback:
-                    progress_callback(100)  # Ensure progress reaches 100% at the end
+    video_title = info.get('title', 'downloaded_video').replace("/", "_")  # Prevent invalid filename characters
+    return os.path.join(output_path, f"{video_title}.mp4")
 
-        # Extract video properties
-        with YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            video_format = next(f for f in info['formats'] if f['format_id'] == video_format_id)
-            audio_format = next(f for f in info['formats'] if f['format_id'] == audio_format_id)
+def build_metadata_args(video_title, video_bitrate, audio_bitrate):
+    """
+    Returns the ffmpeg output options that tag the file and its streams with
+    their bitrates and replace any metadata carried over from the source.
+    """
+    return [
+        # Add metadata during merge
+        '-metadata', f'audio_bitrate={audio_bitrate}kbps',
+        '-metadata', f'video_bitrate={video_bitrate}kbps',
+        '-metadata', f'description=Video Bitrate: {video_bitrate}kbps, Audio Bitrate: {audio_bitrate}kbps',
+        # Add metadata specifically to audio stream
+        '-metadata:s:a:0', f'title={video_title} audio',
+        '-metadata:s:a:0', f'bitrate={audio_bitrate}',
+        # Add metadata specifically to video stream
+        '-metadata:s:v:0', f'title={video_title} video',
+        '-metadata:s:v:0', f'bitrate={video_bitrate}',
+        # Clear any existing metadata that might interfere
+        '-map_metadata', '-1'
+    ]
 
-        video_title = info.get('title', 'downloaded_video').replace("/", "_")  # Prevent invalid filename characters
-        video_codec = select_video_codec(prefer_cpu=False)
-        print(f'Selected video codec: {video_codec}')
-        print("-------------------------------------------------")
-        video_bitrate = video_format.get('tbr', 0)
-        audio_bitrate = audio_format.get('abr', 0)  # Get audio bitrate for metadata
+def download_stage(video_url, video_format_id, audio_format_id, output_path, progress_callback=None, info=None, merge=True,
+                   download_options=None):
+    """
+    First pipeline stage: downloads the selected video and audio formats.
 
-        # File paths
-        output_filename = os.path.basename(output_path)
-        output_dir = os.path.dirname(output_path)
-        merged_input = os.path.join(output_dir, f"{video_title}_temp.mp4")  # Temporary merged video
-        output_watermarked = os.path.join(output_path, f"{video_title}.mp4")
+    The two streams are fetched at the same time. Plain HTTP formats with a
+    known size go through the range downloader over several connections;
+    everything else goes through yt_dlp with parallel fragments and chunked
+    requests. With `merge=True` the streams are then muxed into a temporary
+    file, adding bitrate metadata on the way. With `merge=False` they are kept
+    as separate files so the watermark pass can read them directly and mux
+    them itself, which avoids writing a full-size merged copy first.
+
+    Args:
+        video_url (str): YouTube video URL
+        video_format_id (str): Format ID of the video stream
+        audio_format_id (str): Format ID of the audio stream
+        output_path (str): Directory the finished video will be written to
+        progress_callback (function, optional): Called with the download percentage
+        info (dict, optional): Info dict already resolved by `get_video_info`
+        merge (bool): Merge the streams into one temporary file
+        download_options (dict, optional): Per-job overrides of
+            `range_downloader.DEFAULT_DOWNLOAD_OPTIONS`, e.g. {'connections': 8}
+
+    Returns:
+        dict: Download result handed to `encode_stage`, with the video title,
+            downloaded file(s), final output directory, stream bitrates and
+            the metadata options for the final file
+
+    Raises:
+        Exception: If the formats cannot be found or yt_dlp fails to download
+    """
+    # Extract video properties
+    if info is None:
+        info = get_video_info(video_url)
+    video_format = next(f for f in info['formats'] if f['format_id'] == video_format_id)
+    audio_format = next(f for f in info['formats'] if f['format_id'] == audio_format_id)
+
+    # Both streams count towards one percentage, weighted by their size
+    expected_bytes = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in (video_format, audio_format))
+    stream_bytes = {}  # filename -> (downloaded, total)
+    stream_lock = threading.Lock()  # Both streams report at the same time
+
+    # Progress hook function for yt_dlp
+    def progress_hook(d):
+        if not progress_callback:
+            return
+        if d['status'] == 'downloading':
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 1
+            with stream_lock:
+                stream_bytes[d.get('filename')] = (d.get('downloaded_bytes', 0), total_bytes)
+                downloaded_bytes = sum(done for done, _ in stream_bytes.values())
+                total = max(expected_bytes, sum(size for _, size in stream_bytes.values()))
+            percentage = min(100.0, (downloaded_bytes / total) * 100)
+            progress_callback(percentage)  # Update the progress bar
+        elif d['status'] == 'finished':
+            size = d.get('total_bytes') or d.get('downloaded_bytes', 0)
+            with stream_lock:
+                stream_bytes[d.get('filename')] = (size, size)
+
+    video_title = info.get('title', 'downloaded_video').replace("/", "_")  # Prevent invalid filename characters
+    video_bitrate = video_format.get('tbr', 0)
+    audio_bitrate = audio_format.get('abr', 0)  # Get audio bitrate for metadata
+    metadata_args = build_metadata_args(video_title, video_bitrate, audio_bitrate)
+
+    # File paths
+    output_dir = os.path.dirname(output_path)
+    downloaded = {
+        'url': video_url,
+        'title': video_title,
+        'output_path': output_path,
+        'video_bitrate': video_bitrate,
+        'audio_bitrate': audio_bitrate,
+        'source_codec': video_format.get('vcodec'),
+        'video_height': video_format.get('height'),
+        'metadata_args': metadata_args,
+    }
+    started = time.time()
+    options = resolve_download_options(download_options)
+
+    def fetch_stream(fmt, suffix):
+        if options['range_download'] and supports_ranges(fmt):
+            target = os.path.join(output_dir, f"{video_title}_{suffix}.{fmt.get('ext') or 'bin'}")
 
-        # Step 1: Download video and audio into a temporary merged file
+            def range_progress(done, total):
+                progress_hook({'status': 'downloading', 'filename': target, 'downloaded_bytes': done, 'total_bytes': total})
+
+            download_ranges(
+                fmt['url'], target, fmt['filesize'], headers=fmt.get('http_headers'),
+                connections=options['connections'], chunk_size=options['chunk_size'],
+                retries=options['retries'], timeout=options['timeout'], progress_callback=range_progress
+            )
+            progress_hook({'status': 'finished', 'filename': target, 'total_bytes': fmt['filesize']})
+            return target
+
+        # Each stream on its own, untouched by the merger
         ydl_opts = {
-            'format': f"{video_format_id}+{audio_format_id}",
-            'outtmpl': merged_input,
+            'format': fmt['format_id'],
+            'outtmpl': os.path.join(output_dir, f"{video_title}_{suffix}.%(ext)s"),
             'progress_hooks': [progress_hook],  # Attach the progress hook
-            'postprocessor_args': [
-                # Add metadata during merge
-                '-metadata', f'audio_bitrate={audio_bitrate}kbps',
-                '-metadata', f'video_bitrate={video_bitrate}kbps',
-                '-metadata', f'description=Video Bitrate: {video_bitrate}kbps, Audio Bitrate: {audio_bitrate}kbps',
-                # Add metadata specifically to audio stream
-                '-metadata:s:a:0', f'title={video_title} audio',
-                '-metadata:s:a:0', f'bitrate={audio_bitrate}',
-                # Add metadata specifically to video stream
-                '-metadata:s:v:0', f'title={video_title} video',
-                '-metadata:s:v:0', f'bitrate={video_bitrate}',
-                # Clear any existing metadata that might interfere
-                '-map_metadata', '-1'
-            ],
+            **build_ydl_tuning(options),
         }
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
-
-        # Step 2: Apply watermark if enabled
-        if watermark:
-            try:
-                add_moving_watermark(
-                    input_file=merged_input,
-                    output_file=output_watermarked,
-                    watermark_text=watermark_text,
-                    video_codec=video_codec,
-                    video_bitrate=video_bitrate
-                )
-
-                # Delete the temporary merged file only after successful watermarking
-                if os.path.exists(merged_input):
-                    os.remove(merged_input)
-
-                return True  # Video downloaded successfully
-            except Exception as e:
-                return False  # Return False on error during watermarking
+        with load_yt_dlp()(ydl_opts) as ydl:
+            # Download from the resolved info dict so yt_dlp does not extract it again
+            result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        return result['requested_downloads'][0]['filepath']
+
+    # Fetch the video and audio streams side by side
+    with span("download", video_id=get_video_id(video_url), video_format_id=video_format_id,
+              audio_format_id=audio_format_id) as timing:
+        with ThreadPoolExecutor(max_workers=2 if options['parallel_streams'] else 1) as executor:
+            video_future = executor.submit(fetch_stream, video_format, 'video')
+            audio_future = executor.submit(fetch_stream, audio_format, 'audio')
+            video_file, audio_file = video_future.result(), audio_future.result()
+        timing.set(bytes=_record_download(started, [video_file, audio_file]))
+
+    if merge:
+        merged_input = os.path.join(output_dir, f"{video_title}_temp.mp4")  # Temporary merged video
+        merge_streams(video_file, audio_file, merged_input, metadata_args)
+        for stream_file in (video_file, audio_file):
+            os.remove(stream_file)
+        downloaded['merged_input'] = merged_input
+    else:
+        downloaded['video_file'] = video_file
+        downloaded['audio_file'] = audio_file
+
+    if progress_callback:
+        progress_callback(100)  # Ensure progress reaches 100% at the end
+    return downloaded
+
+def _record_download(started, files):
+    """
+    Feeds the measured download speed to the format policy's throughput stats
+    and returns the bytes downloaded.
+    """
+    num_bytes = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+    get_throughput_stats().record_download(num_bytes, time.time() - started)
+    return num_bytes
+
+def merge_streams(video_file, audio_file, output_file, metadata_args=None):
+    """
+    Muxes separately downloaded video and audio streams without re-encoding.
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    command = [
+        "ffmpeg", "-y",
+        "-i", video_file,
+        "-i", audio_file,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c", "copy",
+        *(metadata_args or []),
+        output_file
+    ]
+    try:
+        with span("merge", output_file=output_file) as timing:
+            subprocess.run(command, check=True)
+            timing.set(bytes=os.path.getsize(output_file))
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to merge streams: {e}")
+
+def plan_encode(downloaded):
+    """
+    Works out what `encode_stage` does with a download, shared with its async
+    version so only the ffmpeg invocation differs between them.
+
+    Returns:
+        dict: final_output (path of the finished video), separate_streams
+            (whether video and audio are still separate files), temp_files
+            (removed once the output is written) and watermark_args (the
+            `add_moving_watermark` arguments that come from the download)
+    """
+    separate_streams = 'merged_input' not in downloaded
+    watermark_args = {
+        'input_file': downloaded['video_file'] if separate_streams else downloaded['merged_input'],
+        'video_bitrate': downloaded['video_bitrate'],
+        'source_codec': downloaded.get('source_codec'),
+    }
+    if separate_streams:
+        # The watermark pass muxes the audio and tags the metadata too
+        watermark_args.update(audio_file=downloaded['audio_file'], metadata_args=downloaded['metadata_args'])
+    return {
+        'final_output': os.path.join(downloaded['output_path'], f"{downloaded['title']}.mp4"),
+        'separate_streams': separate_streams,
+        'temp_files': [downloaded['video_file'], downloaded['audio_file']] if separate_streams
+        else [downloaded['merged_input']],
+        'watermark_args': watermark_args,
+    }
+
+def track_encode_progress(progress_callback=None):
+    """
+    Returns (last_progress, callback): the callback passes ffmpeg's progress
+    events on to `progress_callback` and keeps the latest one in last_progress.
+    """
+    last_progress = {}
+
+    def encode_progress(event):
+        last_progress.update(event)
+        if progress_callback:
+            progress_callback(event)
+    return last_progress, encode_progress
+
+def record_encode(downloaded, output_file, last_progress, seconds, timing):
+    """
+    Feeds the measured encode speed to the format policy's throughput stats
+    and adds the encode's results to its timing span.
+    """
+    if last_progress.get('frame'):
+        get_throughput_stats().record_encode(downloaded.get('video_height'), last_progress['frame'], seconds)
+    timing.set(bytes=os.path.getsize(output_file), frames=last_progress.get('frame'),
+               fps=last_progress.get('fps'), ffmpeg_speed=last_progress.get('speed'))
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def encode_stage(downloaded, watermark=True, watermark_text="LIMITLESS MEDIA", video_codec=None, watermark_options=None,
+                 progress_callback=None):
+    """
+    Second pipeline stage: watermarks the download from `download_stage`, or
+    just moves it into place when watermarking is disabled.
+
+    Separately downloaded streams are merged, watermarked and tagged in a
+    single ffmpeg pass.
+
+    Args:
+        downloaded (dict): Result of `download_stage`
+        watermark (bool): Whether to add the watermark
+        watermark_text (str): Text to use for the watermark
+        video_codec (str, optional): Encoder to use; picked with `select_video_codec` if None
+        watermark_options (dict, optional): Extra `add_moving_watermark` keyword
+            arguments, e.g. {'segments': 8, 'workers': 8} for a parallel encode
+            or {'encoder_profile': 'archival'}
+        progress_callback (function, optional): Called with ffmpeg's progress
+            (percent, fps, speed, ETA) while watermarking
+
+    Returns:
+        str: Path of the finished video
+
+    Raises:
+        RuntimeError: If watermarking fails
+    """
+    plan = plan_encode(downloaded)
+    final_output = plan['final_output']
+
+    if watermark:
+        if video_codec is None:
+            video_codec = select_video_codec(prefer_cpu=False)
+
+        # Track the frames encoded to measure encode speed for format selection
+        last_progress, encode_progress = track_encode_progress(progress_callback)
+        started = time.time()
 
+        print(f'Selected video codec: {video_codec}')
+        print("-------------------------------------------------")
+        with span("watermark", video_id=get_video_id(downloaded['url']), encoder=video_codec) as timing:
+            add_moving_watermark(
+                output_file=final_output,
+                watermark_text=watermark_text,
+                video_codec=video_codec,
+                progress_callback=encode_progress,
+                **plan['watermark_args'],
+                **(watermark_options or {})
+            )
+            record_encode(downloaded, final_output, last_progress, time.time() - started, timing)
+    elif plan['separate_streams']:
+        merge_streams(downloaded['video_file'], downloaded['audio_file'], final_output, downloaded['metadata_args'])
+    else:
         # If watermarking is disabled, rename the temporary file to the final output
-        final_output = f"{output_path}/{video_title}.mp4"
-        os.rename(merged_input, final_output)
-        return True  # Video downloaded successfully
+        os.rename(downloaded['merged_input'], final_output)
+        return final_output
+
+    # Delete the temporary files only after the final file was written
+    remove_files(plan['temp_files'])
+    return final_output
+
+# Share of the combined progress taken by the download when a video is watermarked
+DOWNLOAD_PROGRESS_WEIGHT = 0.4
+
+def job_percent(stage, percent, watermark=True):
+    """
+    Maps a 'download' or 'watermark' stage percentage onto the whole job:
+    the download counts for DOWNLOAD_PROGRESS_WEIGHT of a watermarked video
+    and for all of an unwatermarked one.
+    """
+    download_weight = DOWNLOAD_PROGRESS_WEIGHT if watermark else 1.0
+    if stage == 'download':
+        return percent * download_weight
+    return download_weight * 100 + percent * (1 - download_weight)
+
+def find_stored_output(output_store, video_url, video_format_id, audio_format_id, output_path, info=None,
+                       watermark=True, watermark_text="LIMITLESS MEDIA", watermark_options=None):
+    """
+    Links a video already made with the same formats and settings into place.
+
+    Returns:
+        tuple: (store key to `put` the output under once it is made, path
+            of the linked output or None on a miss)
+    """
+    key = store_key(get_video_id(video_url), video_format_id, audio_format_id, watermark, watermark_text,
+                    watermark_options)
+    if info is None:
+        info = get_video_info(video_url)
+    return key, output_store.get(key, get_output_file(output_path, info))
+
+def download_video(video_url, video_format_id, audio_format_id, output_path, watermark=True, watermark_text="LIMITLESS MEDIA", progress_callback=None, info=None, watermark_options=None,
+                   download_options=None, output_store=None):
+    """
+    Downloads the selected video and audio formats, merges them, applies a watermark if enabled,
+    and removes the temporary merged file after successfully creating the watermarked file.
+    Also adds audio bitrate metadata to the output file.
+
+    If `info` is given (an info dict already resolved by `get_video_info`), no
+    metadata extraction is done at all; otherwise the shared info cache is used.
+    `watermark_options` is passed on to `add_moving_watermark` and
+    `download_options` (connections, chunk size, ...) to `download_stage`.
+    With an `output_store`, a video already made with the same formats and
+    settings is linked into place without downloading or encoding it.
+
+    `progress_callback` receives one percentage for the whole job: the
+    download counts for DOWNLOAD_PROGRESS_WEIGHT of it and watermarking for
+    the rest (or the download for all of it when watermarking is disabled).
+
+    This runs `download_stage` and `encode_stage` back to back; see
+    `pipeline.run_pipeline` to overlap them across several videos.
+    """
+    try:
+        with span("download_video", video_id=get_video_id(video_url)):
+            if output_store:
+                key, output = find_stored_output(output_store, video_url, video_format_id, audio_format_id,
+                                                 output_path, info, watermark, watermark_text, watermark_options)
+                if output:
+                    if progress_callback:
+                        progress_callback(100)
+                    return True
+
+            def download_progress(percentage):
+                if progress_callback:
+                    progress_callback(job_percent('download', percentage, watermark))
+
+            def encode_progress(event):
+                if progress_callback and event['percent'] is not None:
+                    progress_callback(job_percent('watermark', event['percent'], watermark))
+
+            # Watermarked videos skip the temporary merge; the watermark pass muxes the streams
+            downloaded = download_stage(
+                video_url, video_format_id, audio_format_id, output_path,
+                progress_callback=download_progress, info=info, merge=not watermark,
+                download_options=download_options
+            )
+            output = encode_stage(downloaded, watermark=watermark, watermark_text=watermark_text, watermark_options=watermark_options,
+                                  progress_callback=encode_progress)
+            if output_store:
+                output_store.put(key, output)
+            return True  # Video downloaded successfully
 
     except Exception as e:
+        print(f"Error downloading {video_url}: {e}")
         return False  # Return False on any error
 
-def process_url(url, output_path, watermark=True, watermark_text="LIMITLESS MEDIA", progress_callback=None):
+def resolve_video(video_url):
+    """
+    Resolves the title and formats of a single video.
+
+    Errors are not raised; they are recorded in the returned entry's status so
+    one bad video never stops a playlist.
+
+    Args:
+        video_url (str): YouTube video URL
+
+    Returns:
+        dict: Entry with url, title, formats, duration and status ('ready' or 'error: ...')
+    """
+    video_info = {
+        'url': video_url,
+        'title': None,
+        'formats': None,
+        'duration': None,
+        'status': 'pending'
+    }
+
+    try:
+        # Formats and title both come from the one cached extraction
+        info = get_video_info(video_url)
+        video_info['formats'] = info.get('formats', [])
+        video_info['title'] = info.get('title', 'Unknown Title')
+        video_info['duration'] = info.get('duration')
+
+        video_info['status'] = 'ready'
+
+    except Exception as e:
+        video_info['status'] = f'error: {str(e)}'
+
+    return video_info
+
+def process_url(url, output_path, watermark=True, watermark_text="LIMITLESS MEDIA", progress_callback=None, max_workers=1,
+                lazy=False):
     """
     Process a URL which could be either a single video or a playlist.
     
@@ -279,6 +851,11 @@ def process_url(url, output_path, watermark=True, watermark_text="LIMITLESS MEDI
         watermark (bool): Whether to add watermark
         watermark_text (str): Text to use for watermark
         progress_callback (function): Callback for progress updates
+        max_workers (int): Number of playlist entries resolved concurrently.
+            1 resolves them one at a time.
+        lazy (bool): Return playlist entries straight from the flat playlist
+            extraction, with status 'pending' and no formats, and leave
+            resolving them (`resolve_video`) to the caller
         
     Returns:
         dict: Information about the processed videos including:
@@ -296,36 +873,22 @@ def process_url(url, output_path, watermark=True, watermark_text="LIMITLESS MEDI
     }
     
     try:
-        if is_playlist(url):
-            result['is_playlist'] = True
-            video_urls = get_playlist_urls(url)           
-            
-            # Process each video in the playlist
-            for video_url in video_urls:
-                video_info = {
-                    'url': video_url,
-                    'title': None,
-                    'formats': None,
-                    'status': 'pending'
-                }
-                
-                try:
-                    # Get available formats for the video
-                    formats = get_video_formats(video_url)
-                    video_info['formats'] = formats
-                    
-                    # Get video title for the info
-                    with YoutubeDL({'quiet': True}) as ydl:
-                        info = ydl.extract_info(video_url, download=False)
-                        video_info['title'] = info.get('title', 'Unknown Title')
-                    
-                    video_info['status'] = 'ready'
-                    
-                except Exception as e:
-                    video_info['status'] = f'error: {str(e)}'
-                
-                result['videos'].append(video_info)
-                
+        with span("process_url", url=url) as timing:
+            if is_playlist(url):
+                result['is_playlist'] = True
+                if lazy:
+                    # One flat request; formats are resolved later, row by row
+                    result['videos'] = [
+                        {**entry, 'title': entry['title'] or entry['url'], 'formats': None, 'status': 'pending'}
+                        for entry in get_playlist_entries(url)
+                    ]
+                    timing.set(entries=len(result['videos']), lazy=True)
+                    return result
+                video_urls = get_playlist_urls(url)
+            else:
+                video_urls = [url]
+
+            def report(video_info):
                 # Call progress callback if provided
                 if progress_callback:
                     progress_callback({
@@ -333,42 +896,30 @@ def process_url(url, output_path, watermark=True, watermark_text="LIMITLESS MEDI
                         'video': video_info,
                         'total_videos': len(video_urls)
                     })
-            
-        else:
-            # Single video processing
-            video_info = {
-                'url': url,
-                'title': None,
-                'formats': None,
-                'status': 'pending'
-            }
-            
-            try:
-                # Get available formats for the video
-                formats = get_video_formats(url)
-                video_info['formats'] = formats
-                
-                # Get video title
-                with YoutubeDL({'quiet': True}) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    video_info['title'] = info.get('title', 'Unknown Title')
-                
-                video_info['status'] = 'ready'
-                
-            except Exception as e:
-                video_info['status'] = f'error: {str(e)}'
-            
-            result['videos'].append(video_info)
-            
-            # Call progress callback if provided
-            if progress_callback:
-                progress_callback({
-                    'type': 'video_processed',
-                    'video': video_info,
-                    'total_videos': 1
-                })
+
+            if max_workers and max_workers > 1 and len(video_urls) > 1:
+                # Resolve entries in a bounded pool; report each as soon as it is done
+                # but keep the result list in playlist order
+                videos = [None] * len(video_urls)
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(resolve_video, video_url): index
+                        for index, video_url in enumerate(video_urls)
+                    }
+                    for future in as_completed(futures):
+                        video_info = future.result()
+                        videos[futures[future]] = video_info
+                        report(video_info)
+                result['videos'] = videos
+            else:
+                # Process each video one at a time
+                for video_url in video_urls:
+                    video_info = resolve_video(video_url)
+                    result['videos'].append(video_info)
+                    report(video_info)
         
-        return result
+            timing.set(entries=len(result['videos']))
+            return result
         
     except Exception as e:
         raise Exception(f"Error processing URL: {str(e)}")
@@ -0,0 +1,197 @@
+import contextlib
+import os
+import threading
+import time
+from ffmpeg_caps import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# One lock file per CPU slot; every process on the machine shares them
+SLOT_DIR = os.path.join(CACHE_DIR, "encode_slots")
+
+POLL_INTERVAL = 0.2  # Seconds between attempts while waiting for free slots
+
+# Encodes the budget is split between by default, so a second encode in this
+# or another process can start next to the first instead of waiting for it
+DEFAULT_CONCURRENT_JOBS = 2
+
+def _lock_file(path):
+    """
+    Opens and locks a slot file without blocking. Returns the open handle,
+    or None if another job holds the slot. The lock is released when the
+    handle is closed, including when the holding process dies.
+    """
+    handle = open(path, 'a+')
+    try:
+        if fcntl:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return handle
+    except OSError:
+        handle.close()
+        return None
+
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+class CpuAllocation:
+    """
+    CPU slots held by one encode. `threads` is what the encode should pass to
+    ffmpeg as `-threads`; `apply_to` applies pinning and niceness to the
+    ffmpeg process once it has started.
+    """
+
+    def __init__(self, slots, handles, cpus, nice=None):
+        self.slots = slots
+        self.threads = len(slots)
+        self.cpus = cpus
+        self.nice = nice
+        self._handles = handles
+
+    def apply_to(self, pid):
+        """
+        Pins a started process to the allocation's CPUs and raises its niceness.
+
+        This runs in the parent right after the process starts rather than as
+        a `preexec_fn`, which is not safe when encodes are started from worker
+        threads. ffmpeg starts its encoder threads later, so they inherit both.
+        A process that already exited, or a niceness the user may not set, is
+        ignored; neither setting exists on Windows.
+        """
+        if self.cpus and hasattr(os, 'sched_setaffinity'):
+            with contextlib.suppress(OSError):
+                os.sched_setaffinity(pid, self.cpus)
+        if self.nice is not None and hasattr(os, 'setpriority'):
+            with contextlib.suppress(OSError):
+                niceness = os.getpriority(os.PRIO_PROCESS, pid) + self.nice
+                os.setpriority(os.PRIO_PROCESS, pid, max(-20, min(19, niceness)))
+
+    def release(self):
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+
+class EncodeScheduler:
+    """
+    Hands out CPU slots to ffmpeg encodes so concurrent jobs share the
+    machine instead of each starting a thread per core.
+
+    Slots are lock files in `slot_dir`, so jobs in other threads and in other
+    processes (a second GUI, the CLI, the job server) draw from the same
+    budget. A job that finds no free slot waits until one is released.
+
+    Args:
+        cpu_budget (int, optional): Slots in total (default: usable CPU cores).
+            Every process using the same slot_dir should use the same budget
+        threads_per_job (int, optional): Slots a job asks for (default: an
+            equal share of the budget for `concurrent_jobs` encodes, at least
+            min_threads)
+        min_threads (int): Fewest slots a job starts with when not all it
+            asked for are free
+        pin (bool): Pin each ffmpeg process to the CPUs of its slots
+        nice (int, optional): Niceness increment for ffmpeg processes
+        slot_dir (str, optional): Folder holding the slot lock files
+            (default: SLOT_DIR), created when slots are first taken
+        concurrent_jobs (int, optional): Encodes expected to run at once,
+            e.g. the encode workers of a pipeline (default: DEFAULT_CONCURRENT_JOBS)
+    """
+
+    def __init__(self, cpu_budget=None, threads_per_job=None, min_threads=1, pin=False, nice=None, slot_dir=None,
+                 concurrent_jobs=None):
+        self.cpus = _available_cpus()
+        self.cpu_budget = cpu_budget or len(self.cpus)
+        self.min_threads = max(1, min_threads)
+        concurrent_jobs = max(1, concurrent_jobs or DEFAULT_CONCURRENT_JOBS)
+        self.threads_per_job = threads_per_job or max(self.min_threads, self.cpu_budget // concurrent_jobs)
+        self.pin = pin
+        self.nice = nice
+        self.slot_dir = slot_dir or SLOT_DIR
+        self._slot_dir_ready = False
+
+    def _slot_path(self, slot):
+        if not self._slot_dir_ready:
+            os.makedirs(self.slot_dir, exist_ok=True)
+            self._slot_dir_ready = True
+        return os.path.join(self.slot_dir, f"slot-{slot:03d}.lock")
+
+    def try_acquire(self, threads=None):
+        """
+        Takes up to `threads` free slots without waiting.
+
+        Returns:
+            CpuAllocation: The slots taken, or None if fewer than the minimum were free
+        """
+        wanted = max(1, min(threads or self.threads_per_job, self.cpu_budget))
+        minimum = min(self.min_threads, wanted)
+        slots, handles = [], []
+        for slot in range(self.cpu_budget):
+            handle = _lock_file(self._slot_path(slot))
+            if handle:
+                slots.append(slot)
+                handles.append(handle)
+                if len(slots) == wanted:
+                    break
+        if len(slots) < minimum:
+            for handle in handles:
+                handle.close()
+            return None
+        cpus = [self.cpus[slot % len(self.cpus)] for slot in slots] if self.pin else None
+        return CpuAllocation(slots, handles, cpus, self.nice)
+
+    def acquire(self, threads=None, timeout=None):
+        """
+        Takes up to `threads` slots, waiting until at least the minimum is free.
+
+        Raises:
+            TimeoutError: If no slots became free within `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            allocation = self.try_acquire(threads)
+            if allocation:
+                return allocation
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("No free encode slots")
+            time.sleep(POLL_INTERVAL)
+
+    @contextlib.contextmanager
+    def allocate(self, threads=None):
+        """
+        Context manager around `acquire` that releases the slots afterwards.
+        """
+        allocation = self.acquire(threads)
+        try:
+            yield allocation
+        finally:
+            allocation.release()
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+def configure_encode_scheduler(**options):
+    """
+    Replaces the shared scheduler used by `add_moving_watermark`, e.g.
+    configure_encode_scheduler(cpu_budget=8, pin=True, nice=10).
+    """
+    global _default_scheduler
+    with _default_lock:
+        _default_scheduler = EncodeScheduler(**options)
+        return _default_scheduler
+
+def get_encode_scheduler():
+    """
+    Returns the shared scheduler, creating it with the defaults on first use.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = EncodeScheduler()
+        return _default_scheduler
@@ -0,0 +1,146 @@
+# Speed/quality profiles:
+#   fast      - quickest encode, for previews and bulk jobs
+#   balanced  - default; good quality at a reasonable speed
+#   archival  - best quality per bit, slow
+ENCODER_PROFILES = ("fast", "balanced", "archival")
+DEFAULT_PROFILE = "balanced"
+
+# Keyframe interval (1 sec at 60 FPS)
+GOP_SIZE = "60"
+
+# Per-encoder settings for each profile
+X264_PRESETS = {'fast': 'veryfast', 'balanced': 'medium', 'archival': 'slow'}
+X264_CRF = {'fast': 23, 'balanced': 20, 'archival': 18}
+
+VP9_DEADLINES = {'fast': 'realtime', 'balanced': 'good', 'archival': 'good'}
+VP9_CPU_USED = {'fast': 8, 'balanced': 4, 'archival': 1}
+VP9_CRF = {'fast': 36, 'balanced': 32, 'archival': 28}
+
+NVENC_PRESETS = {'fast': 'p2', 'balanced': 'p4', 'archival': 'p7'}
+NVENC_CQ = {'fast': 28, 'balanced': 23, 'archival': 19}
+
+QSV_PRESETS = {'fast': 'veryfast', 'balanced': 'medium', 'archival': 'veryslow'}
+QSV_QUALITY = {'fast': 28, 'balanced': 23, 'archival': 19}
+
+AMF_QUALITY = {'fast': 'speed', 'balanced': 'balanced', 'archival': 'quality'}
+AMF_QP = {'fast': 28, 'balanced': 23, 'archival': 19}
+
+VIDEOTOOLBOX_QUALITY = {'fast': 50, 'balanced': 60, 'archival': 75}
+
+def normalize_codec(codec):
+    """
+    Returns 'vp9', 'h264', 'av1' or 'hevc' for a yt_dlp vcodec or ffprobe codec name.
+    """
+    codec = (codec or "").lower()
+    if codec.startswith(("vp9", "vp09")):
+        return "vp9"
+    if codec.startswith(("avc1", "avc3", "h264")):
+        return "h264"
+    if codec.startswith(("av01", "av1")):
+        return "av1"
+    if codec.startswith(("hev1", "hvc1", "hevc", "h265")):
+        return "hevc"
+    return codec
+
+def choose_encoder(selected_encoder=None, source_codec=None, profile=DEFAULT_PROFILE):
+    """
+    Picks the encoder to watermark with.
+
+    The encoder found by `select_video_codec` is used as is, except for
+    archival output, which always uses a CPU encoder: libvpx-vp9 for VP9
+    sources so there is no generation change to H.264, libx264 otherwise.
+
+    Args:
+        selected_encoder (str, optional): Probed encoder, e.g. 'h264_nvenc'
+        source_codec (str, optional): Codec of the downloaded video stream
+        profile (str): One of ENCODER_PROFILES
+
+    Returns:
+        str: ffmpeg encoder name
+    """
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {profile}")
+    if profile == "archival":
+        return "libvpx-vp9" if normalize_codec(source_codec) == "vp9" else "libx264"
+    if selected_encoder and normalize_codec(selected_encoder) == "vp9":
+        return "libvpx-vp9"
+    return selected_encoder or "libx264"
+
+def _rate_control(video_bitrate, quality_args):
+    """
+    Bitrate-capped encoding when the source bitrate is known, quality-based otherwise.
+    """
+    if video_bitrate:
+        return [
+            "-b:v", f"{video_bitrate}k",
+            "-maxrate", f"{video_bitrate}k",
+            "-bufsize", f"{video_bitrate * 2}k",  # Two seconds of video for rate control
+        ]
+    return quality_args
+
+def build_encoder_args(encoder, profile=DEFAULT_PROFILE, video_bitrate=None, threads=None):
+    """
+    Returns the complete ffmpeg video encoding options for an encoder and profile.
+
+    Args:
+        encoder (str): ffmpeg encoder name, e.g. 'libx264' or 'h264_nvenc'
+        profile (str): One of ENCODER_PROFILES
+        video_bitrate (float, optional): Target bitrate in kbps; quality-based
+            rate control is used when it is missing
+        threads (int, optional): Encoder threads
+
+    Returns:
+        list: ffmpeg options, starting with -c:v
+    """
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {profile}")
+    video_bitrate = int(video_bitrate) if video_bitrate else None
+
+    if encoder == "libx264":
+        args = [
+            "-preset", X264_PRESETS[profile],
+            *_rate_control(video_bitrate, ["-crf", str(X264_CRF[profile])]),
+        ]
+    elif encoder == "libvpx-vp9":
+        args = [
+            "-deadline", VP9_DEADLINES[profile],
+            "-cpu-used", str(VP9_CPU_USED[profile]),
+            "-row-mt", "1",          # Multithread within tiles
+            "-tile-columns", "2",    # libvpx lowers this for narrow videos
+            "-frame-parallel", "0",
+            # Constrained quality with a bitrate, constant quality without
+            *(["-crf", str(VP9_CRF[profile]), *_rate_control(video_bitrate, [])] if video_bitrate
+              else ["-crf", str(VP9_CRF[profile]), "-b:v", "0"]),
+        ]
+    elif encoder.endswith("_nvenc"):
+        args = [
+            "-preset", NVENC_PRESETS[profile],
+            "-rc", "vbr",
+            "-cq", str(NVENC_CQ[profile]),
+            *_rate_control(video_bitrate, ["-b:v", "0"]),
+        ]
+    elif encoder.endswith("_qsv"):
+        args = [
+            "-preset", QSV_PRESETS[profile],
+            *_rate_control(video_bitrate, ["-global_quality", str(QSV_QUALITY[profile])]),
+        ]
+    elif encoder.endswith("_amf"):
+        args = [
+            "-quality", AMF_QUALITY[profile],
+            *_rate_control(video_bitrate, [
+                "-rc", "cqp",
+                "-qp_i", str(AMF_QP[profile]),
+                "-qp_p", str(AMF_QP[profile]),
+            ]),
+        ]
+    elif encoder.endswith("_videotoolbox"):
+        args = _rate_control(video_bitrate, ["-q:v", str(VIDEOTOOLBOX_QUALITY[profile])])
+    else:
+        args = _rate_control(video_bitrate, [])
+
+    return [
+        "-c:v", encoder,
+        *args,
+        "-g", GOP_SIZE,
+        *(["-threads", str(threads)] if threads else []),
+    ]
@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+FFMPEG_BINARY = "ffmpeg"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ytdownloadwithwm")
+CAPS_CACHE_FILE = os.path.join(CACHE_DIR, "ffmpeg_caps.json")
+
+# Filters the watermark engines depend on
+PROBED_FILTERS = ("drawtext", "overlay")
+
+_capabilities = None  # Probe result for this process
+_lock = threading.Lock()
+
+def _run(args, timeout=30):
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    return result.returncode, result.stdout.decode('utf-8', errors='replace')
+
+def _parse_encoders(listing):
+    """
+    Returns the encoder names from `ffmpeg -encoders` output.
+    """
+    encoders = []
+    in_table = False
+    for line in listing.splitlines():
+        if line.strip().startswith("------"):
+            in_table = True
+            continue
+        parts = line.split()
+        if in_table and len(parts) >= 2:
+            encoders.append(parts[1])
+    return encoders
+
+def _parse_filters(listing):
+    """
+    Returns the filter names from `ffmpeg -filters` output.
+    """
+    filters = []
+    for line in listing.splitlines():
+        parts = line.split()
+        # Filter rows look like " TSC drawtext  V->V  Draw text on top of video frames"
+        if len(parts) >= 3 and "->" in parts[2] and set(parts[0]) <= set("TSCA.|"):
+            filters.append(parts[1])
+    return filters
+
+def _binary_signature(ffmpeg_path):
+    """
+    Returns what identifies an ffmpeg build for cache invalidation.
+    """
+    return {'path': ffmpeg_path, 'mtime': os.path.getmtime(ffmpeg_path)}
+
+def _load_cache(signature, cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            caps = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if caps.get('path') != signature['path'] or caps.get('mtime') != signature['mtime']:
+        return None
+    return caps
+
+def _save_cache(caps, cache_file):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_path = f"{cache_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(caps, f, indent=2)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        print(f"Could not write ffmpeg capability cache: {e}")
+
+def _probe(ffmpeg_path):
+    _, version_output = _run([ffmpeg_path, "-hide_banner", "-version"])
+    first_line = version_output.splitlines()[0] if version_output else ""
+    version = first_line.split()[2] if first_line.startswith("ffmpeg version") else first_line
+
+    _, encoders_output = _run([ffmpeg_path, "-hide_banner", "-encoders"])
+    _, filters_output = _run([ffmpeg_path, "-hide_banner", "-filters"])
+    filters = _parse_filters(filters_output)
+
+    return {
+        **_binary_signature(ffmpeg_path),
+        'version': version,
+        'encoders': _parse_encoders(encoders_output),
+        'filters': {name: name in filters for name in PROBED_FILTERS},
+        'verified_encoders': {},  # encoder -> whether a test encode succeeded
+    }
+
+def get_capabilities(cache_file=CAPS_CACHE_FILE, refresh=False):
+    """
+    Returns what the installed ffmpeg can do, probing it at most once per process.
+
+    The result is also stored in `cache_file` and reused by later runs until the
+    ffmpeg binary's path or modification time changes.
+
+    Args:
+        cache_file (str): Path of the on-disk capability cache
+        refresh (bool): Ignore the cached result and probe again
+
+    Returns:
+        dict: Capabilities with keys:
+            - available (bool): Whether ffmpeg was found
+            - path, mtime: The probed binary
+            - version (str): ffmpeg version string
+            - encoders (list): Encoder names listed by `ffmpeg -encoders`
+            - filters (dict): Filter name -> whether it is available
+            - verified_encoders (dict): Encoder -> result of a test encode
+    """
+    global _capabilities
+    with _lock:
+        if _capabilities is not None and not refresh:
+            return _capabilities
+
+        ffmpeg_path = shutil.which(FFMPEG_BINARY)
+        if not ffmpeg_path:
+            _capabilities = {'available': False, 'encoders': [], 'filters': {}, 'verified_encoders': {}}
+            return _capabilities
+
+        ffmpeg_path = os.path.realpath(ffmpeg_path)
+        caps = None if refresh else _load_cache(_binary_signature(ffmpeg_path), cache_file)
+        if caps is None:
+            caps = _probe(ffmpeg_path)
+            _save_cache(caps, cache_file)
+        caps['available'] = True
+        _capabilities = caps
+        return _capabilities
+
+def _test_encode(ffmpeg_path, encoder):
+    """
+    Encodes a few frames of a generated test pattern to check an encoder really works.
+    """
+    try:
+        returncode, _ = _run([
+            ffmpeg_path, "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "testsrc=size=256x144:rate=25",
+            "-frames:v", "5",
+            "-c:v", encoder,
+            "-f", "null", "-"
+        ])
+        return returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+def encoder_works(encoder, cache_file=CAPS_CACHE_FILE):
+    """
+    Checks that ffmpeg lists an encoder and can actually encode with it.
+
+    A listed hardware encoder often fails at runtime (no GPU, missing driver),
+    so the listing is confirmed with a short test encode. The outcome is cached
+    together with the rest of the capabilities.
+
+    Args:
+        encoder (str): Encoder name, e.g. 'h264_nvenc'
+
+    Returns:
+        bool: True if the encoder can be used
+    """
+    caps = get_capabilities(cache_file)
+    if not caps['available'] or encoder not in caps['encoders']:
+        return False
+
+    with _lock:
+        if encoder in caps['verified_encoders']:
+            return caps['verified_encoders'][encoder]
+
+    works = _test_encode(caps['path'], encoder)
+    with _lock:
+        caps['verified_encoders'][encoder] = works
+        _save_cache({k: v for k, v in caps.items() if k != 'available'}, cache_file)
+    return works
+
+def has_filter(name, cache_file=CAPS_CACHE_FILE):
+    """
+    Returns True if ffmpeg provides the given filter (only probed filters are known).
+    """
+    return get_capabilities(cache_file)['filters'].get(name, False)
@@ -0,0 +1,273 @@
+import json
+import os
+import threading
+from encoder_policy import normalize_codec
+from ffmpeg_caps import CACHE_DIR
+
+# Measured download bandwidth and encode speed, kept between runs
+THROUGHPUT_FILE = os.path.join(CACHE_DIR, "throughput.json")
+
+# Assumed until something has been measured on this machine
+DEFAULT_BANDWIDTH = 2 * 1024 * 1024  # Bytes per second
+DEFAULT_ENCODE_FPS = 60  # Watermark encode speed at 1080p
+REFERENCE_HEIGHT = 1080
+
+# Weight of a new measurement against the running average
+SMOOTHING = 0.3
+
+# Codecs the watermark pass handles, best first
+CODEC_PREFERENCE = {'vp9': 2, 'h264': 1}
+
+class ThroughputStats:
+    """
+    Running averages of download bandwidth and watermark encode speed per
+    resolution, used to estimate how long a format will take.
+
+    Thread-safe; measurements are saved to `stats_file` as they come in.
+    """
+
+    def __init__(self, stats_file=THROUGHPUT_FILE):
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._stats = {'bandwidth': None, 'encode_fps': {}}
+        if stats_file and os.path.exists(stats_file):
+            try:
+                with open(stats_file, 'r', encoding='utf-8') as f:
+                    self._stats.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable throughput stats: {e}")
+
+    def _save(self):
+        if not self.stats_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self._stats, f)
+        except OSError as e:
+            print(f"Could not save throughput stats: {e}")
+
+    @staticmethod
+    def _smooth(previous, value):
+        return value if previous is None else previous + SMOOTHING * (value - previous)
+
+    def record_download(self, num_bytes, seconds):
+        """
+        Records a finished download of `num_bytes` that took `seconds`.
+        """
+        if num_bytes <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self._stats['bandwidth'] = self._smooth(self._stats['bandwidth'], num_bytes / seconds)
+            self._save()
+
+    def record_encode(self, height, frames, seconds):
+        """
+        Records a watermark encode of `frames` frames at `height` that took `seconds`.
+        """
+        if not height or frames <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            key = str(int(height))
+            self._stats['encode_fps'][key] = self._smooth(self._stats['encode_fps'].get(key), frames / seconds)
+            self._save()
+
+    def bandwidth(self):
+        """
+        Returns the expected download speed in bytes per second.
+        """
+        with self._lock:
+            return self._stats['bandwidth'] or DEFAULT_BANDWIDTH
+
+    def encode_fps(self, height):
+        """
+        Returns the expected watermark encode speed at a resolution.
+
+        Unmeasured resolutions are scaled from the nearest measured one by
+        pixel count.
+        """
+        height = height or REFERENCE_HEIGHT
+        with self._lock:
+            measured = {int(key): fps for key, fps in self._stats['encode_fps'].items()}
+        if measured:
+            nearest = min(measured, key=lambda measured_height: abs(measured_height - height))
+            reference_height, reference_fps = nearest, measured[nearest]
+        else:
+            reference_height, reference_fps = REFERENCE_HEIGHT, DEFAULT_ENCODE_FPS
+        return reference_fps * (reference_height / height) ** 2
+
+throughput_stats = ThroughputStats()
+
+def configure_throughput_stats(stats_file=THROUGHPUT_FILE):
+    """
+    Replaces the shared throughput stats, e.g. with stats_file=None so
+    synthetic runs such as the benchmarks neither read nor save measurements.
+    """
+    global throughput_stats
+    throughput_stats = ThroughputStats(stats_file)
+    return throughput_stats
+
+def get_throughput_stats():
+    """
+    Returns the shared throughput stats the download and encode stages record into.
+    """
+    return throughput_stats
+
+def estimate_size(fmt, duration=None):
+    """
+    Returns the size of a format in bytes: `filesize`, else `filesize_approx`,
+    else its bitrate times the duration. None if none of them is known.
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration
+    return None
+
+def estimate_job(video_format, audio_format, duration=None, watermark=True, stats=None):
+    """
+    Estimates size and time of downloading (and watermarking) one format pair.
+
+    Args:
+        video_format (dict): Video-only format
+        audio_format (dict): Audio-only format
+        duration (float, optional): Video length in seconds
+        watermark (bool): Whether the video will be re-encoded
+        stats (ThroughputStats, optional): Measurements to use (default: shared stats)
+
+    Returns:
+        dict: format, size (bytes), download_seconds, encode_seconds and seconds (total)
+    """
+    stats = stats or throughput_stats
+    size = (estimate_size(video_format, duration) or 0) + (estimate_size(audio_format, duration) or 0)
+    download_seconds = size / stats.bandwidth()
+    encode_seconds = 0
+    if watermark and duration:
+        frames = duration * (video_format.get('fps') or 30)
+        encode_seconds = frames / stats.encode_fps(video_format.get('height'))
+    return {
+        'format': video_format,
+        'size': size,
+        'download_seconds': download_seconds,
+        'encode_seconds': encode_seconds,
+        'seconds': download_seconds + encode_seconds,
+    }
+
+class FormatPolicy:
+    """
+    Picks the best quality format whose estimated job fits the limits.
+
+    Subclasses change what "best" means by overriding `score`.
+
+    Args:
+        max_minutes (float, optional): Longest acceptable download plus watermark time
+        max_mb (float, optional): Largest acceptable download (video plus audio)
+    """
+
+    def __init__(self, max_minutes=None, max_mb=None):
+        self.max_minutes = max_minutes
+        self.max_mb = max_mb
+
+    def fits(self, estimate):
+        if self.max_minutes is not None and estimate['seconds'] > self.max_minutes * 60:
+            return False
+        if self.max_mb is not None and estimate['size'] > self.max_mb * 1024 * 1024:
+            return False
+        return True
+
+    def score(self, estimate):
+        """
+        Returns a sort key; higher is better. Default: resolution, FPS, codec, bitrate.
+        """
+        fmt = estimate['format']
+        return (fmt.get('height') or 0, fmt.get('fps') or 0,
+                CODEC_PREFERENCE.get(normalize_codec(fmt.get('vcodec')), 0), fmt.get('tbr') or 0)
+
+class SmallestFormatPolicy(FormatPolicy):
+    """
+    Prefers the smallest download.
+    """
+
+    def score(self, estimate):
+        return -estimate['size']
+
+class FastestFormatPolicy(FormatPolicy):
+    """
+    Prefers the shortest estimated job.
+    """
+
+    def score(self, estimate):
+        return -estimate['seconds']
+
+# Policies selectable by name from the CLI
+FORMAT_POLICIES = {
+    'best': FormatPolicy,
+    'smallest': SmallestFormatPolicy,
+    'fastest': FastestFormatPolicy,
+}
+
+def get_policy(name="best", max_minutes=None, max_mb=None):
+    """
+    Returns the named policy with the given limits.
+    """
+    if name not in FORMAT_POLICIES:
+        raise ValueError(f"Unknown format policy: {name}")
+    return FORMAT_POLICIES[name](max_minutes=max_minutes, max_mb=max_mb)
+
+def _best_audio(formats):
+    audio_formats = [f for f in formats if f.get('acodec', 'none') != 'none' and f.get('vcodec', 'none') == 'none']
+    return max(audio_formats, key=lambda f: f.get('abr') or 0)
+
+def rank_formats(formats, duration=None, policy=None, watermark=True, stats=None):
+    """
+    Estimates every video-only VP9/AVC format and ranks them for a policy.
+
+    Formats that fit the policy's limits come first, best scored first. If
+    none fits, the rest follow fastest first so the caller still gets the
+    closest match.
+
+    Args:
+        formats (list): Formats of the video
+        duration (float, optional): Video length in seconds
+        policy (FormatPolicy, optional): Ranking and limits (default: best quality, no limits)
+        watermark (bool): Whether the video will be re-encoded
+        stats (ThroughputStats, optional): Measurements to use (default: shared stats)
+
+    Returns:
+        list: `estimate_job` results with an added 'fits' flag
+    """
+    policy = policy or FormatPolicy()
+    audio_format = _best_audio(formats)
+    estimates = []
+    for fmt in formats:
+        if fmt.get('acodec', 'none') != 'none' or fmt.get('vcodec', 'none') == 'none':
+            continue
+        if normalize_codec(fmt.get('vcodec')) not in CODEC_PREFERENCE:
+            continue
+        if estimate_size(fmt, duration) is None:
+            continue  # Nothing to estimate from
+        estimate = estimate_job(fmt, audio_format, duration, watermark, stats)
+        estimate['fits'] = policy.fits(estimate)
+        estimates.append(estimate)
+
+    fitting = sorted((e for e in estimates if e['fits']), key=policy.score, reverse=True)
+    too_big = sorted((e for e in estimates if not e['fits']), key=lambda e: e['seconds'])
+    return fitting + too_big
+
+def choose_formats(formats, policy=None, duration=None, watermark=True, stats=None):
+    """
+    Picks the video and audio format IDs for a video.
+
+    Returns:
+        tuple: (video_format_id, audio_format_id)
+
+    Raises:
+        ValueError: If the video has no usable video format
+    """
+    ranked = rank_formats(formats, duration, policy, watermark, stats)
+    if not ranked:
+        raise ValueError("No video format with a known size")
+    if not ranked[0]['fits']:
+        print(f"No format fits the limits; using the fastest ({ranked[0]['format']['format_id']})")
+    return ranked[0]['format']['format_id'], _best_audio(formats)['format_id']
@@ -0,0 +1,230 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Finished spans kept in memory for `recent_spans`
+MAX_RECENT_SPANS = 10000
+
+# Environment variables the GUI reads (the CLI has matching options)
+METRICS_ENV = "YTDWM_METRICS"          # JSON-lines file for spans
+PROMETHEUS_ENV = "YTDWM_PROMETHEUS"    # Prometheus text file, written on exit
+PROFILE_ENV = "YTDWM_PROFILE"          # cProfile stats file, written on exit
+
+def _children_cpu_time():
+    """
+    Returns the user and system CPU seconds of this process's finished
+    child processes, or None where that is not reported.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class Span:
+    """
+    Times one stage of one video: wall time, CPU time of the calling thread,
+    CPU time of the child processes (ffmpeg) that finished meanwhile and any
+    attributes set while it runs (bytes, ffmpeg speed, ...).
+
+    The encode, merge and render stages do their work in ffmpeg, so for them
+    `child_cpu_seconds` is the meaningful figure; `cpu_seconds` only covers
+    Python. Child CPU is process-wide: spans that overlap in other threads
+    also count each other's ffmpeg processes.
+
+    Use through `span()`:
+
+        with span("download", video_id=video_id) as s:
+            ...
+            s.set(bytes=num_bytes)
+    """
+
+    def __init__(self, recorder, stage, attributes):
+        self.recorder = recorder
+        self.stage = stage
+        self.attributes = attributes
+        self._profiler = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._profiler = self.recorder._start_profile()
+        self.started_at = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._children_cpu = _children_cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        record = {
+            'stage': self.stage,
+            'started_at': self.started_at,
+            'wall_seconds': time.perf_counter() - self._wall,
+            'cpu_seconds': time.thread_time() - self._cpu,
+            'child_cpu_seconds': (_children_cpu_time() - self._children_cpu
+                                  if self._children_cpu is not None else None),
+            'thread': threading.current_thread().name,
+            **self.attributes,
+            'error': str(exc) if exc else None,
+        }
+        self.recorder._stop_profile(self._profiler)
+        self.recorder.record(record)
+        return False
+
+class Recorder:
+    """
+    Collects finished spans, appends them to a JSON-lines file if one is
+    configured, keeps per-stage totals for the Prometheus dump and, when
+    profiling is on, merges the cProfile data of every instrumented thread.
+    """
+
+    def __init__(self):
+        self.jsonl_path = None
+        self.profiling = False
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=MAX_RECENT_SPANS)
+        self._totals = {}  # stage -> totals
+        self._profiles = []
+        self._local = threading.local()
+        self._profile_warning_shown = False
+
+    def configure(self, jsonl_path=None, profile=False):
+        self.jsonl_path = jsonl_path
+        self.profiling = profile
+
+    def record(self, record):
+        with self._lock:
+            self._recent.append(record)
+            totals = self._totals.setdefault(record['stage'], {
+                'count': 0, 'errors': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'child_cpu_seconds': 0.0,
+                'bytes': 0, 'speed_sum': 0.0, 'speed_count': 0,
+            })
+            totals['count'] += 1
+            totals['errors'] += 1 if record['error'] else 0
+            totals['wall_seconds'] += record['wall_seconds']
+            totals['cpu_seconds'] += record['cpu_seconds']
+            totals['child_cpu_seconds'] += record.get('child_cpu_seconds') or 0
+            totals['bytes'] += record.get('bytes') or 0
+            if record.get('ffmpeg_speed'):
+                totals['speed_sum'] += record['ffmpeg_speed']
+                totals['speed_count'] += 1
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def recent_spans(self, stage=None):
+        with self._lock:
+            return [record for record in self._recent if stage is None or record['stage'] == stage]
+
+    def totals(self):
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self._totals.items()}
+
+    def _start_profile(self):
+        # One profiler per thread, only for the outermost span in that thread
+        if not self.profiling or getattr(self._local, 'profiler', None):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows only one active profiler at a time
+            if not self._profile_warning_shown:
+                self._profile_warning_shown = True
+                print("Profiling is limited to one thread at a time on this Python version")
+            return None
+        self._local.profiler = profiler
+        return profiler
+
+    def _stop_profile(self, profiler):
+        if profiler is None:
+            return
+        profiler.disable()
+        self._local.profiler = None
+        with self._lock:
+            self._profiles.append(profiler)
+
+    def write_profile(self, path):
+        """
+        Writes the merged cProfile stats of every profiled span, for
+        `python -m pstats` or snakeviz. Returns False if nothing was profiled.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path)
+        return True
+
+    def prometheus_text(self):
+        """
+        Returns the per-stage totals in the Prometheus text exposition format.
+        """
+        metrics = [
+            ("ytdwm_stage_runs_total", "counter", "Spans finished per stage", 'count'),
+            ("ytdwm_stage_errors_total", "counter", "Spans that raised per stage", 'errors'),
+            ("ytdwm_stage_wall_seconds_total", "counter", "Wall time per stage", 'wall_seconds'),
+            ("ytdwm_stage_cpu_seconds_total", "counter", "Python thread CPU time per stage", 'cpu_seconds'),
+            ("ytdwm_stage_child_cpu_seconds_total", "counter",
+             "CPU time of child processes (ffmpeg) finished during each stage", 'child_cpu_seconds'),
+            ("ytdwm_stage_bytes_total", "counter", "Bytes transferred or written per stage", 'bytes'),
+        ]
+        totals = self.totals()
+        lines = []
+        for name, metric_type, help_text, key in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, stage_totals in sorted(totals.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {stage_totals[key]}')
+        lines.append("# HELP ytdwm_ffmpeg_speed_average Average ffmpeg speed (x realtime) per stage")
+        lines.append("# TYPE ytdwm_ffmpeg_speed_average gauge")
+        for stage, stage_totals in sorted(totals.items()):
+            if stage_totals['speed_count']:
+                lines.append(f'ytdwm_ffmpeg_speed_average{{stage="{stage}"}} '
+                             f'{stage_totals["speed_sum"] / stage_totals["speed_count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+
+recorder = Recorder()
+
+def span(stage, **attributes):
+    """
+    Returns a `Span` for a pipeline stage, recorded by the shared recorder.
+    """
+    return Span(recorder, stage, attributes)
+
+def configure_instrumentation(jsonl_path=None, profile=False):
+    """
+    Sets where spans are written and whether Python code run inside spans is profiled.
+    """
+    recorder.configure(jsonl_path=jsonl_path, profile=profile)
+
+def configure_from_environment():
+    """
+    Applies the YTDWM_METRICS / YTDWM_PROFILE settings and returns a
+    function that writes the Prometheus and profile files on exit.
+    """
+    configure_instrumentation(jsonl_path=os.environ.get(METRICS_ENV) or None,
+                              profile=bool(os.environ.get(PROFILE_ENV)))
+
+    def write_reports():
+        if os.environ.get(PROMETHEUS_ENV):
+            recorder.write_prometheus(os.environ[PROMETHEUS_ENV])
+        if os.environ.get(PROFILE_ENV):
+            recorder.write_profile(os.environ[PROFILE_ENV])
+    return write_reports
@@ -0,0 +1,583 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from downloader import configure_info_cache, download_video, get_video_id, process_url, select_video_codec, warm_up_yt_dlp
+from encode_scheduler import DEFAULT_CONCURRENT_JOBS, configure_encode_scheduler
+from encoder_policy import ENCODER_PROFILES
+from ffmpeg_caps import CACHE_DIR
+from format_policy import FORMAT_POLICIES, choose_formats, get_policy
+from instrumentation import recorder
+from output_store import DEFAULT_MAX_BYTES, OUTPUT_STORE_DIR, OutputStore
+from watermark import WATERMARK_ENGINES, validate_windows
+
+# Long-running local service: one process owns the worker pool, the warm
+# yt_dlp import, the info and encoder caches and the encode CPU budget, and
+# any number of clients (GUIs, scripts, the CLI on other machines) submit
+# jobs to it over HTTP. Nothing here may import tkinter.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Events kept per job for `/jobs/<id>/events`; older ones are dropped
+MAX_JOB_EVENTS = 1000
+
+# Seconds a streaming client waits for new events before checking the connection
+EVENT_WAIT_TIMEOUT = 15
+
+# Job and video states
+QUEUED = "queued"
+RESOLVING = "resolving"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Longest URL and watermark text a request may send
+MAX_URL_LENGTH = 2048
+MAX_WATERMARK_TEXT = 200
+
+def _number(name, value, minimum, maximum, integer=False):
+    kinds = (int,) if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not minimum <= value <= maximum:
+        kind = "an integer" if integer else "a number"
+        raise ValueError(f"'{name}' must be {kind} from {minimum} to {maximum}")
+    return value
+
+def _flag(name, value):
+    if not isinstance(value, bool):
+        raise ValueError(f"'{name}' must be true or false")
+    return value
+
+def _choice(name, value, choices):
+    if value not in choices:
+        raise ValueError(f"'{name}' must be one of: {', '.join(choices)}")
+    return value
+
+def _windows(name, value):
+    if not isinstance(value, list):
+        raise ValueError(f"'{name}' must be [window, period] in seconds")
+    window, period = validate_windows(value)
+    # Each period adds pieces to the encode plan; keep a request from asking for millions
+    if period < 1:
+        raise ValueError(f"'{name}' period must be at least 1 second")
+    return (window, period)
+
+# The `add_moving_watermark` and `download_stage` options a request may set,
+# each with its check. Anything else (encoders, callbacks, schedulers) stays server-side.
+WATERMARK_OPTION_CHECKS = {
+    'engine': lambda name, value: _choice(name, value, WATERMARK_ENGINES),
+    'encoder_profile': lambda name, value: _choice(name, value, ENCODER_PROFILES),
+    'windows': _windows,
+    'segments': lambda name, value: _number(name, value, 1, 64, integer=True),
+    'workers': lambda name, value: _number(name, value, 1, 64, integer=True),
+    'threads_per_worker': lambda name, value: _number(name, value, 1, 256, integer=True),
+}
+DOWNLOAD_OPTION_CHECKS = {
+    'connections': lambda name, value: _number(name, value, 1, 32, integer=True),
+    'chunk_size': lambda name, value: _number(name, value, 64 * 1024, 1024 ** 3, integer=True),
+    'fragment_downloads': lambda name, value: _number(name, value, 1, 32, integer=True),
+    'parallel_streams': _flag,
+    'range_download': _flag,
+    'retries': lambda name, value: _number(name, value, 1, 10, integer=True),
+    'timeout': lambda name, value: _number(name, value, 1, 600),
+}
+
+def _check_options(name, options, checks):
+    if not isinstance(options, dict):
+        raise ValueError(f"'{name}' must be an object")
+    unknown = sorted(set(options) - set(checks))
+    if unknown:
+        raise ValueError(f"Unknown {name}: {', '.join(unknown)}")
+    return {key: checks[key](f"{name}.{key}", value) for key, value in options.items()}
+
+def validate_request(request, root):
+    """
+    Checks a submitted job request and returns a normalized copy.
+
+    Only the documented fields are accepted, each with its type and range;
+    `output_dir` is resolved and must stay inside `root`, the server's own
+    output folder. Fields set to null are left out.
+
+    Raises:
+        ValueError: Naming the first field that is missing, unknown or invalid
+    """
+    if not isinstance(request, dict):
+        raise ValueError("A job must be a JSON object")
+    request = {key: value for key, value in request.items() if value is not None}
+    checks = {
+        'url': lambda value: value,
+        'output_dir': lambda value: value,
+        'watermark': lambda value: _flag('watermark', value),
+        'watermark_text': lambda value: value,
+        'format_policy': lambda value: _choice('format_policy', value, sorted(FORMAT_POLICIES)),
+        'max_minutes': lambda value: _number('max_minutes', value, 0.1, 7 * 24 * 60),
+        'max_mb': lambda value: _number('max_mb', value, 1, 1024 ** 2),
+        'watermark_options': lambda value: _check_options('watermark_options', value, WATERMARK_OPTION_CHECKS),
+        'download_options': lambda value: _check_options('download_options', value, DOWNLOAD_OPTION_CHECKS),
+    }
+    unknown = sorted(set(request) - set(checks))
+    if unknown:
+        raise ValueError(f"Unknown job fields: {', '.join(unknown)}")
+    url = request.get('url')
+    if not isinstance(url, str) or not url.strip() or len(url) > MAX_URL_LENGTH:
+        raise ValueError(f"A job needs a 'url' of at most {MAX_URL_LENGTH} characters")
+    text = request.get('watermark_text', "LIMITLESS MEDIA")
+    if (not isinstance(text, str) or not text.strip() or len(text) > MAX_WATERMARK_TEXT
+            or any(not char.isprintable() for char in text)):
+        raise ValueError(f"'watermark_text' must be 1 to {MAX_WATERMARK_TEXT} printable characters")
+
+    normalized = {key: checks[key](value) for key, value in request.items()}
+    normalized['url'] = url.strip()
+    root = os.path.realpath(root)
+    output_dir = request.get('output_dir', "")
+    if not isinstance(output_dir, str):
+        raise ValueError("'output_dir' must be a string")
+    output_dir = os.path.realpath(os.path.join(root, output_dir))
+    if os.path.commonpath([root, output_dir]) != root:
+        raise ValueError("'output_dir' must be inside the server's output folder")
+    normalized['output_dir'] = output_dir
+    return normalized
+
+class JobCancelled(Exception):
+    """
+    Raised from a progress callback to stop a video whose job was cancelled.
+    """
+
+class Job:
+    """
+    One submitted URL (a video or a whole playlist) and the videos it expanded to.
+
+    Every change is also posted as an event with a sequence number, so
+    clients can stream them with `events_since`. Progress events for the
+    same video replace each other while nobody has read them.
+    """
+
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.url = request['url']
+        self.state = QUEUED
+        self.error = None
+        self.is_playlist = False
+        self.videos = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self._events = deque(maxlen=MAX_JOB_EVENTS)
+        self._sequence = itertools.count(1)
+        self._condition = threading.Condition()
+        self._futures = []
+
+    def post(self, event_type, **fields):
+        with self._condition:
+            last = self._events[-1] if self._events else None
+            if (event_type == 'video_progress' and last and last['type'] == 'video_progress'
+                    and last['index'] == fields.get('index')):
+                self._events.pop()
+            self._events.append({'seq': next(self._sequence), 'type': event_type, 'time': time.time(), **fields})
+            self._condition.notify_all()
+
+    def set_state(self, state, error=None):
+        with self._condition:
+            self.state = state
+            self.error = error
+            if state in FINISHED_STATES:
+                self.finished_at = time.time()
+        self.post('job_state', state=state, error=error)
+
+    def update_video(self, index, **fields):
+        with self._condition:
+            self.videos[index].update(fields)
+            video = dict(self.videos[index])
+        if 'percent' in fields and len(fields) == 1:
+            self.post('video_progress', index=index, percent=fields['percent'])
+        else:
+            self.post('video_state', index=index, video=video)
+
+    def events_since(self, sequence, timeout=None):
+        """
+        Returns the events after `sequence`, waiting up to `timeout` seconds
+        for one if there are none yet.
+        """
+        with self._condition:
+            if timeout and not self.is_finished() and not any(e['seq'] > sequence for e in self._events):
+                self._condition.wait(timeout)
+            return [event for event in self._events if event['seq'] > sequence]
+
+    def is_finished(self):
+        return self.state in FINISHED_STATES
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'id': self.id,
+                'url': self.url,
+                'state': self.state,
+                'error': self.error,
+                'is_playlist': self.is_playlist,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'videos': [dict(video) for video in self.videos],
+            }
+
+class JobManager:
+    """
+    Runs submitted jobs on one shared worker pool.
+
+    Each job is resolved with `resolver` (a `process_url`-compatible
+    function), formats are picked with the job's format policy, and every
+    video is then run through `downloader` (a `download_video`-compatible
+    function) on the shared pool. Encodes draw from the process-wide encode
+    scheduler, and all jobs share the info cache and the output store.
+    Both functions can be replaced, e.g. with a local stand-in extractor.
+
+    Args:
+        output_dir (str): Folder for finished videos unless a job names its own
+        workers (int): Videos downloaded and watermarked at once, across all jobs
+        resolve_workers (int): Playlist entries resolved at once per job
+        resolver (function): Expands and resolves a URL, see `downloader.process_url`
+        downloader (function): Downloads one video, see `downloader.download_video`
+        output_store (OutputStore, optional): Shared store of finished videos
+    """
+
+    def __init__(self, output_dir="Videos", workers=2, resolve_workers=8, resolver=process_url,
+                 downloader=download_video, output_store=None):
+        self.output_dir = output_dir
+        self.resolve_workers = resolve_workers
+        self.resolver = resolver
+        self.downloader = downloader
+        self.output_store = output_store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._resolve_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="job-resolve")
+        self._video_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job-video")
+
+    def submit(self, request):
+        """
+        Queues a job.
+
+        Args:
+            request (dict): 'url' plus optional 'output_dir' (relative to the
+                server's output folder), 'watermark', 'watermark_text',
+                'format_policy', 'max_minutes', 'max_mb', 'watermark_options'
+                and 'download_options'; see `validate_request`
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            ValueError: If the request is invalid, before anything is queued
+        """
+        request = validate_request(request, self.output_dir)
+        with self._lock:
+            job = Job(str(next(self._ids)), request)
+            self._jobs[job.id] = job
+        job.post('job_state', state=QUEUED, error=None)
+        self._resolve_pool.submit(self._resolve_job, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """
+        Cancels a job: queued videos never start and running ones stop at
+        their next progress update (ffmpeg is killed).
+
+        Returns:
+            Job: The job, or None if there is no such job
+        """
+        job = self.get(job_id)
+        if job is None or job.is_finished():
+            return job
+        job.cancelled.set()
+        for future in job._futures:
+            future.cancel()
+        if job.state in (QUEUED, RESOLVING):
+            job.set_state(CANCELLED)
+        else:
+            self._finish_if_done(job)
+        return job
+
+    def shutdown(self):
+        for job in self.list_jobs():
+            self.cancel(job.id)
+        self._resolve_pool.shutdown(wait=False)
+        self._video_pool.shutdown(wait=True)
+
+    def _resolve_job(self, job):
+        if job.cancelled.is_set():
+            return
+        request = job.request
+        watermark = request.get('watermark', True)
+        job.set_state(RESOLVING)
+        try:
+            policy = get_policy(request.get('format_policy', 'best'), max_minutes=request.get('max_minutes'),
+                                max_mb=request.get('max_mb'))
+            os.makedirs(request['output_dir'], exist_ok=True)
+            result = self.resolver(request['url'], request['output_dir'],
+                                   watermark=watermark,
+                                   watermark_text=request.get('watermark_text', "LIMITLESS MEDIA"),
+                                   max_workers=self.resolve_workers)
+        except Exception as e:
+            job.set_state(FAILED, error=str(e))
+            return
+        if job.cancelled.is_set():
+            return
+
+        plans = []
+        with job._condition:
+            job.is_playlist = result['is_playlist']
+            for video in result['videos']:
+                entry = {'url': video['url'], 'video_id': get_video_id(video['url']), 'title': video['title'],
+                         'state': QUEUED, 'percent': 0.0, 'output': None, 'error': None}
+                formats = None
+                if video['status'] != 'ready' or not video['formats']:
+                    entry.update(state=FAILED, error=video['status'])
+                else:
+                    try:
+                        formats = choose_formats(video['formats'], policy, duration=video.get('duration'),
+                                                 watermark=watermark)
+                    except Exception as e:
+                        entry.update(state=FAILED, error=f"No usable formats: {e}")
+                job.videos.append(entry)
+                plans.append(formats)
+
+        job.set_state(RUNNING)
+        for index, formats in enumerate(plans):
+            if formats:
+                job._futures.append(self._video_pool.submit(self._run_video, job, index, *formats))
+        self._finish_if_done(job)
+
+    def _run_video(self, job, index, video_format_id, audio_format_id):
+        if job.cancelled.is_set():
+            job.update_video(index, state=CANCELLED)
+            self._finish_if_done(job)
+            return
+        request = job.request
+        job.update_video(index, state=RUNNING, video_format_id=video_format_id, audio_format_id=audio_format_id)
+
+        def progress(percent):
+            if job.cancelled.is_set():
+                raise JobCancelled(job.id)
+            job.update_video(index, percent=percent)
+
+        try:
+            success = self.downloader(
+                job.videos[index]['url'], video_format_id, audio_format_id, request['output_dir'],
+                watermark=request.get('watermark', True),
+                watermark_text=request.get('watermark_text', "LIMITLESS MEDIA"),
+                progress_callback=progress,
+                watermark_options=request.get('watermark_options'),
+                download_options=request.get('download_options'),
+                output_store=self.output_store,
+            )
+            error = None if success else "Download or watermarking failed"
+        except Exception as e:
+            success, error = False, str(e)
+
+        if job.cancelled.is_set() and not success:
+            job.update_video(index, state=CANCELLED)
+        elif success:
+            job.update_video(index, state=DONE, percent=100.0)
+        else:
+            job.update_video(index, state=FAILED, error=error)
+        self._finish_if_done(job)
+
+    def _finish_if_done(self, job):
+        with job._condition:
+            if job.is_finished() or job.state != RUNNING:
+                return
+            if job.cancelled.is_set():
+                # Videos that were still queued will never run
+                for index, video in enumerate(job.videos):
+                    if video['state'] == QUEUED:
+                        video['state'] = CANCELLED
+            states = [video['state'] for video in job.videos]
+            if any(state not in FINISHED_STATES for state in states):
+                return
+        if job.cancelled.is_set():
+            job.set_state(CANCELLED)
+        elif states and all(state == DONE for state in states):
+            job.set_state(DONE)
+        else:
+            job.set_state(FAILED, error=f"{states.count(FAILED)} of {len(states)} videos failed")
+
+def make_handler(manager):
+    """
+    Returns the request handler class serving `manager`'s jobs:
+
+        GET    /health               Liveness and job count
+        GET    /metrics              Per-stage timing totals (Prometheus text)
+        GET    /jobs                 Every job
+        POST   /jobs                 Submit {"url": ..., ...}, see `JobManager.submit`
+        GET    /jobs/<id>            One job and its videos
+        GET    /jobs/<id>/events     JSON lines, streamed until the job finishes (?since=<seq>)
+        POST   /jobs/<id>/cancel     Cancel a job (DELETE /jobs/<id> does the same)
+    """
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        server_version = "YTDownloadWithWM"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self):
+            path = urlparse(self.path).path.rstrip("/")
+            match = re.fullmatch(r"/jobs/([^/]+)(?:/(events|cancel))?", path)
+            if match:
+                return path, manager.get(match.group(1)), match.group(2)
+            return path, None, None
+
+        def do_GET(self):
+            path, job, action = self.route()
+            if path == "/health":
+                self.send_json(200, {'status': 'ok', 'jobs': len(manager.list_jobs())})
+            elif path == "/metrics":
+                data = recorder.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif path == "/jobs":
+                self.send_json(200, {'jobs': [job.snapshot() for job in manager.list_jobs()]})
+            elif job and action is None:
+                self.send_json(200, job.snapshot())
+            elif job and action == "events":
+                self.stream_events(job)
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def stream_events(self, job):
+            query = parse_qs(urlparse(self.path).query)
+            try:
+                sequence = int(query.get('since', ['0'])[0])
+            except ValueError:
+                sequence = 0
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            try:
+                while True:
+                    finished = job.is_finished()
+                    events = job.events_since(sequence, timeout=None if finished else EVENT_WAIT_TIMEOUT)
+                    for event in events:
+                        self.wfile.write((json.dumps(event) + "\n").encode('utf-8'))
+                        sequence = event['seq']
+                    self.wfile.flush()
+                    if finished and not events:
+                        return
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            path, job, action = self.route()
+            if path == "/jobs":
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                    job = manager.submit(request)
+                except (ValueError, TypeError) as e:
+                    self.send_json(400, {'error': str(e)})
+                    return
+                self.send_json(202, job.snapshot())
+            elif job and action == "cancel":
+                self.send_json(200, manager.cancel(job.id).snapshot())
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_DELETE(self):
+            path, job, action = self.route()
+            if job and action is None:
+                self.send_json(200, manager.cancel(job.id).snapshot())
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+    return JobRequestHandler
+
+def create_server(manager, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Returns a ThreadingHTTPServer for `manager`; call serve_forever() on it.
+    Port 0 picks a free port (see server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(manager))
+    server.daemon_threads = True
+    return server
+
+def warm_up():
+    """
+    Imports yt_dlp and probes ffmpeg's encoders in the background, so the
+    first job does not pay for either.
+    """
+    warm_up_yt_dlp()
+    threading.Thread(target=select_video_codec, daemon=True).start()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve download and watermark jobs over HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("-o", "--output-dir", default="Videos", help="Folder for finished videos (default: Videos)")
+    parser.add_argument("--workers", type=int, default=2, help="Videos downloaded and watermarked at once, across all jobs")
+    parser.add_argument("--resolve-workers", type=int, default=8, help="Playlist entries resolved at once per job")
+    parser.add_argument("--cpu-budget", type=int,
+                        help="CPU slots shared by all encodes on this machine (default: CPU cores)")
+    parser.add_argument("--encode-threads", type=int, help="CPU slots each encode asks for (default: an equal share of the budget)")
+    parser.add_argument("--info-cache-dir", default=os.path.join(CACHE_DIR, "info"),
+                        help="Keep resolved video info here across restarts")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not reuse or keep finished videos in the output store")
+    parser.add_argument("--store-dir", default=OUTPUT_STORE_DIR, help="Output store folder")
+    parser.add_argument("--store-max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3,
+                        help="Evict the least recently used videos beyond this size")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    configure_info_cache(cache_dir=args.info_cache_dir)
+    configure_encode_scheduler(cpu_budget=args.cpu_budget, threads_per_job=args.encode_threads,
+                               concurrent_jobs=max(args.workers, DEFAULT_CONCURRENT_JOBS))
+    output_store = None if args.no_store else OutputStore(args.store_dir, int(args.store_max_gb * 1024 ** 3))
+    manager = JobManager(args.output_dir, workers=args.workers, resolve_workers=args.resolve_workers,
+                         output_store=output_store)
+    warm_up()
+
+    server = create_server(manager, args.host, args.port)
+    print(f"Serving jobs on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.shutdown()
+        if output_store:
+            output_store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
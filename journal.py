@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Kept in the output folder so a journal always travels with the videos it describes
+JOURNAL_FILENAME = ".download_journal.sqlite3"
+
+# Job states, in the order a video moves through them
+RESOLVED = "resolved"
+DOWNLOADING = "downloading"
+DOWNLOADED = "downloaded"
+WATERMARKING = "watermarking"
+DONE = "done"
+FAILED = "failed"
+
+class JobJournal:
+    """
+    Crash-safe record of where each video of a download run got to.
+
+    Every state change is committed to SQLite straight away, so after a crash
+    or restart `run_pipeline` can skip finished videos, let yt_dlp resume
+    partial downloads from their `.part` files and only redo unfinished
+    watermarking.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, JOURNAL_FILENAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                video_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                state TEXT NOT NULL,
+                video_format_id TEXT,
+                audio_format_id TEXT,
+                watermark INTEGER,
+                downloaded TEXT,
+                output_file TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Journals from before watermark settings were recorded
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        if 'settings' not in columns:
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN settings TEXT")
+
+    def get(self, video_id):
+        """
+        Returns the journal entry for a video as a dict, or None.
+        """
+        with self._lock:
+            cursor = self._connection.execute("SELECT * FROM jobs WHERE video_id = ?", (video_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            entry = dict(zip([column[0] for column in cursor.description], row))
+        entry['watermark'] = bool(entry['watermark'])
+        entry['downloaded'] = json.loads(entry['downloaded']) if entry['downloaded'] else None
+        return entry
+
+    def record_resolved(self, video_id, url, video_format_id, audio_format_id, watermark, settings=None):
+        """
+        Records the formats chosen for a video. Existing progress is kept if
+        the choice has not changed, and reset if it has.
+
+        Args:
+            settings (str, optional): Key of the watermark settings (see
+                `sync_archive.settings_key`); a finished video made with
+                other settings is made again
+        """
+        entry = self.get(video_id)
+        if entry and (entry['video_format_id'], entry['audio_format_id'], entry['watermark'], entry['settings']) == \
+                (video_format_id, audio_format_id, bool(watermark), settings):
+            return entry
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "(video_id, url, state, video_format_id, audio_format_id, watermark, settings, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, url, RESOLVED, video_format_id, audio_format_id, int(bool(watermark)), settings,
+                 time.time())
+            )
+        return self.get(video_id)
+
+    def set_state(self, video_id, state, downloaded=None, output_file=None, error=None):
+        """
+        Moves a video to a new state, storing the download result, output
+        path or error that came with it.
+        """
+        updates = {'state': state, 'updated_at': time.time(), 'error': error}
+        if downloaded is not None:
+            updates['downloaded'] = json.dumps(downloaded)
+        if output_file is not None:
+            updates['output_file'] = output_file
+        assignments = ", ".join(f"{column} = ?" for column in updates)
+        with self._lock:
+            self._connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE video_id = ?",
+                (*updates.values(), video_id)
+            )
+
+    def entries(self):
+        """
+        Returns every journal entry.
+        """
+        with self._lock:
+            video_ids = [row[0] for row in self._connection.execute("SELECT video_id FROM jobs")]
+        return [self.get(video_id) for video_id in video_ids]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
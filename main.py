@@ -1,17 +1,28 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import threading
-from downloader import extract_video_info, get_best_audio_format, get_best_video_format, filter_matching_video_formats, download_video, process_url
+from downloader import extract_video_info, get_best_audio_format, get_best_video_format, filter_matching_video_formats, download_video, process_url, warm_up_yt_dlp
 import os
 import time
+from pipeline import run_pipeline
+from journal import JobJournal
+from output_store import OutputStore
+from playlist_view import SELECTED, PlaylistRow, RowResolver, VirtualPlaylistView
+from ui_events import UIEventBus
+from format_policy import FormatPolicy
+from instrumentation import configure_from_environment
 from version_variable import VERSION
 
 # Global variables and constants
 filtered_video_formats = None  # To store filtered video formats
-format_vars = {}  # To store format variables for playlist videos
-watermark_vars = {}  # To store watermark variables for playlist videos
-video_selected_vars = {}  # To store video selection variables for playlist videos
+playlist_rows = []  # PlaylistRow per playlist video, in playlist order
+playlist_progress = {}  # Job index -> percent done, for the running playlist download
+playlist_view = None  # VirtualPlaylistView showing playlist_rows
+row_resolver = None  # Resolves the formats of lazily loaded playlist rows
 stop_animation = threading.Event()  # Event to control loading animation
+PLAYLIST_RESOLVE_WORKERS = 8  # Playlist entries resolved concurrently
+PLAYLIST_DOWNLOAD_WORKERS = 2  # Playlist videos downloaded concurrently
+PLAYLIST_ENCODE_WORKERS = 1  # Playlist videos watermarked concurrently
 
 # Global variables for storing video format information
 selected_format = None  # To store the selected video format
@@ -62,7 +73,7 @@ def fetch_best_formats():
 
     # Populate dropdown with matching video formats
     format_id_map = {
-        f"{f['format_note']} => ID: {f['format_id']}, Res: {f.get('resolution', 'N/A')}, FPS: {f.get('fps', 'N/A')}, Size: {f.get('filesize', 0) / 1024 / 1024:.2f} MB": f['format_id']
+        f"{f['format_note']} => ID: {f['format_id']}, Res: {f.get('resolution', 'N/A')}, FPS: {f.get('fps', 'N/A')}, Size: {(f.get('filesize') or f.get('filesize_approx') or 0) / 1024 / 1024:.2f} MB": f['format_id']
         for f in filtered_video_formats
     }
 
@@ -104,20 +115,23 @@ def handle_download():
     # Check if watermark is enabled
     add_watermark = watermark_enabled.get()
 
-    # Progress update callback
+    # Progress update callback; the UI bus applies the latest value once per frame
     def progress_callback(progress):
-        progress_bar['value'] = progress  # Update progress bar
-        app.update_idletasks()
+        ui_bus.post('progress', value=progress)
 
     # Threaded download function
     def threaded_download():
-        progress_bar['value'] = 0  # Reset progress bar before download starts
-        result = download_video(
-            url, video_format_id, audio_format_id, output_path,
-            watermark=add_watermark, progress_callback=progress_callback
-        )
-        label.config(text=result)
-        progress_bar['value'] = 0  # Reset progress bar after completion
+        ui_bus.post('progress', value=0)  # Reset progress bar before download starts
+        output_store = OutputStore()
+        try:
+            result = download_video(
+                url, video_format_id, audio_format_id, output_path,
+                watermark=add_watermark, progress_callback=progress_callback, output_store=output_store
+            )
+        finally:
+            output_store.close()
+        ui_bus.post('status', text="✅ Download complete!" if result else "❌ Download failed.")
+        ui_bus.post('progress', value=0)  # Reset progress bar after completion
 
     # Start download in a new thread
     threading.Thread(target=threaded_download, daemon=True).start()
@@ -127,236 +141,241 @@ def download_playlist_videos():
     Download all videos in the playlist with their selected formats and watermark settings
     """
     print("Starting playlist download...")
-    print(f"Format vars: {format_vars}")
-    print(f"Watermark vars: {watermark_vars}")
-    print(f"Video selected vars: {video_selected_vars}")
+    selected_rows = [row for row in playlist_rows if row.selected]
+    print(f"Selected videos: {len(selected_rows)} of {len(playlist_rows)}")
+    
+    # Get download path
+    download_path = filedialog.askdirectory(title="Select Playlist Download Folder")
+    if not download_path:
+        label.config(text="⚠️ Download cancelled.")
+        return
     
     def threaded_playlist_download():
-        total_videos = len(format_vars)
+        total_videos = len(playlist_rows)
         print(f"Total videos to download: {total_videos}")
         
-        # Get download path
-        download_path = filedialog.askdirectory(title="Select Playlist Download Folder")
-        if not download_path:
-            label.config(text="⚠️ Download cancelled.")
-            return
-        
         # Create a playlist directory with timestamp
         playlist_dir = os.path.join(download_path, "Videos")
         os.makedirs(playlist_dir, exist_ok=True)
         
-        success_count = 0  # Initialize success counter
-        
-        for i, (video_url, format_var) in enumerate(format_vars.items(), 1):
-            if not video_selected_vars[video_url].get():
-                continue  # Skip if video is not selected
-            
-            selected_format_str = format_var['format_var'].get()
-            # Extract format ID from the string (format is "format_note => ID: format_id, Res: resolution, FPS: fps, Size: filesize MB")
-            format_id = selected_format_str.split("ID: ")[1].split(",")[0].strip() if "ID: " in selected_format_str else selected_format_str
-            
-            audio_format_id = format_var['audio_format_id']
-            watermark = watermark_vars[video_url].get() if video_url in watermark_vars else False
-            print(f"Downloading video {i}: {video_url}")
-            print(f"Selected format ID: {format_id}")
-            print(f"Audio format ID: {audio_format_id}")
-            print(f"Watermark: {watermark}")
-            
-            # Update label to show which video is being downloaded
-            label.config(text=f"Downloading video {i} of {total_videos}...")
+        # Collect the selected videos into pipeline jobs
+        jobs = []
+        for i, row in enumerate(playlist_rows, 1):
+            if row.selected and row.is_pending():
+                # Resolved in the background, in playlist order, and at the
+                # latest when the job reaches a download worker
+                row_resolver.request(row, SELECTED)
+                jobs.append({
+                    'url': row.url,
+                    'output_path': playlist_dir,
+                    'watermark': row.watermark,
+                    'resolve': lambda row=row: resolve_row_formats(row),
+                })
+                continue
+            if not row.selected or not row.is_ready():
+                continue  # Skip if video is not selected or cannot be downloaded
             
-            try:
-                # Use existing download function's core logic
-                download_success = download_video(video_url, format_id, audio_format_id, playlist_dir, watermark)
-                
-                if download_success:
-                    success_count += 1  # Increment success count if download was successful
-                
-                # Update progress for this video
-                progress_bar["value"] = (i / total_videos) * 100
-                root.update_idletasks()
-            except Exception as e:
-                print(f"Error downloading video {i}: {str(e)}")
-                label.config(text=f"Error downloading video {i}: {str(e)}")
+            # Rows that were never scrolled into view still need their default format
+            row.ensure_format_options()
+            if not row.video_format_id:
                 continue
+            print(f"Queueing video {i}: {row.url}")
+            print(f"Selected format ID: {row.video_format_id}")
+            print(f"Audio format ID: {row.audio_format_id}")
+            print(f"Watermark: {row.watermark}")
+            jobs.append({
+                'url': row.url,
+                'video_format_id': row.video_format_id,
+                'audio_format_id': row.audio_format_id,
+                'output_path': playlist_dir,
+                'watermark': row.watermark,
+            })
+        
+        finished = [0]  # Videos finished so far, successful or not
+        
+        # Runs on pipeline threads: only post to the UI bus, never touch Tk here
+        def pipeline_progress(event):
+            if event['type'] == 'video_progress':
+                ui_bus.post('video_progress', key=event['index'], percent=event['percent'], total=len(jobs))
+                return
+            if event['type'] == 'video_downloaded':
+                ui_bus.post('status', text=f"Downloaded video {event['index'] + 1}, watermarking...")
+                return
+            finished[0] += 1
+            if event['type'] == 'video_failed':
+                ui_bus.post('status', text=f"Error downloading video {event['index'] + 1}: {event['result']['error']}")
+            else:
+                ui_bus.post('status', text=f"Finished {finished[0]} of {len(jobs)} videos...")
+            # A finished video counts as complete, successful or not
+            ui_bus.post('video_progress', key=event['index'], percent=100, total=len(jobs))
+        
+        ui_bus.post('status', text=f"Downloading {len(jobs)} videos...")
+        # The journal lets an interrupted run pick up where it stopped, and the
+        # output store reuses videos made by earlier runs
+        journal = JobJournal(playlist_dir)
+        output_store = OutputStore()
+        try:
+            results = run_pipeline(
+                jobs,
+                download_workers=PLAYLIST_DOWNLOAD_WORKERS,
+                encode_workers=PLAYLIST_ENCODE_WORKERS,
+                progress_callback=pipeline_progress,
+                journal=journal,
+                output_store=output_store
+            )
+        finally:
+            journal.close()
+            output_store.close()
+        success_count = sum(1 for result in results if result['success'])
         
         # Update final message based on success count
         if success_count == 0:
-            label.config(text="⚠️ No videos were selected for download.")
-        elif success_count == len([v for v in video_selected_vars.values() if v.get()]):
-            label.config(text="✅ All selected videos downloaded! ✅", foreground='green', font=('Helvetica', 12, 'bold'))
+            ui_bus.post('status', text="⚠️ No videos were selected for download.")
+        elif success_count == len(selected_rows):
+            ui_bus.post('status', text="✅ All selected videos downloaded! ✅", foreground='green', font=('Helvetica', 12, 'bold'))
         else:
-            label.config(text=f"❌ Downloaded {success_count} out of {len([v for v in video_selected_vars.values() if v.get()])} selected videos. Try downloading later. ❌ ")
-        progress_bar["value"] = 0
+            ui_bus.post('status', text=f"❌ Downloaded {success_count} out of {len(selected_rows)} selected videos. Try downloading later. ❌ ")
+        ui_bus.post('progress', value=0)
     
     # Reset progress bar
+    playlist_progress.clear()
     progress_bar["value"] = 0
     
     # Start download in a new thread
     threading.Thread(target=threaded_playlist_download, daemon=True).start()
 
+def resolve_row_formats(row):
+    """
+    Resolves a lazily loaded row for the pipeline and returns its format IDs.
+    """
+    row_resolver.resolve_now(row)
+    row.ensure_format_options()
+    if not row.video_format_id:
+        raise ValueError(row.status if not row.is_ready() else "No suitable formats found")
+    return {'video_format_id': row.video_format_id, 'audio_format_id': row.audio_format_id}
+
+def read_format_policy():
+    """
+    Returns the format policy for the time budget entered, if any.
+    """
+    try:
+        max_minutes = float(max_minutes_entry.get()) if max_minutes_entry.get().strip() else None
+    except ValueError:
+        label.config(text="⚠️ Ignoring invalid time budget.")
+        max_minutes = None
+    return FormatPolicy(max_minutes=max_minutes)
+
 def expand_window_for_playlist(playlist_info):
     """
     Show playlist information and format selection in the main window
     """
-    global format_vars, watermark_vars, video_selected_vars
-    # Clear previous variables
-    format_vars.clear()
-    watermark_vars.clear()
-    video_selected_vars.clear()
+    global playlist_rows, playlist_view, row_resolver
+    policy = read_format_policy()
+    # Rows only hold data; widgets are created for the visible ones by the view
+    playlist_rows = [PlaylistRow(video, watermark=watermark_enabled.get(), policy=policy) for video in playlist_info['videos']]
     
     # Clear any existing playlist frame
     for widget in root.winfo_children():
         if isinstance(widget, ttk.Frame) and widget.winfo_name() == 'playlist_frame':
             widget.destroy()
     
-    # Create main frame with scrollbar for playlist content
     playlist_frame = ttk.Frame(root, name='playlist_frame')
     playlist_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
     
-    # Add canvas and scrollbar
-    canvas = tk.Canvas(playlist_frame)
-    scrollbar = ttk.Scrollbar(playlist_frame, orient="vertical", command=canvas.yview)
-    scrollable_frame = ttk.Frame(canvas)
-    
-    scrollable_frame.bind(
-        "<Configure>",
-        lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-    )
-    
-    canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-    canvas.configure(yscrollcommand=scrollbar.set)
-    
-    # Pack scrollbar components
-    scrollbar.pack(side="right", fill="y")
-    canvas.pack(side="left", fill="both", expand=True)
-    
     # Add header
-    header = ttk.Label(scrollable_frame, text=(f"Playlist Videos (Total: {len(playlist_info['videos'])})" if playlist_info['is_playlist'] else "Video Information"), font=('Helvetica', 12, 'bold'))
+    header = ttk.Label(playlist_frame, text=(f"Playlist Videos (Total: {len(playlist_rows)})" if playlist_info['is_playlist'] else "Video Information"), font=('Helvetica', 12, 'bold'))
     header.pack(pady=10)
     
-    # Dictionary to store format variables for each video
-    format_vars = {}
-    watermark_vars = {}  # Add dictionary for watermark variables
-    video_selected_vars = {}  # Add dictionary for video selection variables
-    
-    # Add video entries
-    for i, video in enumerate(playlist_info['videos'], 1):
-        video_frame = ttk.LabelFrame(scrollable_frame, text=f"Video {i}")
-        video_frame.pack(fill="x", padx=5, pady=5, ipadx=5, ipady=5)
-        
-        # Checkbox for video selection
-        video_selected = tk.BooleanVar(value=True)  # Default to checked
-        checkbox = ttk.Checkbutton(video_frame, text="Select for Download", variable=video_selected)
-        checkbox.pack(anchor="w")
-        
-        # Store the video selection variable in a dictionary
-        video_selected_vars[video['url']] = video_selected
-        
-        # Video title
-        title_label = ttk.Label(video_frame, text=f"Title: {video['title']}", wraplength=700)
-        title_label.pack(anchor="w")
-        
-        if video['status'] == 'ready' and video['formats']:
-            # Format selection
-            format_frame = ttk.Frame(video_frame)
-            format_frame.pack(fill="x", pady=5)
-            
-            format_label = ttk.Label(format_frame, text="Format:")
-            format_label.pack(side="left", padx=5)
-            
-            # Create format selection dropdown
-            format_var = tk.StringVar()
-            format_vars[video['url']] = {
-                'format_var': format_var,
-                'audio_format_id': get_best_audio_format(video['formats'])['format_id']
-            }
-            
-            # Get best video format first to determine properties
-            best_video = get_best_video_format(video['formats'])
-            
-            if best_video:
-                # Get matching video formats based on best video properties
-                matching_formats = filter_matching_video_formats(video['formats'], best_video)
-                
-                # Format the combo box values
-                format_combo = ttk.Combobox(format_frame, textvariable=format_var, state="readonly", width=80)  # Made combobox wider
-                format_combo['values'] = [
-                    f"{fmt['format_note']} => ID: {fmt['format_id']}, Res: {fmt.get('resolution', 'N/A')}, FPS: {fmt.get('fps', 'N/A')}, Size: {fmt.get('filesize', 0) / 1024 / 1024:.2f} MB"
-                    for fmt in matching_formats
-                ]
-                
-                # Set default selection to first format
-                if format_combo['values']:
-                    format_combo.set(format_combo['values'][0])
-            else:
-                format_combo = ttk.Combobox(format_frame, textvariable=format_var, state="readonly", width=80)  # Made combobox wider
-                format_combo['values'] = ["No suitable formats found"]
-                
-            format_combo.pack(side="left", padx=5)
-            
-            # Add watermark checkbox
-            watermark_var = tk.BooleanVar(value=watermark_enabled.get())
-            watermark_vars[video['url']] = watermark_var  # Store the watermark variable
-            watermark_check = ttk.Checkbutton(format_frame, text="Add Watermark", variable=watermark_var, style='Switch.TCheckbutton')
-            watermark_check.pack(side="left", padx=20)
-        else:
-            error_label = ttk.Label(video_frame, text=f"Status: {video['status']}", foreground="red")
-            error_label.pack(anchor="w")
-    
     # Download button
-    download_button = tk.Button(scrollable_frame, text="Download Selected Videos", command=download_playlist_videos)
-    download_button.pack(pady=10)
-
-def check_url():
-    url = input_url.get()
+    download_button = tk.Button(playlist_frame, text="Download Selected Videos", command=download_playlist_videos)
+    download_button.pack(side="bottom", pady=10)
+    
+    # Scrollable list of videos; lazily loaded rows resolve as they come into view
+    if row_resolver:
+        row_resolver.stop()
+    row_resolver = RowResolver(workers=PLAYLIST_RESOLVE_WORKERS,
+                               on_resolved=lambda row: ui_bus.post('row_resolved', key=id(row), row=row))
+    playlist_view = VirtualPlaylistView(playlist_frame, playlist_rows, resolver=row_resolver)
+    playlist_view.pack(fill="both", expand=True)
+
+def check_url(url, watermark):
     if not url:
         return
     
     try:
-        # Clear previous format selection
-        for widget in format_frame.winfo_children():
-            widget.destroy()
+        # Process URL (could be video or playlist). Playlists come back as flat
+        # entries right away; their formats are resolved when rows are shown
+        result = process_url(url, "downloads", watermark=watermark, max_workers=PLAYLIST_RESOLVE_WORKERS, lazy=True)
         
-        # Process URL (could be video or playlist)
-        result = process_url(url, "downloads", watermark=watermark_enabled.get())  # Pass watermark state
-        
-        expand_window_for_playlist(result)
+        # The playlist view is built on the Tk thread
+        ui_bus.post('playlist', result=result)
         
     except Exception as e:
-        label.config(text=f"Error: {str(e)}")
+        ui_bus.post('status', text=f"Error: {str(e)}")
 
-def animate_loading(label, animated_text):
+def animate_loading(animated_text):
     """Animate the loading dots."""
     while not stop_animation.is_set():
         for dots in ['', '.', '..', '...']:
             if stop_animation.is_set():
                 break
-            label.config(text=animated_text + dots)
+            ui_bus.post('status', text=animated_text + dots)
             time.sleep(0.5)
 
 def stop_animating_loading():
     """Stop the loading animation."""
     stop_animation.set()
 
-def threaded_check_url():
+def threaded_check_url(url, watermark):
     try:
-        # Reset the stop event and disable button
-        stop_animation.clear()
-        fetch_best_formats_button.config(state=tk.DISABLED)
-        
         # Start loading animation in a separate thread
-        animation_thread = threading.Thread(target=animate_loading, args=(label, "Processing URL"), daemon=True)
+        animation_thread = threading.Thread(target=animate_loading, args=("Processing URL",), daemon=True)
         animation_thread.start()
 
         # Run the existing check_url function
-        check_url()
+        check_url(url, watermark)
 
     finally:
         # Stop the animation and update UI
         stop_animating_loading()
-        label.config(text="Formats fetched successfully!")
-        fetch_best_formats_button.config(state=tk.NORMAL)
+        animation_thread.join()
+        ui_bus.post('status', text="Formats fetched successfully!")
+        ui_bus.post('fetch_button', state=tk.NORMAL)
+
+def start_check_url():
+    """
+    Reads the inputs on the Tk thread and resolves the URL in the background.
+    """
+    # Reset the stop event and disable button
+    stop_animation.clear()
+    fetch_best_formats_button.config(state=tk.DISABLED)
+    
+    # Clear previous format selection
+    for widget in format_frame.winfo_children():
+        widget.destroy()
+    
+    threading.Thread(target=threaded_check_url, args=(input_url.get(), watermark_enabled.get()), daemon=True).start()
+
+def update_status(event):
+    label.config(**{option: value for option, value in event.items() if option not in ('kind', 'key')})
+
+def update_progress(event):
+    progress_bar['value'] = event['value']
+
+def update_video_progress(event):
+    # Overall playlist progress is the average over all queued videos
+    playlist_progress[event['key']] = event['percent']
+    progress_bar['value'] = sum(playlist_progress.values()) / event['total']
+
+def update_fetch_button(event):
+    fetch_best_formats_button.config(state=event['state'])
+
+def show_playlist(event):
+    expand_window_for_playlist(event['result'])
+
+def show_resolved_row(event):
+    if playlist_view and event['row'] in playlist_rows:
+        playlist_view.update_row(event['row'])
 
 # Create the Tkinter app window
 root = tk.Tk()
@@ -376,7 +395,7 @@ input_url.insert(0, "https://www.youtube.com/playlist?list=PLHc88y3ww4WCWc4kcXdQ
 input_url.pack(pady=5)
 
 # Add buttons for fetching formats and downloading
-fetch_best_formats_button = tk.Button(root, text="Fetch Best Video Formats", command=lambda: threading.Thread(target=threaded_check_url, daemon=True).start())
+fetch_best_formats_button = tk.Button(root, text="Fetch Best Video Formats", command=start_check_url)
 fetch_best_formats_button.pack(pady=10)
 
 # Add watermark checkbox
@@ -384,6 +403,13 @@ watermark_enabled = tk.BooleanVar(value=True)  # Checked by default
 watermark_checkbox = tk.Checkbutton(root, text="Add Watermark", variable=watermark_enabled)
 watermark_checkbox.pack(pady=5)
 
+# Optional time budget; formats are ranked so the default choice finishes within it
+budget_frame = tk.Frame(root)
+budget_frame.pack(pady=5)
+tk.Label(budget_frame, text="Max minutes per video (blank = no limit):").pack(side="left")
+max_minutes_entry = tk.Entry(budget_frame, width=6)
+max_minutes_entry.pack(side="left", padx=5)
+
 # Add a frame for the format dropdown
 format_frame = tk.Frame(root)
 format_frame.pack(pady=10)
@@ -400,5 +426,29 @@ version_label.pack(side=tk.BOTTOM, pady=5)
 copyright_label = tk.Label(root, text=" 2024 Limitless Media - Magid", font=("Arial", 10), fg="gray")
 copyright_label.pack(side=tk.BOTTOM, pady=5)
 
+# Worker threads report through the UI bus; it applies their updates here on the Tk thread
+ui_bus = UIEventBus(root)
+ui_bus.subscribe('status', update_status)
+ui_bus.subscribe('progress', update_progress)
+ui_bus.subscribe('video_progress', update_video_progress)
+ui_bus.subscribe('fetch_button', update_fetch_button)
+ui_bus.subscribe('playlist', show_playlist)
+ui_bus.subscribe('row_resolved', show_resolved_row)
+ui_bus.start()
+
+# Import yt_dlp in the background once the window is up, so the first fetch does not wait for it
+root.after_idle(warm_up_yt_dlp)
+
+# benchmarks/bench_startup.py sets this to time how long the window takes to appear
+if os.environ.get("YTDWM_EXIT_AFTER_STARTUP"):
+    def report_startup():
+        print("window-shown", flush=True)
+        root.destroy()
+    root.after_idle(report_startup)
+
+# YTDWM_METRICS, YTDWM_PROMETHEUS and YTDWM_PROFILE turn on timing and profiling output
+write_instrumentation_reports = configure_from_environment()
+
 # Run the Tkinter main loop
 root.mainloop()
+write_instrumentation_reports()
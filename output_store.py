@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from encoder_policy import DEFAULT_PROFILE
+from ffmpeg_caps import CACHE_DIR
+
+try:
+    import fcntl  # Only needed for reflinks, which are Linux-only anyway
+except ImportError:
+    fcntl = None
+
+OUTPUT_STORE_DIR = os.path.join(CACHE_DIR, "outputs")
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3  # 20 GB
+
+# Watermark options that only change how fast the output is made, not the output
+PERFORMANCE_ONLY_OPTIONS = ("segments", "workers", "threads_per_worker", "scheduler")
+
+# Bytes hashed from each end of a file for the integrity check
+FINGERPRINT_SAMPLE = 1024 * 1024
+
+# Linux ioctl that clones a file's extents (a reflink) on btrfs, XFS and similar
+FICLONE = 0x40049409
+
+def store_key(video_id, video_format_id, audio_format_id, watermark=True, watermark_text="LIMITLESS MEDIA",
+              watermark_options=None):
+    """
+    Returns the store key for a finished video: a hash of everything that
+    decides what the output file contains.
+    """
+    options = {k: v for k, v in (watermark_options or {}).items() if k not in PERFORMANCE_ONLY_OPTIONS}
+    options.setdefault('encoder_profile', DEFAULT_PROFILE)
+    settings = {
+        'video_id': video_id,
+        'video_format_id': video_format_id,
+        'audio_format_id': audio_format_id,
+        'watermark': bool(watermark),
+        # Watermark settings do not matter for unwatermarked output
+        'watermark_text': watermark_text if watermark else None,
+        'watermark_options': options if watermark else None,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def fingerprint(path):
+    """
+    Returns a cheap integrity fingerprint: the size plus a hash of the first
+    and last FINGERPRINT_SAMPLE bytes.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE))
+        if size > FINGERPRINT_SAMPLE:
+            f.seek(max(FINGERPRINT_SAMPLE, size - FINGERPRINT_SAMPLE))
+            digest.update(f.read(FINGERPRINT_SAMPLE))
+    return digest.hexdigest()
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link_file(source, destination):
+    """
+    Makes `destination` a copy of `source` as cheaply as the filesystem
+    allows: a reflink, else a plain copy.
+
+    Never a hardlink: ffmpeg and hand edits rewrite the delivered file in
+    place, which would also change the stored entry sharing its inode.
+
+    Returns:
+        str: 'reflink' or 'copy'
+    """
+    temp_destination = destination + ".linking"
+    if os.path.exists(temp_destination):
+        os.remove(temp_destination)
+    try:
+        _reflink(source, temp_destination)
+        method = 'reflink'
+    except OSError:
+        if os.path.exists(temp_destination):
+            os.remove(temp_destination)
+        shutil.copy2(source, temp_destination)
+        method = 'copy'
+    os.replace(temp_destination, destination)
+    return method
+
+class OutputStore:
+    """
+    Content-addressed store of finished videos.
+
+    Outputs are stored under their `store_key`, so a video that was already
+    downloaded and watermarked with the same formats and settings is linked
+    into place instead of being made again. The index lives in SQLite next
+    to the files; the least recently used entries are evicted once the
+    store is larger than `max_bytes`.
+    """
+
+    def __init__(self, store_dir=OUTPUT_STORE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(store_dir, "index.sqlite3"),
+                                           check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS outputs (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+
+    def _path(self, key):
+        return os.path.join(self.store_dir, key[:2], f"{key}.mp4")
+
+    def _forget(self, key):
+        self._connection.execute("DELETE FROM outputs WHERE key = ?", (key,))
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def get(self, key, destination):
+        """
+        Links the stored output for `key` to `destination`.
+
+        Entries whose file is missing or fails the integrity check are
+        dropped.
+
+        Returns:
+            str: destination on a hit, None on a miss
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, fingerprint FROM outputs WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            path = self._path(key)
+            size, expected = row
+            if not os.path.exists(path) or os.path.getsize(path) != size or fingerprint(path) != expected:
+                print(f"Stored output {key[:12]} failed the integrity check; dropping it")
+                self._forget(key)
+                return None
+            self._connection.execute("UPDATE outputs SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        if not (os.path.exists(destination) and os.path.samefile(path, destination)):
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            method = link_file(path, destination)
+            print(f"Reused stored output for {os.path.basename(destination)} ({method})")
+        return destination
+
+    def put(self, key, source_file):
+        """
+        Adds a finished output to the store, then evicts old entries if the
+        store is over its size limit.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            link_file(source_file, path)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO outputs (key, size, fingerprint, last_used) VALUES (?, ?, ?, ?)",
+                (key, os.path.getsize(path), fingerprint(path), time.time())
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM outputs ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._forget(key)
+            total -= size
+
+    def total_size(self):
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,294 @@
+import os
+import queue
+import threading
+from downloader import (
+    DOWNLOAD_PROGRESS_WEIGHT,
+    download_stage,
+    encode_stage,
+    get_output_file,
+    get_video_id,
+    get_video_info,
+    select_video_codec,
+)
+from output_store import store_key
+from journal import DONE, DOWNLOADED, DOWNLOADING, FAILED, WATERMARKING
+from sync_archive import settings_key
+
+# Sentinel telling a worker there is no more work
+_STOP = object()
+
+def _downloaded_files_exist(downloaded):
+    if not downloaded:
+        return False
+    files = [downloaded.get(key) for key in ('merged_input', 'video_file', 'audio_file') if downloaded.get(key)]
+    return bool(files) and all(os.path.exists(path) for path in files)
+
+def run_pipeline(jobs, download_workers=2, encode_workers=1, queue_size=None, progress_callback=None, journal=None,
+                 output_store=None):
+    """
+    Downloads and watermarks a list of videos as a two-stage pipeline.
+
+    Download workers fetch videos and hand them to encode workers through a
+    bounded queue, so the next video downloads while the previous one is being
+    watermarked. The queue bound caps how many downloads wait on disk.
+
+    `jobs` may also be an iterator, such as a generator yielding videos as
+    they are resolved: the workers start on the first job while the rest are
+    still being produced.
+
+    Args:
+        jobs (list or iterable): Dictionaries with the `download_video` arguments for each video:
+            - url: Video URL
+            - video_format_id: Selected video format ID
+            - audio_format_id: Selected audio format ID
+            - output_path: Directory to save the video
+            - watermark (bool, optional): Whether to add watermark (default True)
+            - watermark_text (str, optional): Text to use for watermark
+            - watermark_options (dict, optional): Extra `add_moving_watermark` arguments
+            - download_options (dict, optional): Per-job download limits for `download_stage`
+            - info (dict, optional): Already resolved info dict
+            - resolve (function, optional): For jobs whose formats are not
+              known yet: called when the job reaches a download worker, it
+              returns a dict with video_format_id and audio_format_id
+              (and optionally info) that is merged into the job
+        download_workers (int): Number of videos downloaded at the same time
+        encode_workers (int): Number of videos watermarked at the same time
+        queue_size (int, optional): Downloaded videos allowed to wait for an
+            encode worker. Defaults to the number of encode workers.
+        progress_callback (function, optional): Called from worker threads with
+            {'type': 'video_downloaded' | 'video_done' | 'video_failed' | 'video_skipped',
+             'index': job index, 'result': result dict, 'total_videos': count}
+            and, while a video downloads and encodes,
+            {'type': 'video_progress', 'index': job index, 'percent': combined
+             download and encode percentage, 'total_videos': count}
+            where count is the number of jobs taken from `jobs` so far
+        journal (JobJournal, optional): Records each video's progress. Videos
+            the journal marks as done are skipped, and downloaded videos whose
+            watermarking did not finish go straight to the encode stage
+        output_store (OutputStore, optional): Finished videos are added to it,
+            and videos it already holds are linked into place without any
+            download or encode (reported as 'video_done' with 'cached' set)
+
+    Returns:
+        list: One result per job, in the order `jobs` produced them, each containing:
+            - url: Video URL
+            - success (bool): Whether the video was downloaded and encoded
+            - output: Path of the finished video, or None
+            - error: Error message, or None
+            - skipped (bool): Whether the journal already had the video done
+            - cached (bool): Whether the output store already had the video
+    """
+    if isinstance(jobs, (list, tuple)):
+        if not jobs:
+            return []
+        download_workers = min(download_workers, len(jobs))
+        encode_workers = min(encode_workers, len(jobs))
+    source = iter(jobs)
+    jobs = []     # Jobs taken from the source so far; indexes are positions in here
+    results = []
+    video_ids = []
+
+    download_workers = max(1, download_workers)
+    encode_workers = max(1, encode_workers)
+    job_queue = queue.Queue()
+    encode_queue = queue.Queue(maxsize=queue_size or encode_workers)
+
+    # Pick the encoder once for the whole run instead of once per video
+    codec_lock = threading.Lock()
+    selected_codec = []
+
+    def get_video_codec():
+        with codec_lock:
+            if not selected_codec:
+                selected_codec.append(select_video_codec(prefer_cpu=False))
+            return selected_codec[0]
+
+    def report(event_type, index):
+        if progress_callback:
+            progress_callback({
+                'type': event_type,
+                'index': index,
+                'result': results[index],
+                'total_videos': len(jobs)
+            })
+
+    def report_progress(index, percent):
+        if progress_callback:
+            progress_callback({
+                'type': 'video_progress',
+                'index': index,
+                'percent': percent,
+                'total_videos': len(jobs)
+            })
+
+    def job_store_key(index):
+        job = jobs[index]
+        return store_key(video_ids[index], job['video_format_id'], job['audio_format_id'], job.get('watermark', True),
+                         job.get('watermark_text', "LIMITLESS MEDIA"), job.get('watermark_options'))
+
+    def job_settings(index):
+        job = jobs[index]
+        return settings_key(job.get('watermark', True), job.get('watermark_text', "LIMITLESS MEDIA"),
+                            job.get('watermark_options'))
+
+    def prepare(index):
+        """
+        Resolves the formats of a job added with `resolve`; False if that failed.
+        """
+        job = jobs[index]
+        resolve = job.pop('resolve', None)
+        if resolve is None:
+            return True
+        try:
+            job.update(resolve())
+        except Exception as e:
+            fail(index, e)
+            return False
+        if journal:
+            journal.record_resolved(video_ids[index], job['url'], job['video_format_id'], job['audio_format_id'],
+                                    job.get('watermark', True), job_settings(index))
+        return True
+
+    def reuse_stored(index):
+        """
+        Links a stored output into place; True on a hit.
+        """
+        if not output_store:
+            return False
+        job = jobs[index]
+        try:
+            info = job.get('info') or get_video_info(job['url'])
+            output = output_store.get(job_store_key(index), get_output_file(job['output_path'], info))
+        except Exception as e:
+            print(f"Output store lookup failed for video {index + 1}: {e}")
+            return False
+        if not output:
+            return False
+        results[index].update(success=True, output=output, cached=True)
+        record(index, DONE, output_file=output)
+        report('video_done', index)
+        return True
+    resumed_downloads = {}  # index -> download result left over from an earlier run
+
+    def record(index, state, **fields):
+        if journal:
+            journal.set_state(video_ids[index], state, **fields)
+
+    def fail(index, error):
+        results[index]['error'] = str(error)
+        print(f"Error processing video {index + 1}: {error}")
+        record(index, FAILED, error=str(error))
+        report('video_failed', index)
+
+    def download_worker():
+        while True:
+            index = job_queue.get()
+            if index is _STOP:
+                return
+            job = jobs[index]
+            if index in resumed_downloads:
+                encode_queue.put((index, resumed_downloads[index]))
+                continue
+            if not prepare(index) or reuse_stored(index):
+                continue
+            try:
+                record(index, DOWNLOADING)
+                # Partial yt_dlp downloads continue from their .part files; finished streams are kept
+                downloaded = download_stage(
+                    job['url'], job['video_format_id'], job['audio_format_id'], job['output_path'],
+                    info=job.get('info'), merge=not job.get('watermark', True),
+                    download_options=job.get('download_options'),
+                    progress_callback=lambda percent, index=index: report_progress(
+                        index, percent * DOWNLOAD_PROGRESS_WEIGHT)
+                )
+            except Exception as e:
+                fail(index, e)
+                continue
+            record(index, DOWNLOADED, downloaded=downloaded)
+            report('video_downloaded', index)
+            encode_queue.put((index, downloaded))  # Blocks while encoders are busy
+
+    def encode_worker():
+        while True:
+            item = encode_queue.get()
+            if item is _STOP:
+                return
+            index, downloaded = item
+            job = jobs[index]
+
+            def encode_progress(event, index=index):
+                if event['percent'] is not None:
+                    report_progress(index, DOWNLOAD_PROGRESS_WEIGHT * 100 +
+                                    event['percent'] * (1 - DOWNLOAD_PROGRESS_WEIGHT))
+
+            try:
+                record(index, WATERMARKING)
+                output = encode_stage(
+                    downloaded,
+                    watermark=job.get('watermark', True),
+                    watermark_text=job.get('watermark_text', "LIMITLESS MEDIA"),
+                    video_codec=get_video_codec() if job.get('watermark', True) else None,
+                    watermark_options=job.get('watermark_options'),
+                    progress_callback=encode_progress
+                )
+            except Exception as e:
+                fail(index, e)
+                continue
+            results[index]['success'] = True
+            results[index]['output'] = output
+            record(index, DONE, output_file=output)
+            if output_store:
+                try:
+                    output_store.put(job_store_key(index), output)
+                except OSError as e:
+                    print(f"Could not add video {index + 1} to the output store: {e}")
+            report('video_done', index)
+
+    def add_job(job):
+        index = len(jobs)
+        jobs.append(job)
+        results.append(
+            {'url': job['url'], 'success': False, 'output': None, 'error': None, 'skipped': False, 'cached': False}
+        )
+        video_ids.append(get_video_id(job['url']))
+        if journal and 'resolve' in job:
+            # A lazy job resumes with the formats an earlier run picked, if any
+            entry = journal.get(video_ids[index])
+            if entry and entry['video_format_id'] and entry['settings'] == job_settings(index):
+                job.pop('resolve')
+                job.update(video_format_id=entry['video_format_id'], audio_format_id=entry['audio_format_id'])
+        if journal and 'resolve' not in job:
+            entry = journal.record_resolved(
+                video_ids[index], job['url'], job['video_format_id'], job['audio_format_id'],
+                job.get('watermark', True), job_settings(index)
+            )
+            if entry['state'] == DONE and entry['output_file'] and os.path.exists(entry['output_file']):
+                results[index].update(success=True, output=entry['output_file'], skipped=True)
+                report('video_skipped', index)
+                return
+            if entry['state'] in (DOWNLOADED, WATERMARKING) and _downloaded_files_exist(entry['downloaded']):
+                resumed_downloads[index] = entry['downloaded']
+        job_queue.put(index)
+
+    downloaders = [threading.Thread(target=download_worker, daemon=True) for _ in range(download_workers)]
+    encoders = [threading.Thread(target=encode_worker, daemon=True) for _ in range(encode_workers)]
+    for thread in downloaders + encoders:
+        thread.start()
+
+    # Jobs are queued as the source produces them; the workers stop once it is exhausted
+    try:
+        for job in source:
+            add_job(job)
+    finally:
+        for _ in range(download_workers):
+            job_queue.put(_STOP)
+
+    # Once every download has finished, let the encoders drain the queue and stop
+    for thread in downloaders:
+        thread.join()
+    for _ in range(encode_workers):
+        encode_queue.put(_STOP)
+    for thread in encoders:
+        thread.join()
+
+    return results
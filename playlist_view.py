@@ -0,0 +1,353 @@
+import itertools
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk
+from downloader import get_best_audio_format, resolve_video
+from format_policy import rank_formats
+
+ROW_HEIGHT = 96  # Pixels per video row, including padding
+EXTRA_ROWS = 2   # Rows kept beyond the visible ones so scrolling never shows a gap
+PREFETCH_ROWS = 5  # Rows below the visible ones resolved ahead of scrolling
+
+# Resolution priorities for lazily loaded rows, most urgent first
+VISIBLE = 0    # On screen
+SELECTED = 1   # Ticked by the user or queued for download
+PREFETCH = 2   # Just below the visible rows
+
+def format_label(fmt, estimate=None):
+    """
+    Returns the text shown for a video format in the format dropdowns, with
+    the estimated job time when a `rank_formats` estimate is given.
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx') or 0
+    label = (f"{fmt.get('format_note')} => ID: {fmt['format_id']}, Res: {fmt.get('resolution', 'N/A')}, "
+             f"FPS: {fmt.get('fps', 'N/A')}, Size: {size / 1024 / 1024:.2f} MB")
+    if estimate and estimate['seconds']:
+        label += f", ~{estimate['seconds'] / 60:.1f} min"
+        if not estimate['fits']:
+            label += " (over limit)"
+    return label
+
+class PlaylistRow:
+    """
+    Selection, format and watermark state of one video in the playlist view.
+
+    Rows are plain data; widgets only display them while they are on screen.
+    """
+
+    def __init__(self, video, watermark=True, policy=None):
+        self.url = video['url']
+        self.title = video['title']
+        self.status = video['status']
+        self.formats = video['formats']
+        self.duration = video.get('duration')
+        self.policy = policy  # FormatPolicy ordering the format choices
+        self.selected = True  # Default to checked
+        self.watermark = watermark
+        self.format_options = None  # (label, format_id) pairs, computed on first use
+        self._options_lock = threading.Lock()
+        self.video_format_id = None
+        self.audio_format_id = None
+
+    def is_ready(self):
+        return self.status == 'ready' and bool(self.formats)
+
+    def is_pending(self):
+        """
+        True for rows from a lazy playlist whose formats are not resolved yet.
+        """
+        return self.status == 'pending'
+
+    def apply(self, video):
+        """
+        Fills in a pending row from a `resolve_video` result. The status is set
+        last, so a row only looks ready once its formats are there.
+        """
+        self.formats = video['formats']
+        self.duration = video.get('duration') or self.duration
+        self.title = video['title'] or self.title
+        self.status = video['status']
+
+    def ensure_format_options(self):
+        """
+        Works out the format choices the first time they are needed, ranked
+        by the row's format policy.
+
+        Called from the Tk thread and from download workers; the choices are
+        built once, under the row's lock, and only published when complete.
+
+        Returns:
+            list: (label, format_id) pairs, best first
+        """
+        if self.is_pending():
+            return []
+        if self.format_options is not None:
+            return self.format_options
+        with self._options_lock:
+            if self.format_options is None:
+                options = []
+                if self.is_ready():
+                    self.audio_format_id = get_best_audio_format(self.formats)['format_id']
+                    options = [
+                        (format_label(estimate['format'], estimate), estimate['format']['format_id'])
+                        for estimate in rank_formats(self.formats, self.duration, self.policy, self.watermark)
+                    ]
+                if options and self.video_format_id is None:
+                    # Set default selection to the policy's pick
+                    self.video_format_id = options[0][1]
+                self.format_options = options
+        return self.format_options
+
+class _RowWidgets:
+    """
+    One reusable set of widgets; rebound to whichever row scrolls into its slot.
+    """
+
+    def __init__(self, canvas, on_wheel, on_select=None):
+        self.row = None
+        self.index = None
+        self.on_select = on_select
+        self.frame = ttk.LabelFrame(canvas, text="")
+        self.selected_var = tk.BooleanVar()
+        self.watermark_var = tk.BooleanVar()
+        self.format_var = tk.StringVar()
+
+        # Checkbox for video selection
+        self.checkbox = ttk.Checkbutton(self.frame, text="Select for Download", variable=self.selected_var,
+                                        command=self._on_selected)
+        self.checkbox.pack(anchor="w")
+
+        # Video title
+        self.title_label = ttk.Label(self.frame, text="", wraplength=700)
+        self.title_label.pack(anchor="w")
+
+        # Format selection
+        self.format_frame = ttk.Frame(self.frame)
+        ttk.Label(self.format_frame, text="Format:").pack(side="left", padx=5)
+        self.format_combo = ttk.Combobox(self.format_frame, textvariable=self.format_var, state="readonly", width=80)
+        self.format_combo.pack(side="left", padx=5)
+        self.format_combo.bind("<<ComboboxSelected>>", self._on_format_selected)
+
+        # Add watermark checkbox
+        self.watermark_check = ttk.Checkbutton(self.format_frame, text="Add Watermark", variable=self.watermark_var,
+                                               style='Switch.TCheckbutton', command=self._on_watermark)
+        self.watermark_check.pack(side="left", padx=20)
+
+        self.status_label = ttk.Label(self.frame, text="", foreground="red")
+
+        for widget in (self.frame, self.checkbox, self.title_label, self.format_frame, self.status_label):
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                widget.bind(sequence, on_wheel)
+
+    def bind_row(self, index, row):
+        self.row = row
+        self.index = index
+        self.frame.configure(text=f"Video {index + 1}")
+        self.selected_var.set(row.selected)
+        self.title_label.configure(text=f"Title: {row.title}")
+
+        options = row.ensure_format_options()
+        if row.is_ready():
+            self.status_label.pack_forget()
+            self.format_frame.pack(fill="x", pady=5)
+            if options:
+                self.format_combo['values'] = [label for label, _ in options]
+                label = next((label for label, format_id in options if format_id == row.video_format_id), None)
+                if label is None:
+                    # The selected format is not offered (any more); show and use the policy's pick
+                    label, row.video_format_id = options[0]
+                self.format_var.set(label)
+            else:
+                self.format_combo['values'] = ["No suitable formats found"]
+                self.format_var.set("")
+            self.watermark_var.set(row.watermark)
+        elif row.is_pending():
+            self.format_frame.pack_forget()
+            self.status_label.configure(text="Loading formats...", foreground="gray")
+            self.status_label.pack(anchor="w")
+        else:
+            self.format_frame.pack_forget()
+            self.status_label.configure(text=f"Status: {row.status}", foreground="red")
+            self.status_label.pack(anchor="w")
+
+    def _on_selected(self):
+        if self.row:
+            self.row.selected = self.selected_var.get()
+            if self.row.selected and self.on_select:
+                self.on_select(self.row)
+
+    def _on_watermark(self):
+        if self.row:
+            self.row.watermark = self.watermark_var.get()
+
+    def _on_format_selected(self, event=None):
+        if self.row and self.row.format_options:
+            labels = dict(self.row.format_options)
+            self.row.video_format_id = labels.get(self.format_var.get(), self.row.video_format_id)
+
+class RowResolver:
+    """
+    Resolves the formats of pending rows from a lazy playlist on demand.
+
+    Requests are served most urgent first (VISIBLE, SELECTED, PREFETCH) and
+    in request order within a priority, by a few background threads.
+    A row requested again at a higher priority moves up. `on_resolved` is
+    called from those threads with each row once it is filled in.
+
+    Args:
+        workers (int): Rows resolved at once
+        on_resolved (function, optional): Called with the row after it resolves
+    """
+
+    def __init__(self, workers=4, on_resolved=None):
+        self.workers = workers
+        self.on_resolved = on_resolved
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._priorities = {}  # id(row) -> best priority queued
+        self._row_locks = {}   # id(row) -> lock held while the row resolves
+        self._threads = []
+        self._stopped = False
+
+    def request(self, row, priority=PREFETCH):
+        """
+        Queues a pending row for resolution; does nothing for resolved rows.
+        """
+        if not row.is_pending():
+            return
+        with self._lock:
+            if self._stopped or self._priorities.get(id(row), priority + 1) <= priority:
+                return
+            self._priorities[id(row)] = priority
+            self._queue.put((priority, next(self._order), row))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def resolve_now(self, row):
+        """
+        Resolves a row on the calling thread (or waits for the thread already
+        resolving it) and returns it.
+        """
+        with self._lock:
+            row_lock = self._row_locks.setdefault(id(row), threading.Lock())
+        with row_lock:
+            if row.is_pending():
+                row.apply(resolve_video(row.url))
+                with self._lock:
+                    self._priorities.pop(id(row), None)
+                if self.on_resolved:
+                    self.on_resolved(row)
+        return row
+
+    def _work(self):
+        while True:
+            _, _, row = self._queue.get()
+            if row is None:
+                return
+            # Stale duplicates of a row that moved up, or that already resolved, are skipped
+            self.resolve_now(row)
+
+    def stop(self):
+        """
+        Drops queued requests and lets the worker threads exit.
+        """
+        with self._lock:
+            self._stopped = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            for _ in self._threads:
+                self._queue.put((-1, next(self._order), None))
+
+class VirtualPlaylistView(ttk.Frame):
+    """
+    Scrollable list of playlist rows that only creates widgets for the rows on
+    screen and reuses them while scrolling, so thousands of videos cost no more
+    than a screenful.
+
+    With a `resolver`, pending rows are resolved as they come into view,
+    with PREFETCH_ROWS rows below them prefetched, and as they are ticked.
+    """
+
+    def __init__(self, parent, rows, resolver=None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.rows = rows
+        self.resolver = resolver
+        self.canvas = tk.Canvas(self, highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        self.pool = []  # (widgets, canvas window id)
+        self.canvas.bind("<Configure>", self._on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self._on_wheel)
+
+    def _on_wheel(self, event):
+        if getattr(event, 'num', None) == 4:
+            step = -1
+        elif getattr(event, 'num', None) == 5:
+            step = 1
+        else:
+            step = -1 if event.delta > 0 else 1
+        self.canvas.yview_scroll(step, "units")
+        return "break"
+
+    def _on_resize(self, event):
+        self.canvas.configure(
+            scrollregion=(0, 0, event.width, len(self.rows) * ROW_HEIGHT),
+            yscrollincrement=ROW_HEIGHT // 4
+        )
+        # Grow the widget pool to cover the visible height
+        needed = min(len(self.rows), event.height // ROW_HEIGHT + 1 + EXTRA_ROWS)
+        while len(self.pool) < needed:
+            widgets = _RowWidgets(self.canvas, self._on_wheel, self._on_select)
+            window = self.canvas.create_window(0, 0, window=widgets.frame, anchor="nw")
+            self.pool.append((widgets, window))
+        for _, window in self.pool:
+            self.canvas.itemconfigure(window, width=event.width - 10, height=ROW_HEIGHT - 6)
+        self.refresh()
+
+    def _on_select(self, row):
+        if self.resolver:
+            self.resolver.request(row, SELECTED)
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Places the pooled widgets on the rows currently in view.
+        """
+        first_index = max(0, int(self.canvas.canvasy(0) // ROW_HEIGHT))
+        for slot, (widgets, window) in enumerate(self.pool):
+            index = first_index + slot
+            if index < len(self.rows):
+                if widgets.row is not self.rows[index]:
+                    widgets.bind_row(index, self.rows[index])
+                self.canvas.coords(window, 5, index * ROW_HEIGHT + 3)
+                self.canvas.itemconfigure(window, state="normal")
+            else:
+                widgets.row = None
+                self.canvas.itemconfigure(window, state="hidden")
+
+        if self.resolver:
+            visible_end = min(len(self.rows), first_index + len(self.pool))
+            for index in range(first_index, visible_end):
+                self.resolver.request(self.rows[index], VISIBLE)
+            for index in range(visible_end, min(len(self.rows), visible_end + PREFETCH_ROWS)):
+                self.resolver.request(self.rows[index], PREFETCH)
+
+    def update_row(self, row):
+        """
+        Redraws a row whose data changed, e.g. once its formats resolved. Must
+        run on the Tk thread.
+        """
+        for widgets, _ in self.pool:
+            if widgets.row is row:
+                widgets.bind_row(widgets.index, row)
@@ -0,0 +1,226 @@
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+# Per-job download limits; override any of them with `download_options`
+DEFAULT_DOWNLOAD_OPTIONS = {
+    'connections': 4,                  # Parallel HTTP range requests per stream
+    'chunk_size': 10 * 1024 * 1024,    # Bytes per range request
+    'fragment_downloads': 4,           # yt_dlp fragments fetched at once (DASH/HLS)
+    'parallel_streams': True,          # Fetch the video and audio streams at the same time
+    'range_download': True,            # Use the built-in range downloader where possible
+    'retries': 3,                      # Attempts per range before the download fails
+    'timeout': 30,                     # Seconds without data before a request is abandoned
+}
+
+READ_BLOCK_SIZE = 256 * 1024
+
+def resolve_download_options(download_options=None):
+    """
+    Returns DEFAULT_DOWNLOAD_OPTIONS updated with the given per-job options.
+    """
+    return {**DEFAULT_DOWNLOAD_OPTIONS, **(download_options or {})}
+
+def build_ydl_tuning(download_options=None):
+    """
+    Returns the yt_dlp options for streams yt_dlp downloads itself: parallel
+    fragments for fragmented formats and chunked requests for the rest, which
+    keeps single-connection throttling from kicking in.
+    """
+    options = resolve_download_options(download_options)
+    return {
+        'concurrent_fragment_downloads': options['fragment_downloads'],
+        'http_chunk_size': options['chunk_size'],
+        'retries': options['retries'],
+        'socket_timeout': options['timeout'],
+    }
+
+def supports_ranges(fmt):
+    """
+    Whether a format can be fetched with the range downloader: a single
+    HTTP(S) file with a known exact size.
+    """
+    return (
+        fmt.get('protocol') in ('http', 'https')
+        and bool(fmt.get('url'))
+        and bool(fmt.get('filesize'))
+        and not fmt.get('fragments')
+    )
+
+def _fetch_range(url, headers, start, end, handle, file_lock, timeout, on_bytes):
+    request = urllib.request.Request(url, headers={**headers, 'Range': f"bytes={start}-{end}"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if response.status != 206 and not (start == 0 and response.status == 200):
+            raise RuntimeError(f"Server ignored the range request (HTTP {response.status})")
+        position = start
+        while position <= end:
+            block = response.read(min(READ_BLOCK_SIZE, end - position + 1))
+            if not block:
+                break
+            with file_lock:
+                handle.seek(position)
+                handle.write(block)
+            position += len(block)
+            on_bytes(len(block))
+    if position <= end:
+        raise RuntimeError(f"Range {start}-{end} ended early at byte {position}")
+
+def _read_completed(ranges_file):
+    """
+    Returns the (start, end) byte ranges a sidecar file lists as written.
+    A line cut short by a crash is ignored.
+    """
+    completed = []
+    with open(ranges_file, 'r', encoding='utf-8') as handle:
+        for line in handle:
+            parts = line.split()
+            if len(parts) == 2 and line.endswith("\n") and all(part.isdigit() for part in parts):
+                completed.append((int(parts[0]), int(parts[1])))
+    return completed
+
+def _missing_ranges(completed, size, chunk_size):
+    """
+    Returns the byte ranges of [0, size) not covered by `completed`, split into chunks.
+    """
+    missing = []
+    position = 0
+    for start, end in sorted(completed) + [(size, size)]:
+        if start > position:
+            for chunk_start in range(position, start, chunk_size):
+                missing.append((chunk_start, min(chunk_start + chunk_size, start) - 1))
+        position = max(position, end + 1)
+    return missing
+
+class _Abort(Exception):
+    """
+    Stops a worker without retrying once the download has failed or was cancelled.
+    """
+
+def download_ranges(url, output_file, size, headers=None, connections=4, chunk_size=10 * 1024 * 1024,
+                    retries=3, timeout=30, progress_callback=None):
+    """
+    Downloads a file over several HTTP connections, each fetching byte ranges.
+
+    The file is written to `output_file + '.part'` and renamed once every range
+    is in, so an interrupted download never looks finished. Finished ranges
+    are listed in `output_file + '.part.ranges'`, and a later call picks the
+    download up from there instead of starting over.
+
+    Args:
+        url (str): Direct media URL
+        output_file (str): Where to save the file
+        size (int): Exact size in bytes
+        headers (dict, optional): HTTP headers to send (e.g. the format's `http_headers`)
+        connections (int): Ranges downloaded at the same time
+        chunk_size (int): Bytes per range request
+        retries (int): Attempts per range
+        timeout (float): Socket timeout in seconds
+        progress_callback (function, optional): Called with (downloaded_bytes, size).
+            If it raises, the download stops and the exception is re-raised
+            here; the .part file is kept for the next attempt.
+
+    Returns:
+        str: output_file
+
+    Raises:
+        RuntimeError: If a range still fails after all retries
+    """
+    if os.path.exists(output_file) and os.path.getsize(output_file) == size:
+        return output_file  # Finished by an earlier run
+    headers = headers or {}
+    part_file = output_file + ".part"
+    ranges_file = part_file + ".ranges"
+
+    # Continue an interrupted download if its .part file and range list are intact
+    completed = []
+    if os.path.exists(part_file) and os.path.getsize(part_file) == size and os.path.exists(ranges_file):
+        completed = _read_completed(ranges_file)
+    resuming = bool(completed)
+
+    missing = _missing_ranges(completed, size, chunk_size)
+    ranges = queue.Queue()
+    for byte_range in missing:
+        ranges.put(byte_range)
+
+    file_lock = threading.Lock()
+    progress_lock = threading.Lock()
+    downloaded = [size - sum(end - start + 1 for start, end in missing)]
+    errors = []
+
+    def on_bytes(count):
+        if errors:
+            raise _Abort()  # Another connection failed; stop this one too
+        with progress_lock:
+            downloaded[0] += count
+            done = downloaded[0]
+        if progress_callback:
+            try:
+                progress_callback(done, size)
+            except BaseException as e:
+                errors.append(e)
+                raise _Abort()
+
+    def forget(count):
+        # The range is fetched again from its start; the next report is corrected
+        with progress_lock:
+            downloaded[0] -= count
+
+    with open(part_file, 'r+b' if resuming else 'wb') as handle, \
+            open(ranges_file, 'a' if resuming else 'w', encoding='utf-8') as ranges_log:
+        if not resuming:
+            handle.truncate(size)
+
+        def fetch(start, end):
+            for attempt in range(1, retries + 1):
+                fetched = [0]
+
+                def count(num_bytes):
+                    fetched[0] += num_bytes
+                    on_bytes(num_bytes)
+
+                try:
+                    _fetch_range(url, headers, start, end, handle, file_lock, timeout, count)
+                except _Abort:
+                    raise
+                except Exception as e:
+                    forget(fetched[0])
+                    if attempt == retries:
+                        raise RuntimeError(f"Range {start}-{end} failed: {e}") from e
+                    time.sleep(attempt)
+                    continue
+                with file_lock:
+                    handle.flush()  # The range is on disk before it is listed
+                    ranges_log.write(f"{start} {end}\n")
+                    ranges_log.flush()
+                    completed.append((start, end))
+                return
+
+        def worker():
+            try:
+                while not errors:
+                    try:
+                        start, end = ranges.get_nowait()
+                    except queue.Empty:
+                        return
+                    fetch(start, end)
+            except _Abort:
+                pass
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(connections, ranges.qsize())))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    missing = _missing_ranges(completed, size, size)
+    if missing:
+        raise RuntimeError(f"Download incomplete: bytes {missing[0][0]}-{missing[0][1]} were never written")
+    os.replace(part_file, output_file)
+    os.remove(ranges_file)
+    return output_file
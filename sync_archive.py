@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+from output_store import PERFORMANCE_ONLY_OPTIONS
+
+# Kept in the output folder, next to the videos it lists, like the job journal
+ARCHIVE_FILENAME = ".sync_archive.sqlite3"
+
+def get_playlist_id(playlist_url):
+    """
+    Returns the playlist ID from a playlist URL's `list` parameter, or the
+    URL itself if it has none.
+    """
+    return parse_qs(urlparse(playlist_url).query).get('list', [playlist_url])[0]
+
+def settings_key(watermark=True, watermark_text="LIMITLESS MEDIA", watermark_options=None):
+    """
+    Returns a hash of the watermark settings a video was delivered with.
+    Options that only affect encode speed are left out.
+    """
+    options = {k: v for k, v in (watermark_options or {}).items() if k not in PERFORMANCE_ONLY_OPTIONS}
+    settings = {
+        'watermark': bool(watermark),
+        'watermark_text': watermark_text if watermark else None,
+        'watermark_options': options if watermark else None,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+class SyncArchive:
+    """
+    Record of the playlist videos already delivered, for incremental sync.
+
+    Deliveries are keyed by (playlist ID, video ID, settings key), so changing
+    the watermark settings makes every video due again. The archive also
+    remembers each playlist's membership at the last sync, so videos that
+    left the playlist can be reported.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS delivered (
+                playlist_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                settings_key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                output_file TEXT,
+                delivered_at REAL NOT NULL,
+                PRIMARY KEY (playlist_id, video_id, settings_key)
+            )
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS members (
+                playlist_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                position INTEGER NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (playlist_id, video_id)
+            )
+        """)
+
+    @classmethod
+    def for_output_dir(cls, output_dir):
+        return cls(os.path.join(output_dir, ARCHIVE_FILENAME))
+
+    def diff(self, playlist_id, entries, key):
+        """
+        Compares the current flat playlist against the archive.
+
+        Args:
+            playlist_id (str): See `get_playlist_id`
+            entries (list): Dictionaries with video_id, url and title, in playlist order
+            key (str): `settings_key` of this sync
+
+        Returns:
+            dict:
+                - added: entries not in the playlist at the last sync
+                - changed: entries seen before but not delivered with these
+                  settings (settings changed, the download failed or the
+                  delivered file was deleted)
+                - unchanged: entries already delivered with these settings
+                - removed: {video_id, url, title} of videos that left the playlist
+        """
+        with self._lock:
+            delivered = {
+                video_id: output_file for video_id, output_file in self._connection.execute(
+                    "SELECT video_id, output_file FROM delivered WHERE playlist_id = ? AND settings_key = ?",
+                    (playlist_id, key))
+            }
+            members = {
+                video_id: {'video_id': video_id, 'url': url, 'title': title}
+                for video_id, url, title in self._connection.execute(
+                    "SELECT video_id, url, title FROM members WHERE playlist_id = ? ORDER BY position",
+                    (playlist_id,))
+            }
+
+        result = {'added': [], 'changed': [], 'unchanged': [], 'removed': []}
+        current = set()
+        for entry in entries:
+            current.add(entry['video_id'])
+            output_file = delivered.get(entry['video_id'])
+            if entry['video_id'] in delivered and (not output_file or os.path.exists(output_file)):
+                result['unchanged'].append(entry)
+            elif entry['video_id'] in members:
+                result['changed'].append(entry)
+            else:
+                result['added'].append(entry)
+        result['removed'] = [member for video_id, member in members.items() if video_id not in current]
+        return result
+
+    def update_members(self, playlist_id, entries):
+        """
+        Replaces the remembered membership of a playlist with `entries`.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.execute("DELETE FROM members WHERE playlist_id = ?", (playlist_id,))
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO members (playlist_id, video_id, url, title, position, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(playlist_id, entry['video_id'], entry['url'], entry.get('title'), position, now)
+                     for position, entry in enumerate(entries)]
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def record_delivered(self, playlist_id, video_id, key, url, title=None, output_file=None):
+        """
+        Marks a video as delivered with the given settings.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO delivered "
+                "(playlist_id, video_id, settings_key, url, title, output_file, delivered_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (playlist_id, video_id, key, url, title, output_file, time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
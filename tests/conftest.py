@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def isolated_encode_slots(tmp_path, monkeypatch):
+    """
+    Keeps the shared encode scheduler's slot files out of the user's cache folder.
+    """
+    import encode_scheduler
+    monkeypatch.setattr(encode_scheduler, 'SLOT_DIR', str(tmp_path / "encode_slots"))
+    monkeypatch.setattr(encode_scheduler, '_default_scheduler', None)
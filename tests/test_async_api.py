@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+import async_api
+import downloader
+
+def test_segmented_progress_is_delivered_on_the_loop(monkeypatch):
+    def add_moving_watermark(input_file, output_file, watermark_text, progress_callback=None, **options):
+        for percent in (25.0, 50.0, 100.0):
+            progress_callback({'percent': percent, 'frame': int(percent)})
+
+    monkeypatch.setattr(async_api, 'add_moving_watermark', add_moving_watermark)
+    events = []
+
+    async def main():
+        loop_thread = threading.get_ident()
+
+        def progress(event):
+            events.append((event['percent'], threading.get_ident() == loop_thread))
+
+        await async_api.add_moving_watermark_async("in.mp4", "out.mp4", "LIMITLESS MEDIA", segments=4,
+                                                   progress_callback=progress)
+        await asyncio.sleep(0)  # Let the last scheduled callbacks run
+
+    asyncio.run(main())
+    assert events == [(25.0, True), (50.0, True), (100.0, True)]
+
+def test_cancelling_a_segmented_encode_stops_its_threads(monkeypatch):
+    stopped = threading.Event()
+
+    def add_moving_watermark(input_file, output_file, watermark_text, progress_callback=None, **options):
+        try:
+            for _ in range(500):
+                progress_callback({'percent': None})
+                time.sleep(0.01)
+        except async_api.JobCancelled:
+            stopped.set()
+            raise
+
+    monkeypatch.setattr(async_api, 'add_moving_watermark', add_moving_watermark)
+
+    async def main():
+        task = asyncio.ensure_future(async_api.add_moving_watermark_async(
+            "in.mp4", "out.mp4", "LIMITLESS MEDIA", windows=(10, 60)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert stopped.wait(2)
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake ffmpeg is a shell script")
+def test_ffmpeg_is_killed_when_the_progress_callback_raises(tmp_path):
+    pid_file = tmp_path / "ffmpeg.pid"
+    fake_ffmpeg = tmp_path / "ffmpeg"
+    fake_ffmpeg.write_text(f"#!/bin/sh\necho $$ > {pid_file}\necho frame=1\necho progress=continue\nexec sleep 30\n")
+    fake_ffmpeg.chmod(0o755)
+
+    def progress(event):
+        raise ValueError("bad progress consumer")
+
+    with pytest.raises(ValueError):
+        asyncio.run(async_api.run_ffmpeg_async([str(fake_ffmpeg)], progress_callback=progress))
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
+
+@pytest.mark.parametrize("downloaded", [
+    {'video_file': "v.mp4", 'audio_file': "a.m4a", 'metadata_args': ["-metadata", "comment=x"]},
+    {'merged_input': "merged.mp4", 'audio_file': None, 'metadata_args': None},
+])
+def test_async_encode_stage_watermarks_like_the_blocking_one(monkeypatch, tmp_path, downloaded):
+    downloaded = {**downloaded, 'url': "https://www.youtube.com/watch?v=aaaaaaaaaaa", 'title': "video",
+                  'output_path': str(tmp_path), 'video_bitrate': 2500, 'source_codec': "avc1", 'video_height': 720}
+    calls = []
+
+    def add_moving_watermark(output_file, progress_callback=None, **options):
+        calls.append({'output_file': output_file, **options})
+        with open(output_file, 'wb') as handle:
+            handle.write(b"watermarked")
+        progress_callback({'percent': 100.0, 'frame': 0})
+
+    async def add_moving_watermark_async(**options):
+        add_moving_watermark(**options)
+
+    monkeypatch.setattr(downloader, 'add_moving_watermark', add_moving_watermark)
+    monkeypatch.setattr(async_api, 'add_moving_watermark_async', add_moving_watermark_async)
+    options = {'watermark_text': "LIMITLESS MEDIA", 'video_codec': "libx264",
+               'watermark_options': {'engine': "overlay"}}
+
+    blocking_output = downloader.encode_stage(downloaded, **options)
+    async_output = asyncio.run(async_api.encode_stage_async(downloaded, **options))
+    assert blocking_output == async_output == str(tmp_path / "video.mp4")
+    assert calls[0] == calls[1]
+    assert calls[0]['input_file'] == downloaded.get('video_file', downloaded.get('merged_input'))
+    assert calls[0]['engine'] == "overlay"
+    assert ('audio_file' in calls[0]) == ('video_file' in downloaded)
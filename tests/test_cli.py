@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+
+import cli
+import downloader
+import pipeline
+
+PLAYLIST_URL = "https://www.youtube.com/playlist?list=PLsync"
+
+class FakeProvider:
+    def __init__(self):
+        self.video_ids = ["a" * 11, "b" * 11]
+
+    def extract_info(self, video_url):
+        video_id = video_url.rsplit("=", 1)[-1]
+        return {
+            'id': video_id, 'title': f"Video {video_id[0]}", 'duration': 60,
+            'formats': [
+                {'format_id': "137", 'vcodec': "avc1.640028", 'acodec': "none", 'height': 1080, 'ext': "mp4",
+                 'tbr': 2000, 'filesize': 15_000_000},
+                {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a.40.2", 'ext': "m4a", 'abr': 128,
+                 'filesize': 1_000_000},
+            ],
+        }
+
+    def playlist_entries(self, playlist_url):
+        return [f"https://www.youtube.com/watch?v={video_id}" for video_id in self.video_ids]
+
+@pytest.fixture
+def batch(monkeypatch, tmp_path):
+    """
+    Runs `run_batch` against a fake extractor with the download and encode stages replaced.
+    """
+    provider = downloader.configure_info_provider(FakeProvider())
+    resolved = []
+
+    def resolve_video(video_url):
+        resolved.append(video_url)
+        return downloader.resolve_video(video_url)
+
+    def download_stage(url, *args, **kwargs):
+        return {'video_file': url, 'audio_file': None}
+
+    def encode_stage(downloaded, **kwargs):
+        output = tmp_path / f"{downloaded['video_file'][-1]}.mp4"
+        output.write_bytes(b"video")
+        return str(output)
+
+    monkeypatch.setattr(cli, 'resolve_video', resolve_video)
+    monkeypatch.setattr(pipeline, 'download_stage', download_stage)
+    monkeypatch.setattr(pipeline, 'encode_stage', encode_stage)
+    monkeypatch.setattr(pipeline, 'select_video_codec', lambda prefer_cpu=False: "libx264")
+
+    def run(*options):
+        args = cli.build_parser().parse_args([PLAYLIST_URL, "-o", str(tmp_path), "--no-store", *options])
+        stream = io.StringIO()
+        resolved.clear()
+        code = cli.run_batch(args, args.urls, cli.ResultWriter(stream))
+        return code, [json.loads(line) for line in stream.getvalue().splitlines()], list(resolved)
+
+    yield provider, run
+    downloader.configure_info_provider(None)
+
+def test_batch_writes_one_result_per_video(batch):
+    provider, run = batch
+    code, records, resolved = run("--no-journal")
+    assert code == 0
+    assert sorted((record['video_id'], record['status']) for record in records) == [
+        ("a" * 11, 'done'), ("b" * 11, 'done')]
+
+def test_sync_only_downloads_what_is_due(batch):
+    provider, run = batch
+    code, records, resolved = run("--sync")
+    assert records[0]['status'] == 'sync' and records[0]['added'] == ["a" * 11, "b" * 11]
+    assert len(resolved) == 2
+
+    # Nothing changed: one flat listing, nothing resolved or downloaded
+    code, records, resolved = run("--sync")
+    assert code == 0
+    assert records == [{'url': PLAYLIST_URL, 'playlist_id': "PLsync", 'status': 'sync', 'added': [],
+                        'changed': [], 'removed': [], 'unchanged': 2}]
+    assert resolved == []
+
+    provider.video_ids = ["b" * 11, "c" * 11]
+    code, records, resolved = run("--sync")
+    assert records[0]['added'] == ["c" * 11] and records[0]['removed'] == ["a" * 11]
+    assert resolved == [f"https://www.youtube.com/watch?v={'c' * 11}"]
+    assert [record['status'] for record in records[1:]] == ['done']
+
+    # Other watermark settings make every video due again, and the journal does not skip them
+    code, records, resolved = run("--sync", "--watermark-text", "NEW TEXT")
+    assert records[0]['changed'] == ["b" * 11, "c" * 11]
+    assert sorted(record['status'] for record in records[1:]) == ['done', 'done']
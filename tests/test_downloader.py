@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import downloader
+from format_policy import THROUGHPUT_FILE, configure_throughput_stats
+
+VIDEO_URL = "https://www.youtube.com/watch?v=" + "a" * 11
+
+INFO = {
+    'id': "a" * 11,
+    'title': "A/B",
+    'formats': [
+        {'format_id': "137", 'vcodec': "avc1", 'acodec': "none", 'height': 1080, 'ext': "mp4", 'tbr': 4000,
+         'protocol': "https", 'url': "https://example.com/video", 'filesize': 5},
+        {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a", 'ext': "m4a", 'abr': 128,
+         'protocol': "https", 'url': "https://example.com/audio", 'filesize': 5},
+    ],
+}
+
+def output_path(directory):
+    # download_stage writes the streams to os.path.dirname(output_path); keep them in the test folder
+    return str(directory) + os.sep
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    """
+    Replaces the range downloader, merging and watermarking with fakes that
+    write small files and record their calls. Throughput measurements are
+    not saved.
+    """
+    calls = {'merge': [], 'watermark': []}
+
+    def download_ranges(url, target, size, **options):
+        with open(target, 'wb') as handle:
+            handle.write(b"x" * size)
+
+    def merge_streams(video_file, audio_file, output_file, metadata_args=None):
+        calls['merge'].append((video_file, audio_file, output_file))
+        with open(output_file, 'wb') as handle:
+            handle.write(b"merged")
+
+    def add_moving_watermark(input_file, output_file, watermark_text, **options):
+        calls['watermark'].append({'input_file': input_file, 'output_file': output_file, **options})
+        with open(output_file, 'wb') as handle:
+            handle.write(b"watermarked")
+
+    monkeypatch.setattr(downloader, 'download_ranges', download_ranges)
+    monkeypatch.setattr(downloader, 'merge_streams', merge_streams)
+    monkeypatch.setattr(downloader, 'add_moving_watermark', add_moving_watermark)
+    configure_throughput_stats(stats_file=None)
+    yield calls
+    configure_throughput_stats(THROUGHPUT_FILE)
+
+def test_watermarked_video_is_encoded_straight_from_the_streams(ffmpeg, tmp_path):
+    assert downloader.download_video(VIDEO_URL, "137", "140", output_path(tmp_path), info=INFO, watermark=True)
+
+    assert ffmpeg['merge'] == []
+    [call] = ffmpeg['watermark']
+    assert call['input_file'] == str(tmp_path / "A_B_video.mp4")
+    assert call['audio_file'] == str(tmp_path / "A_B_audio.m4a")
+    assert "title=A_B video" in call['metadata_args']
+    # Only the finished video is left; no temporary merged copy was ever written
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["A_B.mp4"]
+
+def test_unwatermarked_video_is_only_merged(ffmpeg, tmp_path):
+    assert downloader.download_video(VIDEO_URL, "137", "140", output_path(tmp_path), info=INFO, watermark=False)
+
+    assert ffmpeg['watermark'] == []
+    assert [output for _, _, output in ffmpeg['merge']] == [str(tmp_path / "A_B_temp.mp4")]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["A_B.mp4"]
+
+def test_streams_are_kept_when_watermarking_fails(ffmpeg, tmp_path, monkeypatch):
+    def failing_watermark(input_file, output_file, watermark_text, **options):
+        raise RuntimeError("Failed to add watermark")
+
+    monkeypatch.setattr(downloader, 'add_moving_watermark', failing_watermark)
+    downloaded = downloader.download_stage(VIDEO_URL, "137", "140", output_path(tmp_path), info=INFO, merge=False)
+    with pytest.raises(RuntimeError):
+        downloader.encode_stage(downloaded, video_codec="libx264")
+    # A resumed job encodes them again without downloading
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["A_B_audio.m4a", "A_B_video.mp4"]
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import encode_scheduler
+from encode_scheduler import EncodeScheduler
+
+@pytest.fixture
+def slot_dir(tmp_path):
+    return str(tmp_path / "slots")
+
+def test_default_share_lets_two_jobs_run_at_once(slot_dir):
+    scheduler = EncodeScheduler(cpu_budget=4, slot_dir=slot_dir)
+    first, second = scheduler.try_acquire(), scheduler.try_acquire()
+    assert (first.threads, second.threads) == (2, 2)
+    assert scheduler.try_acquire() is None
+    first.release()
+    assert scheduler.try_acquire().threads == 2
+
+@pytest.mark.parametrize("budget, concurrent_jobs, min_threads, expected", [
+    (8, 4, 1, 2),
+    (8, 3, 1, 2),
+    (8, 1, 1, 8),
+    (2, 4, 1, 1),
+    (4, 8, 2, 2),
+])
+def test_share_of_the_budget(slot_dir, budget, concurrent_jobs, min_threads, expected):
+    scheduler = EncodeScheduler(cpu_budget=budget, concurrent_jobs=concurrent_jobs, min_threads=min_threads,
+                                slot_dir=slot_dir)
+    assert scheduler.threads_per_job == expected
+
+def test_slot_dir_is_created_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(encode_scheduler, 'SLOT_DIR', str(tmp_path / "default_slots"))
+    scheduler = EncodeScheduler(cpu_budget=1)
+    assert not os.path.exists(scheduler.slot_dir)
+    scheduler.try_acquire().release()
+    assert os.path.isdir(str(tmp_path / "default_slots"))
+
+def test_fixed_threads_per_job_shares_the_budget(slot_dir):
+    scheduler = EncodeScheduler(cpu_budget=4, threads_per_job=2, slot_dir=slot_dir)
+    first, second = scheduler.try_acquire(), scheduler.try_acquire()
+    assert (first.threads, second.threads) == (2, 2)
+    assert set(first.slots).isdisjoint(second.slots)
+    assert scheduler.try_acquire() is None
+
+def test_job_starts_with_what_is_free_above_the_minimum(slot_dir):
+    held = EncodeScheduler(cpu_budget=4, threads_per_job=3, slot_dir=slot_dir).try_acquire()
+    assert EncodeScheduler(cpu_budget=4, min_threads=1, slot_dir=slot_dir).try_acquire().threads == 1
+    held.release()
+    held = EncodeScheduler(cpu_budget=4, threads_per_job=3, slot_dir=slot_dir).try_acquire()
+    assert EncodeScheduler(cpu_budget=4, min_threads=2, slot_dir=slot_dir).try_acquire() is None
+
+def test_acquire_times_out(slot_dir):
+    scheduler = EncodeScheduler(cpu_budget=1, slot_dir=slot_dir)
+    held = scheduler.acquire()
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(timeout=0.1)
+    held.release()
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason="needs sched_setaffinity")
+def test_pinning_and_niceness_are_applied_to_a_started_process(slot_dir):
+    cpu = sorted(os.sched_getaffinity(0))[0]
+    scheduler = EncodeScheduler(cpu_budget=1, pin=True, nice=5, slot_dir=slot_dir)
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        with scheduler.allocate() as allocation:
+            allocation.apply_to(process.pid)
+            assert os.sched_getaffinity(process.pid) == {cpu}
+            assert os.getpriority(os.PRIO_PROCESS, process.pid) == min(19, os.getpriority(os.PRIO_PROCESS, 0) + 5)
+    finally:
+        process.kill()
+        process.wait()
+
+def test_apply_to_ignores_an_exited_process(slot_dir):
+    scheduler = EncodeScheduler(cpu_budget=1, pin=True, nice=5, slot_dir=slot_dir)
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    with scheduler.allocate() as allocation:
+        allocation.apply_to(process.pid)
@@ -0,0 +1,112 @@
+import pytest
+
+from encoder_policy import ENCODER_PROFILES, build_encoder_args, choose_encoder, normalize_codec
+
+BITRATE_ARGS = ["-b:v", "2500k", "-maxrate", "2500k", "-bufsize", "5000k"]
+
+# encoder -> profile -> options between "-c:v <encoder>" and "-g", without a bitrate
+QUALITY_ARGS = {
+    'libx264': {
+        'fast': ["-preset", "veryfast", "-crf", "23"],
+        'balanced': ["-preset", "medium", "-crf", "20"],
+        'archival': ["-preset", "slow", "-crf", "18"],
+    },
+    'libvpx-vp9': {
+        'fast': ["-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1", "-tile-columns", "2",
+                 "-frame-parallel", "0", "-crf", "36", "-b:v", "0"],
+        'balanced': ["-deadline", "good", "-cpu-used", "4", "-row-mt", "1", "-tile-columns", "2",
+                     "-frame-parallel", "0", "-crf", "32", "-b:v", "0"],
+        'archival': ["-deadline", "good", "-cpu-used", "1", "-row-mt", "1", "-tile-columns", "2",
+                     "-frame-parallel", "0", "-crf", "28", "-b:v", "0"],
+    },
+    'h264_nvenc': {
+        'fast': ["-preset", "p2", "-rc", "vbr", "-cq", "28", "-b:v", "0"],
+        'balanced': ["-preset", "p4", "-rc", "vbr", "-cq", "23", "-b:v", "0"],
+        'archival': ["-preset", "p7", "-rc", "vbr", "-cq", "19", "-b:v", "0"],
+    },
+    'h264_qsv': {
+        'fast': ["-preset", "veryfast", "-global_quality", "28"],
+        'balanced': ["-preset", "medium", "-global_quality", "23"],
+        'archival': ["-preset", "veryslow", "-global_quality", "19"],
+    },
+    'h264_amf': {
+        'fast': ["-quality", "speed", "-rc", "cqp", "-qp_i", "28", "-qp_p", "28"],
+        'balanced': ["-quality", "balanced", "-rc", "cqp", "-qp_i", "23", "-qp_p", "23"],
+        'archival': ["-quality", "quality", "-rc", "cqp", "-qp_i", "19", "-qp_p", "19"],
+    },
+    'h264_videotoolbox': {
+        'fast': ["-q:v", "50"],
+        'balanced': ["-q:v", "60"],
+        'archival': ["-q:v", "75"],
+    },
+}
+
+# encoder -> profile -> options with a 2500 kbps bitrate
+BITRATE_CAPPED_ARGS = {
+    'libx264': {profile: ["-preset", preset, *BITRATE_ARGS]
+                for profile, preset in (('fast', 'veryfast'), ('balanced', 'medium'), ('archival', 'slow'))},
+    'libvpx-vp9': {
+        profile: [*QUALITY_ARGS['libvpx-vp9'][profile][:-2], *BITRATE_ARGS] for profile in ENCODER_PROFILES
+    },
+    'h264_nvenc': {
+        profile: [*QUALITY_ARGS['h264_nvenc'][profile][:-2], *BITRATE_ARGS] for profile in ENCODER_PROFILES
+    },
+    'h264_qsv': {profile: QUALITY_ARGS['h264_qsv'][profile][:2] + BITRATE_ARGS for profile in ENCODER_PROFILES},
+    'h264_amf': {profile: QUALITY_ARGS['h264_amf'][profile][:2] + BITRATE_ARGS for profile in ENCODER_PROFILES},
+    'h264_videotoolbox': {profile: BITRATE_ARGS for profile in ENCODER_PROFILES},
+}
+
+CASES = [(encoder, profile) for encoder in QUALITY_ARGS for profile in ENCODER_PROFILES]
+
+@pytest.mark.parametrize("encoder, profile", CASES)
+def test_quality_based_args(encoder, profile):
+    assert build_encoder_args(encoder, profile) == [
+        "-c:v", encoder, *QUALITY_ARGS[encoder][profile], "-g", "60"
+    ]
+
+@pytest.mark.parametrize("encoder, profile", CASES)
+def test_bitrate_capped_args(encoder, profile):
+    assert build_encoder_args(encoder, profile, video_bitrate=2500.7) == [
+        "-c:v", encoder, *BITRATE_CAPPED_ARGS[encoder][profile], "-g", "60"
+    ]
+
+def test_vp9_with_bitrate_is_constrained_quality():
+    assert build_encoder_args("libvpx-vp9", "balanced", video_bitrate=1000) == [
+        "-c:v", "libvpx-vp9", "-deadline", "good", "-cpu-used", "4", "-row-mt", "1", "-tile-columns", "2",
+        "-frame-parallel", "0", "-crf", "32", "-b:v", "1000k", "-maxrate", "1000k", "-bufsize", "2000k",
+        "-g", "60",
+    ]
+
+def test_threads_are_appended_last():
+    assert build_encoder_args("libx264", "fast", threads=4)[-2:] == ["-threads", "4"]
+    assert "-threads" not in build_encoder_args("libx264", "fast")
+
+def test_unknown_encoder_only_gets_rate_control():
+    assert build_encoder_args("mpeg4", "balanced") == ["-c:v", "mpeg4", "-g", "60"]
+    assert build_encoder_args("mpeg4", "balanced", 800) == [
+        "-c:v", "mpeg4", "-b:v", "800k", "-maxrate", "800k", "-bufsize", "1600k", "-g", "60"
+    ]
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        build_encoder_args("libx264", "extreme")
+    with pytest.raises(ValueError):
+        choose_encoder("libx264", "h264", "extreme")
+
+@pytest.mark.parametrize("selected, source, profile, expected", [
+    ("h264_nvenc", "avc1.640028", "balanced", "h264_nvenc"),
+    ("h264_nvenc", "vp09.00.40.08", "fast", "h264_nvenc"),
+    ("h264_nvenc", "vp09.00.40.08", "archival", "libvpx-vp9"),
+    ("h264_qsv", "avc1.640028", "archival", "libx264"),
+    ("vp9_qsv", None, "balanced", "libvpx-vp9"),
+    (None, None, "balanced", "libx264"),
+])
+def test_choose_encoder(selected, source, profile, expected):
+    assert choose_encoder(selected, source, profile) == expected
+
+@pytest.mark.parametrize("codec, expected", [
+    ("vp09.00.40.08", "vp9"), ("vp9", "vp9"), ("avc1.4d401f", "h264"), ("h264", "h264"),
+    ("av01.0.08M.08", "av1"), ("hvc1.1.6.L93", "hevc"), (None, ""),
+])
+def test_normalize_codec(codec, expected):
+    assert normalize_codec(codec) == expected
@@ -0,0 +1,76 @@
+import os
+import subprocess
+
+import pytest
+
+import watermark
+from downloader import DOWNLOAD_PROGRESS_WEIGHT, job_percent
+from watermark import parse_progress_block, run_ffmpeg
+
+BLOCK = {'frame': "250", 'fps': "50.0", 'out_time_us': "5000000", 'speed': "2.5x"}
+
+def test_progress_block_gives_percent_speed_and_eta():
+    event = parse_progress_block(BLOCK, "continue", duration=20.0)
+    assert event == {'percent': 25.0, 'out_time': 5.0, 'frame': 250, 'fps': 50.0, 'speed': 2.5, 'eta': 6.0}
+
+def test_last_block_is_complete():
+    assert parse_progress_block(BLOCK, "end", duration=20.0)['percent'] == 100.0
+
+def test_progress_without_a_duration_has_no_percent_or_eta():
+    event = parse_progress_block(BLOCK, "continue")
+    assert (event['percent'], event['eta'], event['frame']) == (None, None, 250)
+
+def test_values_ffmpeg_has_not_measured_yet():
+    event = parse_progress_block({'frame': "0", 'fps': "N/A", 'out_time_us': "N/A", 'speed': "N/A"}, "continue",
+                                 duration=20.0)
+    assert event == {'percent': 0.0, 'out_time': 0.0, 'frame': 0, 'fps': 0.0, 'speed': 0.0, 'eta': None}
+
+def fake_ffmpeg(tmp_path, body):
+    script = tmp_path / "ffmpeg"
+    script.write_text("#!/bin/sh\n" + body)
+    script.chmod(0o755)
+    return str(script)
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake ffmpeg is a shell script")
+def test_progress_is_read_while_ffmpeg_runs(tmp_path):
+    # Checks the progress options come first, writes far more to stderr than a
+    # pipe holds, then reports two blocks
+    ffmpeg = fake_ffmpeg(tmp_path, """
+[ "$1 $2 $3" = "-progress pipe:1 -nostats" ] || exit 3
+head -c 1000000 /dev/zero | tr '\\0' 'x' >&2
+printf 'frame=100\\nfps=25.0\\nout_time_us=4000000\\nspeed=2x\\nprogress=continue\\n'
+printf 'frame=200\\nfps=25.0\\nout_time_us=8000000\\nspeed=2x\\nprogress=end\\n'
+""")
+    events = []
+    run_ffmpeg([ffmpeg, "-i", "in.mp4", "out.mp4"], duration=8.0, progress_callback=events.append)
+    assert [(event['frame'], event['percent'], event['eta']) for event in events] == [(100, 50.0, 2.0),
+                                                                                      (200, 100.0, 0.0)]
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake ffmpeg is a shell script")
+def test_failure_carries_the_end_of_stderr(tmp_path):
+    ffmpeg = fake_ffmpeg(tmp_path, "i=0\nwhile [ $i -lt 200 ]; do echo \"line $i\" >&2; i=$((i+1)); done\n"
+                                   "echo 'Unknown encoder' >&2\nexit 1\n")
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_ffmpeg([ffmpeg], progress_callback=lambda event: None)
+    assert error.value.stderr.endswith("Unknown encoder\n")
+    assert "line 0\n" not in error.value.stderr  # Only the last lines are kept
+
+def test_parallel_pieces_report_one_combined_progress():
+    events = []
+    progress = watermark._PiecesProgress([(0.0, 10.0, True), (10.0, 40.0, True)], events.append)
+    progress.piece_callback(0)({'out_time': 5.0, 'fps': 30.0})
+    progress.piece_callback(1)({'out_time': 15.0, 'fps': 20.0})
+    assert (events[-1]['percent'], events[-1]['out_time'], events[-1]['fps']) == (50.0, 20.0, 50.0)
+
+    # A piece never counts for more than its own length
+    progress.piece_callback(0)({'out_time': 12.0, 'fps': 30.0})
+    assert events[-1]['out_time'] == 25.0
+    progress.finish(1)
+    assert events[-1]['percent'] == 100.0
+    assert watermark._PiecesProgress([(0.0, 10.0, True)], None).piece_callback(0) is None
+
+def test_job_progress_weights_the_download_and_the_watermark():
+    assert job_percent('download', 100) == DOWNLOAD_PROGRESS_WEIGHT * 100
+    assert job_percent('watermark', 0) == DOWNLOAD_PROGRESS_WEIGHT * 100
+    assert job_percent('watermark', 100) == pytest.approx(100)
+    assert job_percent('download', 50, watermark=False) == 50
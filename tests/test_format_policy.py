@@ -0,0 +1,95 @@
+import pytest
+
+import format_policy
+from format_policy import (DEFAULT_BANDWIDTH, DEFAULT_ENCODE_FPS, ThroughputStats, choose_formats,
+                           configure_throughput_stats, estimate_size, get_policy, get_throughput_stats, rank_formats)
+
+MB = 1024 * 1024
+
+FORMATS = [
+    {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a.40.2", 'abr': 128, 'filesize': 1 * MB},
+    {'format_id': "251", 'vcodec': "none", 'acodec': "opus", 'abr': 160, 'filesize': 1 * MB},
+    {'format_id': "18", 'vcodec': "avc1.42001E", 'acodec': "mp4a.40.2", 'height': 360, 'filesize': 5 * MB},
+    {'format_id': "136", 'vcodec': "avc1.4d401f", 'acodec': "none", 'height': 720, 'fps': 30, 'filesize': 20 * MB},
+    {'format_id': "247", 'vcodec': "vp9", 'acodec': "none", 'height': 720, 'fps': 30, 'filesize': 15 * MB},
+    {'format_id': "137", 'vcodec': "avc1.640028", 'acodec': "none", 'height': 1080, 'fps': 30,
+     'filesize_approx': 60 * MB},
+    {'format_id': "399", 'vcodec': "av01.0.08M.08", 'acodec': "none", 'height': 1080, 'filesize': 30 * MB},
+    {'format_id': "160", 'vcodec': "avc1.4d400c", 'acodec': "none", 'height': 144, 'tbr': 100},
+]
+
+@pytest.fixture
+def stats():
+    # Nothing measured: the defaults, and nothing written to disk
+    return ThroughputStats(stats_file=None)
+
+def format_ids(estimates):
+    return [estimate['format']['format_id'] for estimate in estimates]
+
+def test_best_policy_ranks_by_resolution_then_codec(stats):
+    ranked = rank_formats(FORMATS, duration=60, stats=stats)
+    # Muxed, audio-only, AV1 and formats without a size are left out
+    assert format_ids(ranked) == ["137", "247", "136", "160"]
+    assert all(estimate['fits'] for estimate in ranked)
+
+def test_estimates_use_size_bandwidth_and_encode_speed(stats):
+    estimate = rank_formats(FORMATS, duration=60, stats=stats)[1]
+    assert estimate['size'] == 15 * MB + 1 * MB
+    assert estimate['download_seconds'] == pytest.approx(16 * MB / DEFAULT_BANDWIDTH)
+    # 720p encodes (1080 / 720)^2 times faster than the 1080p reference
+    assert estimate['encode_seconds'] == pytest.approx(60 * 30 / (DEFAULT_ENCODE_FPS * 2.25))
+    assert rank_formats(FORMATS, duration=60, watermark=False, stats=stats)[1]['encode_seconds'] == 0
+
+def test_size_from_bitrate():
+    assert estimate_size({'tbr': 800}, duration=10) == 800 * 1000 / 8 * 10
+    assert estimate_size({'tbr': 800}) is None
+    assert estimate_size({'filesize_approx': 5}) == 5
+
+def test_limits_prefer_what_fits_and_fall_back_to_the_fastest(stats):
+    ranked = rank_formats(FORMATS, duration=60, policy=get_policy("best", max_mb=18), stats=stats)
+    assert format_ids(ranked) == ["247", "160", "136", "137"]
+    assert [estimate['fits'] for estimate in ranked] == [True, True, False, False]
+
+    # Nothing fits: the quickest job comes first
+    ranked = rank_formats(FORMATS, duration=60, policy=get_policy("best", max_mb=0.001), stats=stats)
+    assert format_ids(ranked)[0] == "160"
+    assert not any(estimate['fits'] for estimate in ranked)
+
+def test_named_policies(stats):
+    assert format_ids(rank_formats(FORMATS, 60, get_policy("smallest"), stats=stats))[:2] == ["160", "247"]
+    assert format_ids(rank_formats(FORMATS, 60, get_policy("fastest"), stats=stats))[0] == "160"
+    with pytest.raises(ValueError):
+        get_policy("cheapest")
+
+def test_choose_formats_picks_the_best_audio_too(stats):
+    assert choose_formats(FORMATS, duration=60, stats=stats) == ("137", "251")
+    with pytest.raises(ValueError):
+        choose_formats([FORMATS[0]], stats=stats)
+
+def test_measurements_are_smoothed_and_saved(tmp_path):
+    stats_file = str(tmp_path / "throughput.json")
+    stats = ThroughputStats(stats_file)
+    stats.record_download(10 * MB, 1)
+    stats.record_download(20 * MB, 1)
+    assert stats.bandwidth() == pytest.approx(13 * MB)  # 10 + 0.3 * (20 - 10)
+    stats.record_encode(720, 1200, 10)
+    stats.record_download(0, 1)  # Ignored
+
+    reloaded = ThroughputStats(stats_file)
+    assert reloaded.bandwidth() == pytest.approx(13 * MB)
+    assert reloaded.encode_fps(720) == pytest.approx(120)
+    # Scaled from the nearest measured resolution by pixel count
+    assert reloaded.encode_fps(1440) == pytest.approx(30)
+
+def test_unreadable_stats_file_is_ignored(tmp_path):
+    stats_file = tmp_path / "throughput.json"
+    stats_file.write_text("{not json")
+    assert ThroughputStats(str(stats_file)).bandwidth() == DEFAULT_BANDWIDTH
+
+def test_configured_stats_are_the_shared_ones(tmp_path, monkeypatch):
+    monkeypatch.setattr(format_policy, 'throughput_stats', format_policy.throughput_stats)
+    stats = configure_throughput_stats(stats_file=None)
+    assert get_throughput_stats() is stats
+    stats.record_download(8 * MB, 1)
+    assert stats.bandwidth() == 8 * MB
+    assert stats.stats_file is None
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+import downloader
+from downloader import InfoCache, configure_info_cache, configure_info_provider, get_video_id, get_video_info
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Controls the time the cache sees; advance it with clock['now'] += seconds.
+    """
+    clock = {'now': 1000.0}
+
+    class Time:
+        @staticmethod
+        def time():
+            return clock['now']
+
+    monkeypatch.setattr(downloader, 'time', Time)
+    return clock
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = InfoCache(ttl=60)
+    cache.put("aaaaaaaaaaa", {'title': "A"})
+    clock['now'] += 59
+    assert cache.get("aaaaaaaaaaa") == {'title': "A"}
+    clock['now'] += 2
+    assert cache.get("aaaaaaaaaaa") is None
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = InfoCache(max_entries=2)
+    cache.put("a", {'title': "A"})
+    cache.put("b", {'title': "B"})
+    assert cache.get("a")  # b is now the least recently used
+    cache.put("c", {'title': "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+def test_entries_are_reloaded_from_disk(tmp_path, clock):
+    InfoCache(ttl=60, cache_dir=str(tmp_path)).put("aaaaaaaaaaa", {'title': "A"})
+    restarted = InfoCache(ttl=60, cache_dir=str(tmp_path))
+    assert restarted.get("aaaaaaaaaaa") == {'title': "A"}
+    # The on-disk copy keeps its original age
+    clock['now'] += 61
+    assert InfoCache(ttl=60, cache_dir=str(tmp_path)).get("aaaaaaaaaaa") is None
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path, clock):
+    cache = InfoCache(cache_dir=str(tmp_path))
+    cache.put("aaaaaaaaaaa", {'title': "A"})
+    for path in tmp_path.iterdir():
+        path.write_text("{not json")
+    assert InfoCache(cache_dir=str(tmp_path)).get("aaaaaaaaaaa") is None
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123&index=2",
+    "https://youtu.be/dQw4w9WgXcQ?t=10",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+    "dQw4w9WgXcQ",
+])
+def test_url_forms_share_one_video_id(url):
+    assert get_video_id(url) == "dQw4w9WgXcQ"
+
+class CountingProvider:
+    def __init__(self, delay=None):
+        self.calls = []
+        self.delay = delay
+
+    def extract_info(self, video_url):
+        self.calls.append(video_url)
+        if self.delay:
+            self.delay.wait(5)
+        return {'id': get_video_id(video_url), 'title': "Video", 'formats': []}
+
+    def playlist_entries(self, playlist_url):
+        return []
+
+@pytest.fixture
+def provider():
+    configure_info_cache()
+    provider = configure_info_provider(CountingProvider(threading.Event()))
+    yield provider
+    configure_info_provider(None)
+    configure_info_cache()
+
+def test_each_video_is_extracted_once(provider):
+    provider.delay.set()
+    assert get_video_info("https://www.youtube.com/watch?v=dQw4w9WgXcQ")['title'] == "Video"
+    assert get_video_info("https://youtu.be/dQw4w9WgXcQ")['title'] == "Video"
+    assert len(provider.calls) == 1
+
+def test_concurrent_requests_for_one_video_share_the_extraction(provider):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_video_info("dQw4w9WgXcQ"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    provider.delay.set()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    assert len(provider.calls) == 1
@@ -0,0 +1,137 @@
+import contextlib
+import json
+import pstats
+import subprocess
+import sys
+import time
+
+import pytest
+
+from instrumentation import Recorder, Span, resource
+
+def run_span(recorder, stage, error=None, **attributes):
+    with pytest.raises(RuntimeError) if error else contextlib.nullcontext():
+        with Span(recorder, stage, attributes):
+            if error:
+                raise RuntimeError(error)
+
+def test_span_records_timings_and_attributes():
+    recorder = Recorder()
+    with Span(recorder, "download", {'video_id': "abc"}) as s:
+        time.sleep(0.02)
+        s.set(bytes=1024)
+
+    [record] = recorder.recent_spans()
+    assert record['stage'] == "download"
+    assert record['video_id'] == "abc"
+    assert record['bytes'] == 1024
+    assert record['wall_seconds'] >= 0.02
+    assert record['cpu_seconds'] >= 0
+    assert record['error'] is None
+
+def test_span_records_the_error_and_lets_it_through():
+    recorder = Recorder()
+    run_span(recorder, "encode", error="ffmpeg failed")
+    [record] = recorder.recent_spans("encode")
+    assert record['error'] == "ffmpeg failed"
+
+def test_recent_spans_filters_by_stage():
+    recorder = Recorder()
+    run_span(recorder, "download")
+    run_span(recorder, "encode")
+    run_span(recorder, "download")
+    assert [record['stage'] for record in recorder.recent_spans()] == ["download", "encode", "download"]
+    assert len(recorder.recent_spans("download")) == 2
+
+def test_totals_sum_each_stage():
+    recorder = Recorder()
+    run_span(recorder, "download", bytes=100)
+    run_span(recorder, "download", bytes=50)
+    run_span(recorder, "encode", ffmpeg_speed=2.0)
+    run_span(recorder, "encode", ffmpeg_speed=4.0)
+    run_span(recorder, "encode", error="boom")
+
+    totals = recorder.totals()
+    assert totals['download']['count'] == 2
+    assert totals['download']['bytes'] == 150
+    assert totals['download']['errors'] == 0
+    assert totals['encode']['count'] == 3
+    assert totals['encode']['errors'] == 1
+    assert totals['encode']['speed_sum'] == 6.0
+    assert totals['encode']['speed_count'] == 2
+
+def test_prometheus_text():
+    recorder = Recorder()
+    run_span(recorder, "download", bytes=100)
+    run_span(recorder, "encode", ffmpeg_speed=3.0)
+
+    lines = recorder.prometheus_text().splitlines()
+    assert "# TYPE ytdwm_stage_runs_total counter" in lines
+    assert 'ytdwm_stage_runs_total{stage="download"} 1' in lines
+    assert 'ytdwm_stage_bytes_total{stage="download"} 100' in lines
+    assert 'ytdwm_stage_errors_total{stage="encode"} 0' in lines
+    assert 'ytdwm_ffmpeg_speed_average{stage="encode"} 3.0' in lines
+    # Stages without an ffmpeg speed get no average
+    assert not any(line.startswith('ytdwm_ffmpeg_speed_average{stage="download"}') for line in lines)
+
+def test_write_prometheus(tmp_path):
+    recorder = Recorder()
+    run_span(recorder, "download")
+    path = tmp_path / "metrics.prom"
+    recorder.write_prometheus(path)
+    assert path.read_text(encoding='utf-8') == recorder.prometheus_text()
+
+def test_spans_are_appended_as_json_lines(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    recorder = Recorder()
+    recorder.configure(jsonl_path=str(path))
+    run_span(recorder, "download", video_id="abc")
+    run_span(recorder, "encode", error="boom")
+
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [record['stage'] for record in records] == ["download", "encode"]
+    assert records[0]['video_id'] == "abc"
+    assert records[1]['error'] == "boom"
+
+def test_no_file_is_written_without_a_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run_span(Recorder(), "download")
+    assert list(tmp_path.iterdir()) == []
+
+def test_write_profile_without_profiling(tmp_path):
+    recorder = Recorder()
+    run_span(recorder, "download")
+    path = tmp_path / "profile.pstats"
+    assert recorder.write_profile(str(path)) is False
+    assert not path.exists()
+
+def test_write_profile_merges_profiled_spans(tmp_path):
+    recorder = Recorder()
+    recorder.configure(profile=True)
+    run_span(recorder, "download")
+    run_span(recorder, "encode")
+    path = tmp_path / "profile.pstats"
+    assert recorder.write_profile(str(path)) is True
+    assert pstats.Stats(str(path)).total_calls > 0
+
+def test_nested_spans_are_profiled_once():
+    recorder = Recorder()
+    recorder.configure(profile=True)
+    with Span(recorder, "video", {}):
+        run_span(recorder, "download")
+    assert len(recorder._profiles) == 1
+
+@pytest.mark.skipif(resource is None, reason="needs resource.getrusage")
+def test_span_counts_the_cpu_of_child_processes():
+    recorder = Recorder()
+    with Span(recorder, "encode", {}):
+        # Busy for a moment in a child, like ffmpeg, and idle here
+        subprocess.run([sys.executable, "-c", "import time\nend = time.process_time() + 0.2\n"
+                        "while time.process_time() < end: pass"], check=True)
+
+    [record] = recorder.recent_spans()
+    assert record['child_cpu_seconds'] >= 0.15
+    assert record['cpu_seconds'] < record['child_cpu_seconds']
+    assert recorder.totals()['encode']['child_cpu_seconds'] == record['child_cpu_seconds']
+    assert any(line.startswith('ytdwm_stage_child_cpu_seconds_total{stage="encode"}')
+               for line in recorder.prometheus_text().splitlines())
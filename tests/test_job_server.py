@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import downloader
+from job_server import JobCancelled, JobManager, create_server, validate_request
+
+PLAYLIST_URL = "https://www.youtube.com/playlist?list=PLtest"
+
+class FakeProvider:
+    """
+    Stands in for yt_dlp: every video has one AVC and one audio format.
+    """
+
+    def extract_info(self, video_url):
+        video_id = video_url.rsplit("=", 1)[-1]
+        return {
+            'id': video_id, 'title': f"Video {video_id}", 'duration': 60,
+            'formats': [
+                {'format_id': "137", 'vcodec': "avc1.640028", 'acodec': "none", 'height': 1080, 'ext': "mp4",
+                 'tbr': 2000, 'filesize': 15_000_000},
+                {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a.40.2", 'ext': "m4a", 'abr': 128,
+                 'filesize': 1_000_000},
+            ],
+        }
+
+    def playlist_entries(self, playlist_url):
+        return [f"https://www.youtube.com/watch?v={video_id}" for video_id in ("pl1", "pl2", "pl3")]
+
+class FakeDownloader:
+    """
+    Writes a small output file; the video "slow" runs until its job is cancelled.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.cancelled = threading.Event()
+
+    def __call__(self, url, video_format_id, audio_format_id, output_path, watermark=True,
+                 watermark_text="LIMITLESS MEDIA", progress_callback=None, watermark_options=None,
+                 download_options=None, output_store=None):
+        self.calls.append({'url': url, 'output_path': output_path, 'watermark_options': watermark_options,
+                           'download_options': download_options, 'watermark_text': watermark_text})
+        video_id = url.rsplit("=", 1)[-1]
+        try:
+            if video_id == "slow":
+                for _ in range(1000):
+                    progress_callback(1.0)
+                    self.cancelled.wait(0.01)
+            progress_callback(50.0)
+        except JobCancelled:
+            self.cancelled.set()
+            raise
+        with open(os.path.join(output_path, f"{video_id}.mp4"), 'wb') as handle:
+            handle.write(b"video")
+        return True
+
+@pytest.fixture
+def service(tmp_path):
+    downloader.configure_info_provider(FakeProvider())
+    fake_downloader = FakeDownloader()
+    manager = JobManager(str(tmp_path), workers=2, downloader=fake_downloader)
+    server = create_server(manager, port=0)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield base_url, fake_downloader, tmp_path
+    server.shutdown()
+    server.server_close()
+    manager.shutdown()
+    downloader.configure_info_provider(None)
+
+def call(method, url, body=None):
+    data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode('utf-8')
+    request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def stream_events(base_url, job_id):
+    status, body = call("GET", f"{base_url}/jobs/{job_id}/events")
+    assert status == 200
+    return [json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+def test_playlist_job_runs_to_completion(service):
+    base_url, fake_downloader, root = service
+    status, body = call("POST", f"{base_url}/jobs", {
+        'url': PLAYLIST_URL, 'output_dir': "team", 'watermark_text': "Don't copy: v1, final",
+        'watermark_options': {'engine': "overlay", 'windows': [10, 60]},
+        'download_options': {'connections': 2, 'range_download': False},
+    })
+    assert status == 202
+    job_id = json.loads(body)['id']
+
+    events = stream_events(base_url, job_id)
+    assert events[-1]['type'] == 'job_state' and events[-1]['state'] == 'done'
+    assert [event['seq'] for event in events] == sorted(event['seq'] for event in events)
+
+    status, body = call("GET", f"{base_url}/jobs/{job_id}")
+    job = json.loads(body)
+    assert job['is_playlist']
+    assert [video['state'] for video in job['videos']] == ['done'] * 3
+    for video_id in ("pl1", "pl2", "pl3"):
+        assert (root / "team" / f"{video_id}.mp4").exists()
+    assert all(call_args['output_path'] == os.path.realpath(root / "team") for call_args in fake_downloader.calls)
+    assert fake_downloader.calls[0]['watermark_options'] == {'engine': "overlay", 'windows': (10.0, 60.0)}
+    assert fake_downloader.calls[0]['download_options'] == {'connections': 2, 'range_download': False}
+
+def test_cancel_stops_a_running_video(service):
+    base_url, fake_downloader, root = service
+    status, body = call("POST", f"{base_url}/jobs", {'url': "https://www.youtube.com/watch?v=slow"})
+    job_id = json.loads(body)['id']
+    for _ in range(500):
+        status, body = call("GET", f"{base_url}/jobs/{job_id}")
+        videos = json.loads(body)['videos']
+        if videos and videos[0]['state'] == 'running':
+            break
+        fake_downloader.cancelled.wait(0.01)
+
+    status, body = call("POST", f"{base_url}/jobs/{job_id}/cancel")
+    assert status == 200
+    assert fake_downloader.cancelled.wait(5)
+    events = stream_events(base_url, job_id)
+    assert events[-1]['state'] == 'cancelled'
+    assert not (root / "slow.mp4").exists()
+
+@pytest.mark.parametrize("body", [
+    {},
+    {'url': ""},
+    {'url': 42},
+    {'url': PLAYLIST_URL, 'priority': 1},
+    {'url': PLAYLIST_URL, 'output_dir': "../elsewhere"},
+    {'url': PLAYLIST_URL, 'output_dir': "/tmp"},
+    {'url': PLAYLIST_URL, 'watermark': "yes"},
+    {'url': PLAYLIST_URL, 'watermark_text': "x" * 500},
+    {'url': PLAYLIST_URL, 'watermark_text': "two\nlines"},
+    {'url': PLAYLIST_URL, 'format_policy': "cheapest"},
+    {'url': PLAYLIST_URL, 'max_minutes': -1},
+    {'url': PLAYLIST_URL, 'watermark_options': {'windows': [10, 0]}},
+    {'url': PLAYLIST_URL, 'watermark_options': {'windows': [0.001, 0.002]}},
+    {'url': PLAYLIST_URL, 'watermark_options': {'video_codec': "libx265"}},
+    {'url': PLAYLIST_URL, 'watermark_options': {'segments': 10_000}},
+    {'url': PLAYLIST_URL, 'watermark_options': "fast"},
+    {'url': PLAYLIST_URL, 'download_options': {'connections': "4"}},
+    {'url': PLAYLIST_URL, 'download_options': {'retries': 0}},
+    {'url': PLAYLIST_URL, 'download_options': {'range_download': 1}},
+    {'url': PLAYLIST_URL, 'download_options': {'outtmpl': "/etc/%(id)s"}},
+    b"not json",
+    [PLAYLIST_URL],
+])
+def test_bad_requests_are_rejected(service, body):
+    base_url, fake_downloader, root = service
+    status, response = call("POST", f"{base_url}/jobs", body)
+    assert status == 400
+    assert json.loads(response)['error']
+    status, response = call("GET", f"{base_url}/health")
+    assert json.loads(response)['jobs'] == 0
+
+def test_request_is_normalized(tmp_path):
+    request = validate_request({'url': " https://www.youtube.com/watch?v=a ", 'max_mb': None,
+                                'watermark_options': {'windows': [5, 30]}}, str(tmp_path))
+    assert request == {'url': "https://www.youtube.com/watch?v=a", 'output_dir': os.path.realpath(tmp_path),
+                       'watermark_options': {'windows': (5.0, 30.0)}}
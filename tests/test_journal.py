@@ -0,0 +1,75 @@
+import sqlite3
+
+from journal import DONE, DOWNLOADED, FAILED, RESOLVED, WATERMARKING, JobJournal
+
+def test_entries_survive_reopening(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True)
+    journal.set_state("a", DOWNLOADED, downloaded={'video_file': "a.mp4", 'audio_file': "a.m4a"})
+    journal.close()
+
+    journal = JobJournal(str(tmp_path))
+    entry = journal.get("a")
+    assert entry['state'] == DOWNLOADED
+    assert entry['downloaded'] == {'video_file': "a.mp4", 'audio_file': "a.m4a"}
+    assert entry['watermark'] is True
+    assert [entry['video_id'] for entry in journal.entries()] == ["a"]
+    journal.close()
+
+def test_same_formats_keep_progress(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True)
+    journal.set_state("a", WATERMARKING, downloaded={'video_file': "a.mp4"})
+    entry = journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True)
+    assert entry['state'] == WATERMARKING
+    assert entry['downloaded'] == {'video_file': "a.mp4"}
+    journal.close()
+
+def test_changed_formats_or_watermark_reset_progress(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True)
+    journal.set_state("a", DONE, output_file="a.mp4")
+    entry = journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "248", "140", True)
+    assert (entry['state'], entry['video_format_id'], entry['output_file']) == (RESOLVED, "248", None)
+
+    journal.set_state("a", DONE, output_file="a.mp4")
+    entry = journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "248", "140", False)
+    assert (entry['state'], entry['watermark']) == (RESOLVED, False)
+    journal.close()
+
+def test_failure_keeps_earlier_fields(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True)
+    journal.set_state("a", DOWNLOADED, downloaded={'video_file': "a.mp4"})
+    journal.set_state("a", FAILED, error="ffmpeg exited with 1")
+    entry = journal.get("a")
+    assert (entry['state'], entry['error']) == (FAILED, "ffmpeg exited with 1")
+    assert entry['downloaded'] == {'video_file': "a.mp4"}
+    assert journal.get("missing") is None
+    journal.close()
+
+def test_other_settings_reset_progress(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True, "key1")
+    journal.set_state("a", DONE, output_file="a.mp4")
+    assert journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True, "key1")['state'] == DONE
+    entry = journal.record_resolved("a", "https://www.youtube.com/watch?v=a", "137", "140", True, "key2")
+    assert (entry['state'], entry['settings']) == (RESOLVED, "key2")
+    journal.close()
+
+def test_journal_without_settings_is_upgraded(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / ".download_journal.sqlite3"))
+    connection.execute(
+        "CREATE TABLE jobs (video_id TEXT PRIMARY KEY, url TEXT NOT NULL, state TEXT NOT NULL, video_format_id TEXT, "
+        "audio_format_id TEXT, watermark INTEGER, downloaded TEXT, output_file TEXT, error TEXT, "
+        "updated_at REAL NOT NULL)"
+    )
+    connection.execute("INSERT INTO jobs VALUES ('a', 'url', 'done', '137', '140', 1, NULL, 'a.mp4', NULL, 0)")
+    connection.commit()
+    connection.close()
+
+    journal = JobJournal(str(tmp_path))
+    assert journal.get("a")['settings'] is None
+    # Without a recorded settings key the video cannot be trusted to match
+    assert journal.record_resolved("a", "url", "137", "140", True, "key")['state'] == RESOLVED
+    journal.close()
@@ -0,0 +1,103 @@
+import itertools
+
+import pytest
+
+import output_store
+from encoder_policy import DEFAULT_PROFILE
+from output_store import OutputStore, fingerprint, store_key
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every timestamp the store records one second later than the last.
+    """
+    ticks = itertools.count(1)
+
+    class Clock:
+        @staticmethod
+        def time():
+            return float(next(ticks))
+
+    monkeypatch.setattr(output_store, 'time', Clock)
+
+def make_file(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+def test_key_ignores_speed_only_settings():
+    base = store_key("a" * 11, "137", "140", True, "LIMITLESS MEDIA", {'engine': "overlay"})
+    assert base == store_key("a" * 11, "137", "140", True, "LIMITLESS MEDIA",
+                             {'engine': "overlay", 'segments': 8, 'workers': 4, 'threads_per_worker': 2,
+                              'encoder_profile': DEFAULT_PROFILE})
+    assert base != store_key("a" * 11, "137", "140", True, "OTHER TEXT", {'engine': "overlay"})
+    assert base != store_key("a" * 11, "248", "140", True, "LIMITLESS MEDIA", {'engine': "overlay"})
+    assert base != store_key("a" * 11, "137", "140", True, "LIMITLESS MEDIA",
+                             {'engine': "overlay", 'encoder_profile': "archival"})
+    # Watermark settings do not matter when there is no watermark
+    assert store_key("a" * 11, "137", "140", False, "ONE", {'windows': (10, 60)}) == \
+        store_key("a" * 11, "137", "140", False, "TWO")
+
+def test_stored_output_is_linked_into_place(tmp_path, clock):
+    store = OutputStore(str(tmp_path / "store"))
+    store.put("k" * 64, make_file(tmp_path / "video.mp4", b"watermarked video"))
+    destination = str(tmp_path / "elsewhere" / "video.mp4")
+    assert store.get("k" * 64, destination) == destination
+    with open(destination, 'rb') as handle:
+        assert handle.read() == b"watermarked video"
+    assert store.get("k" * 64, destination) == destination  # Already in place
+    assert store.get("m" * 64, str(tmp_path / "missing.mp4")) is None
+    store.close()
+
+    reopened = OutputStore(str(tmp_path / "store"))
+    assert reopened.total_size() == len(b"watermarked video")
+    reopened.close()
+
+def test_changed_file_fails_the_integrity_check(tmp_path, clock):
+    store = OutputStore(str(tmp_path / "store"))
+    source = make_file(tmp_path / "video.mp4", b"watermarked video")
+    store.put("k" * 64, source)
+    # An in-place edit of the same size must not be served as the original
+    with open(store._path("k" * 64), 'r+b') as handle:
+        handle.write(b"W")
+    assert store.get("k" * 64, str(tmp_path / "copy.mp4")) is None
+    assert store.total_size() == 0
+    store.close()
+
+def test_overwriting_a_delivered_output_leaves_the_store_intact(tmp_path, clock):
+    store = OutputStore(str(tmp_path / "store"))
+    delivered = make_file(tmp_path / "video.mp4", b"watermarked video")
+    store.put("k" * 64, delivered)
+    linked = str(tmp_path / "linked.mp4")
+    store.get("k" * 64, linked)
+
+    # Like ffmpeg -y re-running the same title with other settings
+    for path in (delivered, linked):
+        with open(path, 'wb') as handle:
+            handle.write(b"other settings")
+
+    again = str(tmp_path / "again.mp4")
+    assert store.get("k" * 64, again) == again
+    with open(again, 'rb') as handle:
+        assert handle.read() == b"watermarked video"
+    store.close()
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    store = OutputStore(str(tmp_path / "store"), max_bytes=10)
+    store.put("a" * 64, make_file(tmp_path / "a.mp4", b"aaaa"))
+    store.put("b" * 64, make_file(tmp_path / "b.mp4", b"bbbb"))
+    assert store.get("a" * 64, str(tmp_path / "a2.mp4"))  # a is now more recent than b
+    store.put("c" * 64, make_file(tmp_path / "c.mp4", b"cccc"))
+
+    assert store.total_size() == 8
+    assert store.get("b" * 64, str(tmp_path / "b2.mp4")) is None
+    assert store.get("a" * 64, str(tmp_path / "a3.mp4"))
+    assert store.get("c" * 64, str(tmp_path / "c2.mp4"))
+    store.close()
+
+def test_fingerprint_covers_both_ends(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_store, 'FINGERPRINT_SAMPLE', 4)
+    original = fingerprint(make_file(tmp_path / "one.bin", b"0123456789ab"))
+    assert fingerprint(make_file(tmp_path / "two.bin", b"0123456789aX")) != original
+    assert fingerprint(make_file(tmp_path / "three.bin", b"X123456789ab")) != original
+    # The middle is not sampled
+    assert fingerprint(make_file(tmp_path / "four.bin", b"0123XXXX89ab")) == original
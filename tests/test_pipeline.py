@@ -0,0 +1,229 @@
+import threading
+
+import pytest
+
+import pipeline
+from journal import DONE, DOWNLOADED, FAILED, WATERMARKING, JobJournal
+from sync_archive import settings_key
+
+# Settings key of a job with the default watermark
+DEFAULT_SETTINGS = settings_key()
+
+@pytest.fixture
+def stages(monkeypatch, tmp_path):
+    """
+    Replaces the download and encode stages with fakes that record their calls.
+    """
+    calls = {'download': [], 'encode': []}
+
+    def download_stage(url, video_format_id, audio_format_id, output_path, info=None, merge=False,
+                       download_options=None, progress_callback=None):
+        calls['download'].append(url)
+        video_file = tmp_path / f"{url[-1]}.video.mp4"
+        video_file.write_bytes(b"video")
+        return {'video_file': str(video_file), 'audio_file': None, 'merged_input': None}
+
+    def encode_stage(downloaded, watermark=True, watermark_text=None, video_codec=None, watermark_options=None,
+                     progress_callback=None):
+        calls['encode'].append(downloaded['video_file'])
+        output = downloaded['video_file'].replace(".video.mp4", ".mp4")
+        with open(output, 'wb') as handle:
+            handle.write(b"watermarked")
+        return output
+
+    monkeypatch.setattr(pipeline, 'download_stage', download_stage)
+    monkeypatch.setattr(pipeline, 'encode_stage', encode_stage)
+    monkeypatch.setattr(pipeline, 'select_video_codec', lambda prefer_cpu=False: "libx264")
+    return calls
+
+def video_id(name):
+    return name * 11
+
+def make_job(tmp_path, name):
+    return {'url': f"https://www.youtube.com/watch?v={video_id(name)}", 'video_format_id': "137",
+            'audio_format_id': "140", 'output_path': str(tmp_path)}
+
+def test_list_of_jobs(stages, tmp_path):
+    results = pipeline.run_pipeline([make_job(tmp_path, "a"), make_job(tmp_path, "b")])
+    assert [result['success'] for result in results] == [True, True]
+    assert [result['output'] for result in results] == [str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")]
+
+def test_next_video_downloads_while_the_previous_one_is_encoded(stages, tmp_path, monkeypatch):
+    download = pipeline.download_stage
+    encode = pipeline.encode_stage
+    second_download_started = threading.Event()
+
+    def tracking_download(url, *args, **kwargs):
+        if url.endswith("b"):
+            second_download_started.set()
+        return download(url, *args, **kwargs)
+
+    def blocking_encode(downloaded, **options):
+        if downloaded['video_file'].endswith("a.video.mp4"):
+            assert second_download_started.wait(5), "the download stage waited for the encode"
+        return encode(downloaded, **options)
+
+    monkeypatch.setattr(pipeline, 'download_stage', tracking_download)
+    monkeypatch.setattr(pipeline, 'encode_stage', blocking_encode)
+    results = pipeline.run_pipeline([make_job(tmp_path, "a"), make_job(tmp_path, "b")],
+                                    download_workers=1, encode_workers=1)
+    assert [result['success'] for result in results] == [True, True]
+
+def test_a_failed_download_does_not_stop_the_others(stages, tmp_path, monkeypatch):
+    download = pipeline.download_stage
+
+    def failing_download(url, *args, **kwargs):
+        if url.endswith("b"):
+            raise RuntimeError("HTTP Error 403")
+        return download(url, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline, 'download_stage', failing_download)
+    events = []
+    results = pipeline.run_pipeline([make_job(tmp_path, name) for name in "abc"], download_workers=2,
+                                    encode_workers=2, progress_callback=events.append)
+    assert [result['url'][-1] for result in results] == ["a", "b", "c"]
+    assert [result['success'] for result in results] == [True, False, True]
+    assert results[1]['error'] == "HTTP Error 403"
+    assert ('video_failed', 1) in [(event['type'], event['index']) for event in events]
+    assert len(stages['encode']) == 2
+
+def test_jobs_from_a_generator_start_before_it_is_exhausted(stages, tmp_path):
+    first_done = threading.Event()
+
+    def jobs():
+        yield make_job(tmp_path, "a")
+        # The second video only "resolves" once the first one has been processed
+        assert first_done.wait(5), "the pipeline waited for every job before starting"
+        yield make_job(tmp_path, "b")
+
+    def progress(event):
+        if event['type'] == 'video_done' and event['index'] == 0:
+            first_done.set()
+
+    results = pipeline.run_pipeline(jobs(), progress_callback=progress)
+    assert [result['url'][-1] for result in results] == ["a", "b"]
+    assert all(result['success'] for result in results)
+
+def test_empty_generator(stages):
+    assert pipeline.run_pipeline(iter([])) == []
+    assert stages == {'download': [], 'encode': []}
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    yield journal
+    journal.close()
+
+def test_finished_videos_are_skipped(stages, tmp_path, journal):
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"watermarked")
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "137", "140", True, DEFAULT_SETTINGS)
+    journal.set_state(video_id("a"), DONE, output_file=str(output))
+    events = []
+
+    results = pipeline.run_pipeline([make_job(tmp_path, "a"), make_job(tmp_path, "b")], journal=journal,
+                                    progress_callback=events.append)
+    assert results[0] == {'url': make_job(tmp_path, "a")['url'], 'success': True, 'output': str(output),
+                          'error': None, 'skipped': True, 'cached': False}
+    assert stages['download'] == [make_job(tmp_path, "b")['url']]
+    assert ('video_skipped', 0) in [(event['type'], event['index']) for event in events]
+    assert journal.get(video_id("b"))['state'] == DONE
+
+def test_done_video_is_made_again_with_other_watermark_settings(stages, tmp_path, journal):
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"watermarked")
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "137", "140", True, DEFAULT_SETTINGS)
+    journal.set_state(video_id("a"), DONE, output_file=str(output))
+
+    results = pipeline.run_pipeline([{**make_job(tmp_path, "a"), 'watermark_text': "NEW TEXT"}], journal=journal)
+    assert results[0]['success'] and not results[0]['skipped']
+    assert len(stages['download']) == 1
+    assert journal.get(video_id("a"))['settings'] == settings_key(True, "NEW TEXT")
+
+def test_done_video_whose_output_was_deleted_runs_again(stages, tmp_path, journal):
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "137", "140", True, DEFAULT_SETTINGS)
+    journal.set_state(video_id("a"), DONE, output_file=str(tmp_path / "deleted.mp4"))
+    results = pipeline.run_pipeline([make_job(tmp_path, "a")], journal=journal)
+    assert results[0]['success'] and not results[0]['skipped']
+    assert len(stages['download']) == 1
+
+@pytest.mark.parametrize("state", [DOWNLOADED, WATERMARKING])
+def test_downloaded_video_resumes_at_the_encode(stages, tmp_path, journal, state):
+    video_file = tmp_path / "a.video.mp4"
+    video_file.write_bytes(b"video")
+    downloaded = {'video_file': str(video_file), 'audio_file': None, 'merged_input': None}
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "137", "140", True, DEFAULT_SETTINGS)
+    journal.set_state(video_id("a"), state, downloaded=downloaded)
+
+    results = pipeline.run_pipeline([make_job(tmp_path, "a")], journal=journal)
+    assert results[0]['success']
+    assert stages['download'] == []
+    assert stages['encode'] == [str(video_file)]
+    assert journal.get(video_id("a"))['state'] == DONE
+
+def test_downloaded_video_whose_files_are_gone_is_downloaded_again(stages, tmp_path, journal):
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "137", "140", True, DEFAULT_SETTINGS)
+    journal.set_state(video_id("a"), WATERMARKING, downloaded={'video_file': str(tmp_path / "gone.mp4")})
+    pipeline.run_pipeline([make_job(tmp_path, "a")], journal=journal)
+    assert len(stages['download']) == 1
+
+def test_failures_are_recorded(stages, tmp_path, journal, monkeypatch):
+    def failing_encode(downloaded, **options):
+        raise RuntimeError("Failed to add watermark")
+
+    monkeypatch.setattr(pipeline, 'encode_stage', failing_encode)
+    results = pipeline.run_pipeline([make_job(tmp_path, "a")], journal=journal)
+    assert results[0]['error'] == "Failed to add watermark"
+    entry = journal.get(video_id("a"))
+    assert (entry['state'], entry['error']) == (FAILED, "Failed to add watermark")
+    assert entry['downloaded']['video_file'] == str(tmp_path / "a.video.mp4")
+
+def make_lazy_job(tmp_path, name, resolve):
+    job = make_job(tmp_path, name)
+    del job['video_format_id'], job['audio_format_id']
+    return {**job, 'resolve': resolve}
+
+def test_lazy_job_is_resolved_by_a_download_worker(stages, tmp_path, journal):
+    resolved_in = []
+
+    def resolve():
+        resolved_in.append(threading.current_thread())
+        return {'video_format_id': "248", 'audio_format_id': "251"}
+
+    results = pipeline.run_pipeline([make_lazy_job(tmp_path, "a", resolve)], journal=journal)
+    assert results[0]['success']
+    assert resolved_in and resolved_in[0] is not threading.current_thread()
+    entry = journal.get(video_id("a"))
+    assert (entry['video_format_id'], entry['audio_format_id'], entry['state']) == ("248", "251", DONE)
+
+def test_lazy_job_whose_resolve_fails(stages, tmp_path):
+    def resolve():
+        raise RuntimeError("Video unavailable")
+
+    events = []
+    results = pipeline.run_pipeline([make_lazy_job(tmp_path, "a", resolve), make_job(tmp_path, "b")],
+                                    progress_callback=events.append)
+    assert results[0]['error'] == "Video unavailable"
+    assert results[1]['success']
+    assert ('video_failed', 0) in [(event['type'], event['index']) for event in events]
+    assert stages['download'] == [make_job(tmp_path, "b")['url']]
+
+def test_lazy_job_reuses_the_journaled_formats(stages, tmp_path, journal):
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "248", "251", True, DEFAULT_SETTINGS)
+
+    def resolve():
+        raise AssertionError("a journaled video was resolved again")
+
+    results = pipeline.run_pipeline([make_lazy_job(tmp_path, "a", resolve)], journal=journal)
+    assert results[0]['success']
+    assert journal.get(video_id("a"))['video_format_id'] == "248"
+
+def test_lazy_job_is_resolved_again_with_other_watermark_settings(stages, tmp_path, journal):
+    journal.record_resolved(video_id("a"), make_job(tmp_path, "a")['url'], "248", "251", True, DEFAULT_SETTINGS)
+    job = {**make_lazy_job(tmp_path, "a", lambda: {'video_format_id': "137", 'audio_format_id': "140"}),
+           'watermark_text': "NEW TEXT"}
+
+    results = pipeline.run_pipeline([job], journal=journal)
+    assert results[0]['success']
+    entry = journal.get(video_id("a"))
+    assert (entry['video_format_id'], entry['settings']) == ("137", settings_key(True, "NEW TEXT"))
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import playlist_view
+from playlist_view import PlaylistRow
+
+FORMATS = [
+    {'format_id': "137", 'vcodec': "avc1", 'acodec': "none", 'height': 1080, 'ext': "mp4", 'filesize': 4000},
+    {'format_id': "136", 'vcodec': "avc1", 'acodec': "none", 'height': 720, 'ext': "mp4", 'filesize': 2000},
+    {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a", 'ext': "m4a", 'abr': 128, 'filesize': 100},
+]
+
+def make_row(status='ready'):
+    return PlaylistRow({'url': "https://www.youtube.com/watch?v=a", 'title': "A", 'status': status,
+                        'formats': FORMATS, 'duration': 60})
+
+def test_options_are_built_once_and_never_seen_half_done(monkeypatch):
+    calls = []
+    real_rank_formats = playlist_view.rank_formats
+
+    def slow_rank_formats(*args):
+        calls.append(args)
+        time.sleep(0.05)
+        return real_rank_formats(*args)
+
+    monkeypatch.setattr(playlist_view, 'rank_formats', slow_rank_formats)
+    row = make_row()
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(list(row.ensure_format_options()))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(options == seen[0] for options in seen)
+    assert [format_id for _, format_id in seen[0]] == ["137", "136"]
+    assert row.video_format_id == "137"
+    assert row.audio_format_id == "140"
+
+def test_user_choice_is_kept():
+    row = make_row()
+    row.video_format_id = "136"
+    row.ensure_format_options()
+    assert row.video_format_id == "136"
+
+def test_pending_and_failed_rows_have_no_options():
+    assert make_row('pending').ensure_format_options() == []
+    row = make_row('error: unavailable')
+    assert row.ensure_format_options() == []
+    assert row.video_format_id is None
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from downloader import configure_info_cache, configure_info_provider, get_video_id, process_url
+
+PLAYLIST_URL = "https://www.youtube.com/playlist?list=PL123"
+
+def video_url(name):
+    return f"https://www.youtube.com/watch?v={name * 11}"
+
+class PlaylistProvider:
+    """
+    Serves a playlist of videos named by one letter. Video "x" is unavailable,
+    and the first video only resolves once another one has been reported.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.release_first = threading.Event()
+
+    def extract_info(self, url):
+        name = get_video_id(url)[0]
+        if name == "x":
+            raise ValueError("Video unavailable")
+        if name == self.names[0]:
+            assert self.release_first.wait(5), "later entries were not reported before the first finished"
+        return {'id': get_video_id(url), 'title': name.upper(), 'duration': 60, 'formats': []}
+
+    def playlist_entries(self, url):
+        return [{'url': video_url(name), 'title': None, 'duration': None} for name in self.names]
+
+@pytest.fixture
+def provider():
+    configure_info_cache()
+    provider = configure_info_provider(PlaylistProvider(["a", "b", "x", "c"]))
+    yield provider
+    configure_info_provider(None)
+    configure_info_cache()
+
+def test_entries_are_resolved_concurrently_and_reported_as_they_finish(provider, tmp_path):
+    events = []
+
+    def progress(event):
+        events.append(event)
+        if event['video']['title'] != "A":
+            provider.release_first.set()
+
+    result = process_url(PLAYLIST_URL, str(tmp_path), progress_callback=progress, max_workers=4)
+    assert result['is_playlist']
+    # Results keep playlist order even though "a" finished last
+    assert [video['url'] for video in result['videos']] == [video_url(name) for name in "abxc"]
+    assert [video['title'] for video in result['videos']] == ["A", "B", None, "C"]
+    assert events[-1]['video']['title'] == "A"
+    assert {event['total_videos'] for event in events} == {4}
+
+def test_errors_stay_in_their_entry(provider, tmp_path):
+    provider.release_first.set()
+    result = process_url(PLAYLIST_URL, str(tmp_path), max_workers=4)
+    statuses = [video['status'] for video in result['videos']]
+    assert statuses == ["ready", "ready", "error: Video unavailable", "ready"]
+
+def test_one_worker_resolves_in_order(provider, tmp_path):
+    provider.release_first.set()
+    events = []
+    result = process_url(PLAYLIST_URL, str(tmp_path), progress_callback=events.append, max_workers=1)
+    assert [event['video']['url'] for event in events] == [video['url'] for video in result['videos']]
+
+def test_lazy_playlist_is_not_resolved(provider, tmp_path):
+    result = process_url(PLAYLIST_URL, str(tmp_path), lazy=True)
+    assert [(video['title'], video['status'], video['formats']) for video in result['videos']] == \
+        [(video_url(name), 'pending', None) for name in "abxc"]
@@ -0,0 +1,101 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from range_downloader import _missing_ranges, download_ranges
+
+CONTENT = bytes(range(256)) * 400  # 102400 bytes
+CHUNK = 16 * 1024
+
+class Cancelled(Exception):
+    pass
+
+@pytest.fixture
+def server():
+    """
+    Serves CONTENT with range support at /file, failing ranges whose start is listed in `failing`.
+    """
+    state = {'served': 0, 'failing': set()}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end = (int(value) for value in self.headers['Range'].split("=")[1].split("-"))
+            if start in state['failing']:
+                self.send_error(500)
+                return
+            body = CONTENT[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            with lock:
+                state['served'] += len(body)
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state['url'] = f"http://127.0.0.1:{httpd.server_address[1]}/file"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_download_is_complete(server, tmp_path):
+    output = str(tmp_path / "video.mp4")
+    reports = []
+    download_ranges(server['url'], output, len(CONTENT), connections=4, chunk_size=CHUNK,
+                    progress_callback=lambda done, total: reports.append(done))
+    with open(output, 'rb') as handle:
+        assert handle.read() == CONTENT
+    assert max(reports) == len(CONTENT)
+    assert not os.path.exists(output + ".part")
+    assert not os.path.exists(output + ".part.ranges")
+
+def test_raising_callback_stops_the_download_and_it_resumes(server, tmp_path):
+    output = str(tmp_path / "video.mp4")
+
+    def cancel(done, total):
+        if done > 2 * CHUNK:
+            raise Cancelled()
+
+    with pytest.raises(Cancelled):
+        download_ranges(server['url'], output, len(CONTENT), connections=1, chunk_size=CHUNK,
+                        progress_callback=cancel)
+    assert not os.path.exists(output)
+    assert os.path.exists(output + ".part")
+
+    # The two finished ranges are not fetched again
+    server['served'] = 0
+    reports = []
+    download_ranges(server['url'], output, len(CONTENT), connections=2, chunk_size=CHUNK,
+                    progress_callback=lambda done, total: reports.append(done))
+    with open(output, 'rb') as handle:
+        assert handle.read() == CONTENT
+    assert server['served'] == len(CONTENT) - 2 * CHUNK
+    assert reports[0] > 2 * CHUNK
+    assert max(reports) == len(CONTENT)
+
+def test_failed_range_is_raised_and_nothing_is_renamed(server, tmp_path):
+    output = str(tmp_path / "video.mp4")
+    server['failing'].add(3 * CHUNK)
+    with pytest.raises(RuntimeError, match=f"Range {3 * CHUNK}-"):
+        download_ranges(server['url'], output, len(CONTENT), connections=3, chunk_size=CHUNK, retries=1)
+    assert not os.path.exists(output)
+
+    # A later call only fetches what is missing
+    server['failing'].clear()
+    download_ranges(server['url'], output, len(CONTENT), connections=3, chunk_size=CHUNK)
+    with open(output, 'rb') as handle:
+        assert handle.read() == CONTENT
+
+def test_missing_ranges():
+    assert _missing_ranges([], 10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert _missing_ranges([(4, 7), (0, 3)], 10, 4) == [(8, 9)]
+    assert _missing_ranges([(2, 5)], 10, 100) == [(0, 1), (6, 9)]
+    assert _missing_ranges([(0, 9)], 10, 4) == []
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_python(code):
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+@pytest.mark.parametrize("module", ["downloader", "cli", "pipeline", "job_server"])
+def test_importing_does_not_load_yt_dlp(module):
+    loaded = run_python(f"import sys, {module}\nprint('yt_dlp' in sys.modules, 'tkinter' in sys.modules)")
+    assert loaded.split() == ["False", "False"]
+
+def test_cli_help_does_not_load_yt_dlp():
+    # runpy leaves the modules loaded while the help was printed behind in sys.modules
+    output = run_python("import runpy, sys\nsys.argv = ['cli.py', '--help']\n"
+                        "try:\n    runpy.run_path('cli.py', run_name='__main__')\nexcept SystemExit:\n    pass\n"
+                        "print('yt_dlp loaded:', 'yt_dlp' in sys.modules)")
+    assert output.startswith("usage:")
+    assert output.rstrip().endswith("yt_dlp loaded: False")
+
+def test_extraction_through_a_provider_does_not_load_yt_dlp():
+    output = run_python(
+        "import sys, downloader\n"
+        "class Provider:\n"
+        "    def extract_info(self, url):\n"
+        "        return {'id': 'a' * 11, 'title': 'A', 'formats': []}\n"
+        "    def playlist_entries(self, url):\n"
+        "        return []\n"
+        "downloader.configure_info_provider(Provider())\n"
+        "print(downloader.get_video_info('a' * 11)['title'], 'yt_dlp' in sys.modules)"
+    )
+    assert output.split() == ["A", "False"]
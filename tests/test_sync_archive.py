@@ -0,0 +1,60 @@
+from sync_archive import SyncArchive, get_playlist_id, settings_key
+
+def entry(video_id):
+    return {'video_id': video_id, 'url': f"https://www.youtube.com/watch?v={video_id}", 'title': video_id.upper()}
+
+def ids(entries):
+    return [entry['video_id'] for entry in entries]
+
+def test_playlist_id():
+    assert get_playlist_id("https://www.youtube.com/playlist?list=PL123&index=2") == "PL123"
+    assert get_playlist_id("https://example.com/feed") == "https://example.com/feed"
+
+def test_settings_key_ignores_speed_only_options():
+    assert settings_key(True, "A", {'engine': "overlay"}) == settings_key(True, "A", {'engine': "overlay", 'workers': 8})
+    assert settings_key(True, "A") != settings_key(True, "B")
+    assert settings_key(False, "A", {'engine': "overlay"}) == settings_key(False, "B")
+
+def test_first_sync_adds_everything(tmp_path):
+    archive = SyncArchive.for_output_dir(str(tmp_path))
+    diff = archive.diff("PL", [entry("a"), entry("b")], "key")
+    assert (ids(diff['added']), diff['changed'], diff['unchanged'], diff['removed']) == (["a", "b"], [], [], [])
+    archive.close()
+
+def test_later_sync_reports_added_changed_unchanged_and_removed(tmp_path):
+    archive = SyncArchive(str(tmp_path / "archive.sqlite3"))
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"video")
+    archive.update_members("PL", [entry("a"), entry("b"), entry("c")])
+    archive.record_delivered("PL", "a", "key", entry("a")['url'], "A", str(output))
+    # b was never delivered (its download failed); c leaves the playlist; d is new
+    diff = archive.diff("PL", [entry("d"), entry("a"), entry("b")], "key")
+    assert ids(diff['added']) == ["d"]
+    assert ids(diff['changed']) == ["b"]
+    assert ids(diff['unchanged']) == ["a"]
+    assert ids(diff['removed']) == ["c"]
+    archive.close()
+
+def test_new_settings_or_deleted_output_make_videos_due_again(tmp_path):
+    archive = SyncArchive(str(tmp_path / "archive.sqlite3"))
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"video")
+    archive.update_members("PL", [entry("a")])
+    archive.record_delivered("PL", "a", "key", entry("a")['url'], "A", str(output))
+
+    assert ids(archive.diff("PL", [entry("a")], "other key")['changed']) == ["a"]
+    output.unlink()
+    assert ids(archive.diff("PL", [entry("a")], "key")['changed']) == ["a"]
+    archive.close()
+
+def test_archive_survives_reopening_and_keeps_playlists_apart(tmp_path):
+    path = str(tmp_path / "archive.sqlite3")
+    archive = SyncArchive(path)
+    archive.update_members("PL1", [entry("a")])
+    archive.record_delivered("PL1", "a", "key", entry("a")['url'])
+    archive.close()
+
+    archive = SyncArchive(path)
+    assert ids(archive.diff("PL1", [entry("a")], "key")['unchanged']) == ["a"]
+    assert ids(archive.diff("PL2", [entry("a")], "key")['added']) == ["a"]
+    archive.close()
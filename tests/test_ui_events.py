@@ -0,0 +1,88 @@
+import threading
+
+from ui_events import UIEventBus
+
+class FakeRoot:
+    """
+    Stands in for the Tk root: keeps the scheduled callbacks instead of running a main loop.
+    """
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append((ms, callback))
+
+    def run_frame(self):
+        _, callback = self.scheduled.pop(0)
+        callback()
+
+def make_bus(fps=20):
+    root = FakeRoot()
+    bus = UIEventBus(root, fps=fps)
+    delivered = []
+    bus.subscribe('progress', delivered.append)
+    bus.subscribe('status', delivered.append)
+    bus.start()
+    return root, bus, delivered
+
+def test_updates_are_coalesced_to_the_latest_per_frame():
+    root, bus, delivered = make_bus()
+    for percent in range(100):
+        bus.post('progress', key=0, value=percent)
+    bus.post('status', text="Downloading")
+    assert delivered == []  # Nothing touches the widgets until the Tk thread drains
+
+    root.run_frame()
+    assert delivered == [{'kind': 'progress', 'key': 0, 'value': 99},
+                         {'kind': 'status', 'key': None, 'text': "Downloading"}]
+
+def test_each_key_keeps_its_own_latest_event_in_order_of_last_post():
+    root, bus, delivered = make_bus()
+    bus.post('progress', key=0, value=10)
+    bus.post('progress', key=1, value=20)
+    bus.post('progress', key=0, value=30)
+    root.run_frame()
+    assert [(event['key'], event['value']) for event in delivered] == [(1, 20), (0, 30)]
+
+def test_posting_from_many_threads():
+    root, bus, delivered = make_bus()
+
+    def worker(key):
+        for value in range(1000):
+            bus.post('progress', key=key, value=value)
+
+    threads = [threading.Thread(target=worker, args=(key,)) for key in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(root.scheduled) == 1  # Posting never schedules Tk work
+
+    root.run_frame()
+    assert sorted((event['key'], event['value']) for event in delivered) == [(key, 999) for key in range(8)]
+
+def test_drain_runs_at_the_frame_rate_until_stopped():
+    root, bus, delivered = make_bus(fps=25)
+    bus.start()  # Already running: no second timer
+    assert [ms for ms, _ in root.scheduled] == [40]
+
+    root.run_frame()
+    assert len(root.scheduled) == 1
+    bus.stop()
+    bus.post('status', text="late")
+    root.run_frame()
+    assert root.scheduled == [] and delivered == []
+
+def test_a_failing_handler_does_not_stop_the_others():
+    root, bus, delivered = make_bus()
+
+    def broken(event):
+        raise RuntimeError("widget destroyed")
+
+    bus.subscribe('status', broken)
+    bus.subscribe('status', delivered.append)
+    bus.post('status', text="Done")
+    root.run_frame()
+    assert [event['text'] for event in delivered] == ["Done", "Done"]
+    assert len(root.scheduled) == 1
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+import watermark
+from watermark import (WATERMARK_ENGINES, build_drawtext_filter, build_overlay_filter, build_watermark_command,
+                       build_watermark_graph, choose_engine, render_watermark_image)
+
+def test_command_overwrites_a_stale_output():
+    # Resumed WATERMARKING jobs re-run ffmpeg over the partial output of the
+    # interrupted run, and ffmpeg's stdin is closed so it cannot prompt
+    command = build_watermark_command("in.mp4", "out.mp4", "LIMITLESS MEDIA")
+    assert command[:2] == ["ffmpeg", "-y"]
+    assert command[-1] == "out.mp4"
+
+def test_separate_audio_is_mapped_from_the_second_input():
+    command = build_watermark_command("video.mp4", "out.mp4", "LIMITLESS MEDIA", audio_file="audio.m4a")
+    assert command[2:6] == ["-i", "video.mp4", "-i", "audio.m4a"]
+    assert command[command.index("-map", command.index("-map") + 1) + 1] == "1:a:0"
+
+def test_metadata_is_copied_unless_given():
+    command = build_watermark_command("in.mp4", "out.mp4", "LIMITLESS MEDIA")
+    assert ["-map_metadata", "0"] == command[command.index("-map_metadata"):command.index("-map_metadata") + 2]
+    tagged = build_watermark_command("in.mp4", "out.mp4", "LIMITLESS MEDIA", metadata_args=["-metadata", "title=x"])
+    assert "-map_metadata" not in tagged
+    assert tagged[-3:] == ["-metadata", "title=x", "out.mp4"]
+
+def test_overlay_command_composites_the_rendered_image(monkeypatch):
+    monkeypatch.setattr(watermark, 'render_watermark_image', lambda text: "wm.png")
+    command = build_watermark_command("video.mp4", "out.mp4", "LIMITLESS MEDIA", audio_file="audio.m4a",
+                                      engine="overlay")
+    # The image is the third input, after the video and audio streams
+    assert command[2:10] == ["-i", "video.mp4", "-i", "audio.m4a", "-loop", "1", "-i", "wm.png"]
+    graph = command[command.index("-filter_complex") + 1]
+    assert graph == f"[0:v:0][2:v]{build_overlay_filter()}[watermarked]"
+    assert "-vf" not in command
+    maps = [command[i + 1] for i, option in enumerate(command) if option == "-map"]
+    assert maps == ["[watermarked]", "1:a:0"]
+
+def test_overlay_moves_along_the_drawtext_path():
+    for time_offset in (0, 12.5):
+        drawtext = build_drawtext_filter("LIMITLESS MEDIA", time_offset, windows=(10, 60))
+        overlay = build_overlay_filter(time_offset, windows=(10, 60))
+        # drawtext names the frame size w and h, overlay W and H
+        position = drawtext[drawtext.index("x="):].replace(",w)", ",W)").replace(",h)", ",H)")
+        assert overlay.replace(":shortest=1", "") == f"overlay={position}"
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        build_watermark_graph("LIMITLESS MEDIA", engine="subtitles")
+
+def test_watermark_image_is_rendered_once_per_appearance(monkeypatch, tmp_path):
+    commands = []
+
+    def run(command, check=False):
+        commands.append(command)
+        with open(command[-1], 'wb') as handle:
+            handle.write(b"png")
+
+    monkeypatch.setattr(watermark.subprocess, 'run', run)
+    image = render_watermark_image("LIMITLESS MEDIA", cache_dir=str(tmp_path))
+    assert render_watermark_image("LIMITLESS MEDIA", cache_dir=str(tmp_path)) == image
+    assert len(commands) == 1
+    assert os.path.dirname(image) == str(tmp_path)
+    # Rendered by drawtext on a transparent canvas, with the same look as the drawtext engine
+    assert "color=c=black@0.0" in commands[0][commands[0].index("-i") + 1]
+    assert "fontcolor=white:fontsize=24" in commands[0][commands[0].index("-vf") + 1]
+
+    others = {render_watermark_image("OTHER TEXT", cache_dir=str(tmp_path)),
+              render_watermark_image("LIMITLESS MEDIA", fontcolor="red", cache_dir=str(tmp_path)),
+              render_watermark_image("LIMITLESS MEDIA", fontsize=32, cache_dir=str(tmp_path))}
+    assert len(others | {image}) == 4
+    assert len(commands) == 4
+    # Only the finished images are left in the cache
+    assert sorted(str(path) for path in tmp_path.iterdir()) == sorted(others | {image})
+
+@pytest.fixture
+def filters(monkeypatch, tmp_path):
+    """
+    Pretends ffmpeg has the given filters and keeps watermark images in tmp_path.
+    """
+    available = {}
+    monkeypatch.setattr(watermark, 'get_capabilities', lambda: {'available': True, 'filters': available})
+    monkeypatch.setattr(watermark, 'has_filter', lambda name: available.get(name, False))
+    monkeypatch.setattr(watermark, 'watermark_image_path', lambda text: str(tmp_path / f"{text}.png"))
+    return available
+
+@pytest.mark.parametrize("engine", WATERMARK_ENGINES)
+def test_engine_is_kept_when_ffmpeg_has_both_filters(filters, engine):
+    filters.update(drawtext=True, overlay=True)
+    assert choose_engine(engine, "LIMITLESS MEDIA") == engine
+
+def test_overlay_falls_back_to_drawtext(filters):
+    filters.update(drawtext=True, overlay=False)
+    assert choose_engine("overlay", "LIMITLESS MEDIA") == "drawtext"
+
+def test_without_drawtext_only_a_rendered_image_can_be_used(filters, tmp_path):
+    filters.update(drawtext=False, overlay=True)
+    with pytest.raises(RuntimeError):
+        choose_engine("drawtext", "LIMITLESS MEDIA")
+    with pytest.raises(RuntimeError):
+        choose_engine("overlay", "LIMITLESS MEDIA")
+    (tmp_path / "LIMITLESS MEDIA.png").write_bytes(b"png")
+    assert choose_engine("drawtext", "LIMITLESS MEDIA") == "overlay"
+    assert choose_engine("overlay", "LIMITLESS MEDIA") == "overlay"
+
+def test_engine_is_kept_when_ffmpeg_is_missing(monkeypatch):
+    monkeypatch.setattr(watermark, 'get_capabilities', lambda: {'available': False, 'filters': {}})
+    assert choose_engine("drawtext", "LIMITLESS MEDIA") == "drawtext"
+    with pytest.raises(ValueError):
+        choose_engine("subtitles", "LIMITLESS MEDIA")
+
+def test_missing_drawtext_fails_before_encoding(filters, monkeypatch):
+    def run_ffmpeg(*args, **kwargs):
+        raise AssertionError("ffmpeg was started")
+
+    monkeypatch.setattr(watermark, 'run_ffmpeg', run_ffmpeg)
+    with pytest.raises(RuntimeError, match="drawtext"):
+        watermark.add_moving_watermark("in.mp4", "out.mp4", "LIMITLESS MEDIA")
@@ -0,0 +1,69 @@
+import pytest
+
+import watermark
+from encode_scheduler import EncodeScheduler
+from watermark import build_drawtext_filter, plan_segments
+
+KEYFRAMES = [0.0, 2.5, 4.8, 7.0, 9.9, 13.0, 15.2, 18.0]
+
+def test_segments_start_on_the_keyframe_nearest_each_even_split():
+    assert plan_segments(KEYFRAMES, 20.0, 4) == [(0.0, 4.8), (4.8, 9.9), (9.9, 15.2), (15.2, 20.0)]
+
+def test_fewer_keyframes_than_segments_gives_fewer_pieces():
+    assert plan_segments([0.0, 9.0], 20.0, 4) == [(0.0, 9.0), (9.0, 20.0)]
+    assert plan_segments([], 20.0, 4) == [(0.0, 20.0)]
+    assert plan_segments(KEYFRAMES, 20.0, 1) == [(0.0, 20.0)]
+
+def test_pieces_cover_the_video_without_gaps():
+    pieces = plan_segments(KEYFRAMES, 20.0, 6)
+    assert pieces[0][0] == 0.0 and pieces[-1][1] == 20.0
+    assert all(end == next_start for (_, end), (next_start, _) in zip(pieces, pieces[1:]))
+
+def test_segment_watermark_moves_by_the_time_in_the_whole_video():
+    # A frame 1 s into the piece starting at 4.8 s is drawn where the frame at 5.8 s of a single pass is
+    assert "x='mod((t+4.800000)*0.5,w)':y='mod((t+4.800000)*0.2,h)'" in build_drawtext_filter("WM", 4.8)
+    assert "x='mod(t*0.5,w)':y='mod(t*0.2,h)'" in build_drawtext_filter("WM")
+
+def test_segment_is_cut_and_watermarked_at_its_offset(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(watermark, 'run_ffmpeg', lambda command, **options: commands.append(command))
+    scheduler = EncodeScheduler(cpu_budget=4, slot_dir=str(tmp_path))
+    watermark._encode_segment("in.mp4", "segment.mkv", 4.8, 9.9, "WM", ["-c:v", "libx264"], "drawtext",
+                              scheduler=scheduler, threads=2)
+
+    [command] = commands
+    assert command[command.index("-ss") + 1] == "4.800000"
+    assert command[command.index("-t") + 1] == "5.100000"
+    assert build_drawtext_filter("WM", 4.8) == command[command.index("-vf") + 1]
+    assert command[command.index("-threads") + 1] == "2"
+
+@pytest.fixture
+def segmented(monkeypatch):
+    """
+    Replaces probing and the piece renderer; returns the renderer's calls.
+    """
+    calls = []
+    monkeypatch.setattr(watermark, 'get_capabilities', lambda: {'available': False, 'filters': {}})
+    monkeypatch.setattr(watermark, 'probe_duration', lambda input_file: 20.0)
+    monkeypatch.setattr(watermark, 'probe_keyframes', lambda input_file: KEYFRAMES)
+
+    def render_pieces(input_file, output_file, pieces, watermark_text, encode_options, engine,
+                      audio_file, metadata_args, workers, **options):
+        calls.append({'pieces': pieces, 'workers': workers, 'audio_file': audio_file, **options})
+
+    monkeypatch.setattr(watermark, '_render_pieces', render_pieces)
+    return calls
+
+def test_segmented_encode_splits_at_keyframes(segmented, tmp_path):
+    scheduler = EncodeScheduler(cpu_budget=8, slot_dir=str(tmp_path))
+    watermark.add_moving_watermark("in.mp4", "out.mp4", "WM", audio_file="audio.m4a", segments=4, workers=2,
+                                   threads_per_worker=3, scheduler=scheduler)
+    [call] = segmented
+    assert call['pieces'] == [(start, end, True) for start, end in plan_segments(KEYFRAMES, 20.0, 4)]
+    assert (call['workers'], call['threads_per_worker'], call['audio_file']) == (2, 3, "audio.m4a")
+
+def test_segmented_encode_shares_the_cpu_budget_by_default(segmented, tmp_path):
+    watermark.add_moving_watermark("in.mp4", "out.mp4", "WM", segments=4,
+                                   scheduler=EncodeScheduler(cpu_budget=8, slot_dir=str(tmp_path)))
+    [call] = segmented
+    assert (call['workers'], call['threads_per_worker']) == (4, 2)
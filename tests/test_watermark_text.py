@@ -0,0 +1,71 @@
+import pytest
+
+from watermark import build_drawtext_filter, escape_drawtext_text
+
+def get_token(buf, term):
+    """
+    Python version of libavutil's av_get_token: reads up to an unescaped,
+    unquoted character of `term`, removing quotes and backslash escapes.
+    """
+    token = []
+    i = 0
+    while i < len(buf) and buf[i] not in term:
+        char = buf[i]
+        i += 1
+        if char == "\\" and i < len(buf):
+            token.append(buf[i])
+            i += 1
+        elif char == "'":
+            while i < len(buf) and buf[i] != "'":
+                token.append(buf[i])
+                i += 1
+            i += 1
+        else:
+            token.append(char)
+    return "".join(token), buf[i:]
+
+def expand_text(text):
+    # drawtext's own pass: a backslash takes the next character literally
+    out = []
+    i = 0
+    while i < len(text):
+        if text[i] == "\\" and i + 1 < len(text):
+            i += 1
+        elif text[i] == "%":
+            raise AssertionError("unescaped % would start an expansion")
+        out.append(text[i])
+        i += 1
+    return "".join(out)
+
+def parse_drawtext(graph):
+    """
+    Returns the drawtext options ffmpeg would see for a one-filter graph.
+    """
+    name, rest = graph.split("=", 1)
+    assert name == "drawtext"
+    args, rest = get_token(rest, "[],;")
+    assert rest == "", "text leaked into the filtergraph"
+    options = {}
+    while args:
+        key, args = args.split("=", 1)
+        options[key], args = get_token(args, ":")
+        args = args[1:]
+    return options
+
+@pytest.mark.parametrize("text", [
+    "LIMITLESS MEDIA",
+    "Don't copy",
+    "a:fontsize=400",
+    "one, two; three",
+    "[out]",
+    "50% off",
+    "back\\slash",
+    "it's 'quoted', [tagged]: 100%\\",
+])
+def test_text_is_drawn_as_typed(text):
+    options = parse_drawtext(build_drawtext_filter(text, windows=(10, 60)))
+    assert set(options) == {'text', 'font', 'fontcolor', 'fontsize', 'x', 'y', 'enable'}
+    assert expand_text(options['text']) == text
+
+def test_plain_text_is_unchanged():
+    assert escape_drawtext_text("LIMITLESS MEDIA") == "LIMITLESS MEDIA"
@@ -0,0 +1,110 @@
+import pytest
+
+import watermark
+from watermark import build_smart_render_options, pieces_match, plan_watermark_windows, validate_windows
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0, 14.0, 16.0, 18.0]
+
+def test_windows_are_widened_to_keyframes_and_cover_the_video():
+    pieces = plan_watermark_windows(KEYFRAMES, 20.0, 3, 10)
+    assert pieces == [
+        (0.0, 4.0, True),
+        (4.0, 10.0, False),
+        (10.0, 14.0, True),
+        (14.0, 20.0, False),
+    ]
+
+def test_touching_windows_are_merged():
+    pieces = plan_watermark_windows(KEYFRAMES, 20.0, 5, 5)
+    assert pieces == [(0.0, 20.0, True)]
+
+@pytest.mark.parametrize("windows", [(10, 0), (10, -5), (0, 60), (-1, 60), (61, 60), ("a", 60), (10,), None])
+def test_invalid_windows_are_rejected(windows):
+    with pytest.raises(ValueError):
+        validate_windows(windows)
+
+def test_non_positive_period_does_not_hang():
+    with pytest.raises(ValueError):
+        plan_watermark_windows(KEYFRAMES, 20.0, 10, 0)
+
+def test_valid_windows_are_returned_as_floats():
+    assert validate_windows([10, 60]) == (10.0, 60.0)
+
+H264_SOURCE = {'codec_name': "h264", 'profile': "High", 'level': 40, 'pix_fmt': "yuv420p", 'width': 1920,
+               'height': 1080}
+
+def test_reencoded_pieces_match_an_h264_source():
+    options = build_smart_render_options(H264_SOURCE)
+    assert options[:2] == ["-c:v", "libx264"]
+    assert options[-6:] == ["-pix_fmt", "yuv420p", "-profile:v", "high", "-level:v", "4.0"]
+    ten_bit = build_smart_render_options({**H264_SOURCE, 'profile': "High 10", 'level': 51,
+                                          'pix_fmt': "yuv420p10le"})
+    assert ten_bit[-6:] == ["-pix_fmt", "yuv420p10le", "-profile:v", "high10", "-level:v", "5.1"]
+
+def test_reencoded_pieces_match_a_vp9_source():
+    options = build_smart_render_options({'codec_name': "vp9", 'profile': "Profile 2", 'level': -99,
+                                          'pix_fmt': "yuv420p10le"})
+    assert options[:2] == ["-c:v", "libvpx-vp9"]
+    assert options[-4:] == ["-pix_fmt", "yuv420p10le", "-profile:v", "2"]
+
+def test_other_sources_cannot_be_smart_rendered():
+    with pytest.raises(ValueError):
+        build_smart_render_options({'codec_name': "av1", 'pix_fmt': "yuv420p"})
+
+def test_pieces_match_on_every_stream_parameter():
+    assert pieces_match([H264_SOURCE, dict(H264_SOURCE)])
+    for name, value in (('profile', "Main"), ('level', 41), ('pix_fmt', "yuvj420p"), ('height', 1088)):
+        assert not pieces_match([H264_SOURCE, {**H264_SOURCE, name: value}])
+
+@pytest.fixture
+def fake_render(monkeypatch):
+    """
+    Replaces ffmpeg: segment files hold "encoded" or "copied", and the
+    re-encoded ones probe with the given stream parameters.
+    """
+    calls = {'encoded': [], 'copied': [], 'joined': None, 'encoded_stream': dict(H264_SOURCE)}
+
+    def read(path):
+        with open(path) as handle:
+            return handle.read()
+
+    def encode_segment(input_file, segment_file, start, end, *args):
+        calls['encoded'].append(start)
+        with open(segment_file, 'w') as handle:
+            handle.write("encoded")
+
+    def copy_segment(input_file, segment_file, start, end):
+        calls['copied'].append(start)
+        with open(segment_file, 'w') as handle:
+            handle.write("copied")
+
+    def probe(segment_file):
+        return calls['encoded_stream'] if read(segment_file) == "encoded" else H264_SOURCE
+
+    def run(command, check=False):
+        # The concat list is the first input
+        list_file = command[command.index("-i") + 1]
+        calls['joined'] = [read(line.split("'")[1]) for line in read(list_file).splitlines()]
+
+    monkeypatch.setattr(watermark, '_encode_segment', encode_segment)
+    monkeypatch.setattr(watermark, '_copy_segment', copy_segment)
+    monkeypatch.setattr(watermark, 'probe_video_stream', probe)
+    monkeypatch.setattr(watermark.subprocess, 'run', run)
+    return calls
+
+PIECES = [(0.0, 4.0, True), (4.0, 10.0, False), (10.0, 14.0, True), (14.0, 20.0, False)]
+
+def render(tmp_path):
+    watermark._render_pieces("in.mp4", str(tmp_path / "out.mp4"), PIECES, "LIMITLESS MEDIA", [], "drawtext",
+                             None, None, 2, windows=(3, 10), segment_ext=".ts")
+
+def test_matching_pieces_are_joined_as_they_are(fake_render, tmp_path):
+    render(tmp_path)
+    assert sorted(fake_render['encoded']) == [0.0, 10.0]
+    assert fake_render['joined'] == ["encoded", "copied", "encoded", "copied"]
+
+def test_mismatched_copied_pieces_are_reencoded_before_joining(fake_render, tmp_path):
+    fake_render['encoded_stream'] = {**H264_SOURCE, 'level': 41}
+    render(tmp_path)
+    assert sorted(fake_render['encoded']) == [0.0, 4.0, 10.0, 14.0]
+    assert fake_render['joined'] == ["encoded"] * 4
@@ -0,0 +1,74 @@
+import queue
+
+UI_REFRESH_FPS = 20  # How often queued updates are applied to the widgets
+
+class UIEventBus:
+    """
+    Carries status and progress updates from worker threads to the Tk thread.
+
+    Workers call `post`, which only puts the event on a queue and never
+    touches Tk, so a download thread can report as often as it likes without
+    waiting for the GUI. The Tk thread drains the queue on an `after()` timer
+    and hands each handler only the latest event per (kind, key), so hundreds
+    of progress hooks per second become one redraw per frame.
+    """
+
+    def __init__(self, root, fps=UI_REFRESH_FPS):
+        self.root = root
+        self.interval_ms = max(1, int(1000 / fps))
+        self._queue = queue.SimpleQueue()
+        self._handlers = {}
+        self._running = False
+
+    def subscribe(self, kind, handler):
+        """
+        Registers a handler, called on the Tk thread with each coalesced event of a kind.
+
+        Args:
+            kind (str): Event kind, e.g. 'status' or 'progress'
+            handler (function): Called with the event dict
+        """
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def post(self, kind, key=None, **values):
+        """
+        Queues an event. Safe to call from any thread.
+
+        Args:
+            kind (str): Event kind
+            key (optional): What the event is about, e.g. a video index. Only
+                the latest event for each (kind, key) is delivered per frame.
+            **values: Event data
+        """
+        self._queue.put({'kind': kind, 'key': key, **values})
+
+    def start(self):
+        """
+        Starts draining the queue. Must be called on the Tk thread.
+        """
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        self._running = False
+
+    def _drain(self):
+        if not self._running:
+            return
+        latest = {}  # Re-inserted on every update, so events are applied in the order of their last post
+        try:
+            while True:
+                event = self._queue.get_nowait()
+                latest.pop((event['kind'], event['key']), None)
+                latest[(event['kind'], event['key'])] = event
+        except queue.Empty:
+            pass
+
+        for event in latest.values():
+            for handler in self._handlers.get(event['kind'], ()):
+                try:
+                    handler(event)
+                except Exception as e:
+                    print(f"UI update for {event['kind']} failed: {e}")
+        self.root.after(self.interval_ms, self._drain)
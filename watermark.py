@@ -1,48 +1,808 @@
+import os
+import bisect
+import hashlib
+import shutil
 import subprocess
+import tempfile
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from encode_scheduler import get_encode_scheduler
+from encoder_policy import DEFAULT_PROFILE, build_encoder_args, choose_encoder
+from ffmpeg_caps import get_capabilities, has_filter
 
-def add_moving_watermark(input_file, output_file, watermark_text, video_codec="libx264", video_bitrate=None):
+# Watermark appearance shared by both engines
+WATERMARK_FONT = "Verdana"
+WATERMARK_FONT_SIZE = 24
+WATERMARK_FONT_COLOR = "white"
+
+# Rendered watermark images, one per text/font/size/colour
+WATERMARK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ytdownloadwithwm", "watermarks")
+
+# Engines: "drawtext" rasterises the text on every frame, "overlay" composites
+# an image rendered once
+WATERMARK_ENGINES = ("drawtext", "overlay")
+
+def _time_expression(time_offset):
+    return f"(t+{time_offset:.6f})" if time_offset else "t"
+
+def _enable_option(windows, time_offset):
+    if not windows:
+        return ""
+    window, period = windows
+    return f":enable='lt(mod({_time_expression(time_offset)},{period}),{window})'"
+
+def _backslash_escape(value, special):
+    return "".join(f"\\{char}" if char in special else char for char in value)
+
+def escape_drawtext_text(watermark_text):
     """
-    Adds a moving watermark to the input video using FFmpeg and saves it to the output file.
-    
+    Escapes text for the `text` option of a drawtext filter in a filtergraph.
+
+    The text goes through three parsers, each with its own special characters:
+    drawtext's own expansion (backslash and %), the filter's option list
+    (quotes and the `:` separator) and the filtergraph (`,` and `;` between
+    filters, `[` and `]` around link labels). Escaping every level lets any
+    text, apostrophes included, be drawn as typed instead of ending the option
+    or adding options and filters of its own.
+    """
+    text = _backslash_escape(watermark_text, "\\%")
+    text = _backslash_escape(text, "\\':")
+    return _backslash_escape(text, "\\',;[]")
+
+def build_drawtext_filter(watermark_text, time_offset=0, windows=None):
+    """
+    Returns the drawtext filter that moves the watermark across the frame.
+
     Args:
-        input_file (str): Path to the input video file
-        output_file (str): Path where the watermarked video will be saved
         watermark_text (str): Text to be used as watermark
-        video_codec (str): Video codec to use for encoding (default: "libx264")
-        video_bitrate (int, optional): Video bitrate in kbps. If None, uses CRF mode
-    
+        time_offset (float): Seconds to add to each frame's timestamp. Used when
+            encoding a piece of a video, so the watermark is positioned by the
+            frame's time in the whole video rather than in the piece
+        windows (tuple, optional): (window, period) in seconds; the watermark
+            is only shown for the first `window` seconds of every `period`
+    """
+    t = _time_expression(time_offset)
+    return (f"drawtext=text={escape_drawtext_text(watermark_text)}:font={WATERMARK_FONT}:fontcolor={WATERMARK_FONT_COLOR}:fontsize={WATERMARK_FONT_SIZE}:"
+            f"x='mod({t}*0.5,w)':y='mod({t}*0.2,h)'{_enable_option(windows, time_offset)}")
+
+def build_overlay_filter(time_offset=0, windows=None):
+    """
+    Returns the overlay filter moving a watermark image along the same path as
+    `build_drawtext_filter` (W and H are the video's width and height).
+    """
+    t = _time_expression(time_offset)
+    return f"overlay=x='mod({t}*0.5,W)':y='mod({t}*0.2,H)':shortest=1{_enable_option(windows, time_offset)}"
+
+def watermark_image_path(watermark_text, font=WATERMARK_FONT, fontsize=WATERMARK_FONT_SIZE,
+                         fontcolor=WATERMARK_FONT_COLOR, cache_dir=WATERMARK_CACHE_DIR):
+    """
+    Returns where `render_watermark_image` caches the image for a text.
+    """
+    key = hashlib.sha1(f"{watermark_text}\0{font}\0{fontsize}\0{fontcolor}".encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}.png")
+
+def render_watermark_image(watermark_text, font=WATERMARK_FONT, fontsize=WATERMARK_FONT_SIZE,
+                           fontcolor=WATERMARK_FONT_COLOR, cache_dir=WATERMARK_CACHE_DIR):
+    """
+    Renders the watermark text once to a transparent PNG.
+
+    The image is drawn by the same drawtext filter at the top-left corner of a
+    transparent canvas, so compositing it looks like drawing the text directly.
+    Images are cached by text, font, size and colour.
+
+    Returns:
+        str: Path to the PNG
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg cannot render the text
+    """
+    image_path = watermark_image_path(watermark_text, font, fontsize, fontcolor, cache_dir)
+    if os.path.exists(image_path):
+        return image_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Generous canvas; the transparent margin does not change the composite
+    width = fontsize * (len(watermark_text) + 2)
+    height = fontsize * 2
+    tmp_path = f"{os.path.splitext(image_path)[0]}.{os.getpid()}.tmp.png"
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"color=c=black@0.0:s={width}x{height}:d=1,format=rgba",
+        "-vf", f"drawtext=text={escape_drawtext_text(watermark_text)}:font={font}:fontcolor={fontcolor}:fontsize={fontsize}:x=0:y=0",
+        "-frames:v", "1",
+        tmp_path
+    ]
+    subprocess.run(command, check=True)
+    os.replace(tmp_path, image_path)
+    return image_path
+
+def choose_engine(engine, watermark_text):
+    """
+    Returns the engine to watermark with, given the filters the installed
+    ffmpeg was built with.
+
+    An engine whose filter is missing falls back to the other one. The
+    overlay image is itself drawn with drawtext, so without drawtext (ffmpeg
+    built without libfreetype) only an image rendered on an earlier run can
+    be used.
+
     Raises:
-        RuntimeError: If FFmpeg fails to add the watermark
+        ValueError: If the engine is unknown
+        RuntimeError: If neither engine can draw this text, before anything is encoded
     """
+    if engine not in WATERMARK_ENGINES:
+        raise ValueError(f"Unknown watermark engine: {engine}")
+    if not get_capabilities()['available']:
+        return engine  # Running ffmpeg reports that it is missing
+    drawtext, overlay = has_filter("drawtext"), has_filter("overlay")
+    if engine == "drawtext" and drawtext:
+        return engine
+    if engine == "overlay" and not overlay and drawtext:
+        print("ffmpeg has no overlay filter; watermarking with drawtext instead")
+        return "drawtext"
+    if overlay and (drawtext or os.path.exists(watermark_image_path(watermark_text))):
+        if engine != "overlay":
+            print("ffmpeg has no drawtext filter; using the watermark image rendered earlier")
+        return "overlay"
+    raise RuntimeError("ffmpeg was built without the drawtext filter (libfreetype), so the watermark text "
+                       "cannot be drawn")
+
+def build_watermark_graph(watermark_text, engine="drawtext", time_offset=0, image_input_index=1, windows=None):
+    """
+    Returns the ffmpeg options that watermark input 0's first video stream.
+
+    Args:
+        watermark_text (str): Text to be used as watermark
+        engine (str): "drawtext" or "overlay"
+        time_offset (float): See `build_drawtext_filter`
+        image_input_index (int): Input index the overlay image will get
+        windows (tuple, optional): See `build_drawtext_filter`
+
+    Returns:
+        tuple: (extra input options, filter options, video -map value)
+    """
+    if engine == "overlay":
+        image_path = render_watermark_image(watermark_text)
+        return (
+            ["-loop", "1", "-i", image_path],
+            ["-filter_complex", f"[0:v:0][{image_input_index}:v]{build_overlay_filter(time_offset, windows)}[watermarked]"],
+            "[watermarked]"
+        )
+    if engine != "drawtext":
+        raise ValueError(f"Unknown watermark engine: {engine}")
+    return [], ["-vf", build_drawtext_filter(watermark_text, time_offset, windows)], "0:v:0"
+
+def build_video_encode_options(video_codec="libx264", video_bitrate=None, source_codec=None,
+                               encoder_profile=DEFAULT_PROFILE, threads=None):
+    """
+    Returns the ffmpeg video encoding options used for watermarked output.
+
+    Args:
+        video_codec (str): Encoder picked by `select_video_codec`
+        video_bitrate (int, optional): Video bitrate in kbps. If None, quality-based rate control is used
+        source_codec (str, optional): Codec of the video being watermarked
+        encoder_profile (str): "fast", "balanced" or "archival"
+        threads (int, optional): Encoder threads
+    """
+    encoder = choose_encoder(video_codec, source_codec, encoder_profile)
+    return build_encoder_args(encoder, encoder_profile, video_bitrate, threads)
+
+def probe_duration(input_file):
+    """
+    Returns the duration of a media file in seconds.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", input_file],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    return float(result.stdout.decode('utf-8').strip())
+
+# Stream parameters copied and re-encoded pieces must share to be joined with -c copy
+SMART_RENDER_PARAMETERS = ("codec_name", "profile", "level", "pix_fmt", "width", "height")
+
+def probe_video_stream(input_file):
+    """
+    Returns the codec name, profile, level, pixel format and size of the first video stream.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=" + ",".join(SMART_RENDER_PARAMETERS), "-of", "json", input_file],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    streams = json.loads(result.stdout.decode('utf-8')).get('streams', [])
+    return streams[0] if streams else {}
+
+def probe_keyframes(input_file):
+    """
+    Returns the timestamps (seconds from the start of the video) of the video's keyframes.
+
+    Reads packet flags only, so nothing is decoded.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=start_time:packet=pts_time,flags", "-of", "csv=p=0", input_file],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    start_time = 0.0
+    keyframes = []
+    for line in result.stdout.decode('utf-8').splitlines():
+        parts = line.strip().split(",")
+        if len(parts) == 1 and parts[0] not in ("", "N/A"):
+            start_time = float(parts[0])  # The stream's start_time row
+        elif len(parts) >= 2 and parts[0] not in ("", "N/A") and "K" in parts[1]:
+            keyframes.append(float(parts[0]))
+    return sorted(t - start_time for t in keyframes)
+
+def _parse_speed(value):
+    # ffmpeg reports speed like "1.53x", or "N/A" before the first frame
+    try:
+        return float(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return 0.0
+
+def parse_progress_block(fields, value, duration=None):
+    """
+    Turns one block of ffmpeg `-progress` key=value pairs into a progress
+    event (see `run_ffmpeg`). `value` is "continue" or "end", from the
+    "progress=" line that closes the block.
+    """
+    try:
+        out_time = int(fields.get("out_time_us", "0")) / 1_000_000
+    except ValueError:
+        out_time = 0.0
+    speed = _parse_speed(fields.get("speed"))
+    percent = None
+    eta = None
+    if duration:
+        percent = 100.0 if value == "end" else min(100.0, out_time / duration * 100)
+        if speed > 0:
+            eta = max(0.0, (duration - out_time) / speed)
+    try:
+        frame = int(fields.get("frame", "0"))
+        fps = float(fields.get("fps", "0"))
+    except ValueError:
+        frame, fps = 0, 0.0
+    return {
+        'percent': percent,
+        'out_time': out_time,
+        'frame': frame,
+        'fps': fps,
+        'speed': speed,
+        'eta': eta,
+    }
+
+def _start_ffmpeg(command, allocation=None, **options):
+    process = subprocess.Popen(command, **options)
+    if allocation:
+        allocation.apply_to(process.pid)
+    return process
+
+def run_ffmpeg(command, duration=None, progress_callback=None, allocation=None):
+    """
+    Runs an ffmpeg command, reporting its progress while it encodes.
+
+    ffmpeg's machine-readable `-progress` output is read line by line from
+    stdout. stderr is drained on a separate thread into a short ring buffer,
+    so a chatty ffmpeg can never fill the pipe and stall, and the last lines
+    are still available for the error message.
+
+    Args:
+        command (list): ffmpeg command, starting with the ffmpeg binary
+        duration (float, optional): Seconds of output expected, for percent and ETA
+        progress_callback (function, optional): Called with a dict:
+            - percent (float): 0-100, or None without a duration
+            - out_time (float): Seconds of output written
+            - frame (int): Frames written
+            - fps (float): Encode frames per second
+            - speed (float): Seconds of video encoded per second of wall time
+            - eta (float): Estimated seconds left, or None
+        allocation (CpuAllocation, optional): CPU slots the encode holds; its
+            pinning and niceness are applied to the ffmpeg process
+
+    If progress_callback raises, ffmpeg is killed and the exception propagates,
+    which is how a running encode is cancelled.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg exits with an error
+    """
+    if not progress_callback:
+        process = _start_ffmpeg(command, allocation)
+        try:
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        return
+
+    command = [command[0], "-progress", "pipe:1", "-nostats", *command[1:]]
+    process = _start_ffmpeg(command, allocation, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            stdin=subprocess.DEVNULL, text=True, errors='replace')
+
+    stderr_tail = deque(maxlen=50)
+    def drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line)
+    stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    fields = {}
     try:
-        # Determine the codec based on input format
-        # Use VP9 for WebM/VP9 inputs, H.264 for others
-        reencode_codec = "libvpx-vp9" if video_codec.lower().startswith("vp") else "libx264"
-        
-        # Set quality control: either bitrate or CRF (Constant Rate Factor)
-        bitrate_option = ["-b:v", f"{video_bitrate}k"] if video_bitrate else ["-crf", "22"]
-
-        # Build FFmpeg command with optimized settings
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key != "progress":
+                fields[key] = value
+                continue
+
+            # A "progress=continue/end" line closes each block of key=value pairs
+            progress_callback(parse_progress_block(fields, value, duration))
+            fields = {}
+    except BaseException:
+        # The callback raised (e.g. the job was cancelled): stop ffmpeg rather than leave it running
+        process.kill()
+        process.wait()
+        raise
+
+    returncode = process.wait()
+    stderr_thread.join(timeout=5)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr="".join(stderr_tail))
+
+class _PiecesProgress:
+    """
+    Combines the progress of pieces encoded in parallel into one report.
+    """
+
+    def __init__(self, pieces, progress_callback):
+        self.durations = [end - start for start, end, _ in pieces]
+        self.total = sum(self.durations) or 1.0
+        self.done = [0.0] * len(pieces)
+        self.fps = [0.0] * len(pieces)
+        self.started = time.monotonic()
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+
+    def piece_callback(self, index):
+        if not self.progress_callback:
+            return None
+        def callback(event):
+            self.update(index, min(event['out_time'], self.durations[index]), event['fps'])
+        return callback
+
+    def finish(self, index):
+        self.update(index, self.durations[index], 0.0)
+
+    def update(self, index, out_time, fps):
+        if not self.progress_callback:
+            return
+        with self.lock:
+            self.done[index] = out_time
+            self.fps[index] = fps
+            done = sum(self.done)
+            elapsed = time.monotonic() - self.started
+            speed = done / elapsed if elapsed > 0 else 0.0
+            event = {
+                'percent': min(100.0, done / self.total * 100),
+                'out_time': done,
+                'frame': None,
+                'fps': sum(self.fps),
+                'speed': speed,
+                'eta': (self.total - done) / speed if speed > 0 else None,
+            }
+        self.progress_callback(event)
+
+def plan_segments(keyframes, duration, segments):
+    """
+    Splits a video into roughly equal pieces that each start on a keyframe.
+
+    Args:
+        keyframes (list): Keyframe timestamps from `probe_keyframes`
+        duration (float): Video duration in seconds
+        segments (int): Number of pieces wanted
+
+    Returns:
+        list: (start, end) tuples in seconds covering the whole video
+    """
+    boundaries = [0.0]
+    for i in range(1, segments):
+        target = duration * i / segments
+        # Use the keyframe closest to the even split point
+        candidates = [k for k in keyframes if boundaries[-1] < k < duration]
+        if not candidates:
+            break
+        boundary = min(candidates, key=lambda k: abs(k - target))
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def validate_windows(windows):
+    """
+    Checks a (window, period) pair for the windowed watermark mode.
+
+    Returns:
+        tuple: (window, period) as floats
+
+    Raises:
+        ValueError: Unless 0 < window <= period
+    """
+    try:
+        window, period = (float(value) for value in windows)
+    except (TypeError, ValueError):
+        raise ValueError(f"Watermark windows must be a (window, period) pair of numbers, got {windows!r}")
+    if not 0 < window <= period:
+        raise ValueError(f"Watermark windows need 0 < window <= period, got window={window}, period={period}")
+    return window, period
+
+def plan_watermark_windows(keyframes, duration, window, period):
+    """
+    Splits a video into pieces that need the watermark and pieces that do not.
+
+    Every `period` seconds the watermark is shown for `window` seconds. Each
+    window is widened to the keyframes around it, so the pieces in between
+    start on keyframes and can be copied without re-encoding.
+
+    Args:
+        keyframes (list): Keyframe timestamps from `probe_keyframes`
+        duration (float): Video duration in seconds
+        window (float): Seconds the watermark is shown
+        period (float): Seconds between the start of two windows
+
+    Returns:
+        list: (start, end, reencode) tuples in seconds covering the whole video
+
+    Raises:
+        ValueError: Unless 0 < window <= period
+    """
+    window, period = validate_windows((window, period))
+    keyframes = sorted(set([0.0] + [k for k in keyframes if 0 <= k < duration]))
+    spans = []
+    window_start = 0.0
+    while window_start < duration:
+        window_end = min(window_start + window, duration)
+        # Widen to the GOPs the window touches
+        span_start = keyframes[bisect.bisect_right(keyframes, window_start) - 1]
+        next_index = bisect.bisect_left(keyframes, window_end)
+        span_end = keyframes[next_index] if next_index < len(keyframes) else duration
+        if spans and span_start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], span_end)
+        else:
+            spans.append([span_start, span_end])
+        window_start += period
+
+    pieces = []
+    position = 0.0
+    for span_start, span_end in spans:
+        if span_start > position:
+            pieces.append((position, span_start, False))
+        pieces.append((span_start, span_end, True))
+        position = span_end
+    if position < duration:
+        pieces.append((position, duration, False))
+    return pieces
+
+def _encode_segment(input_file, segment_file, start, end, watermark_text, encode_options, engine, windows=None,
+                    progress_callback=None, scheduler=None, threads=None):
+    # Keep the watermark where a single pass would have put it
+    image_inputs, filter_options, video_map = build_watermark_graph(watermark_text, engine, time_offset=start, windows=windows)
+    # Waits for CPU slots when other encodes are using the budget
+    with (scheduler or get_encode_scheduler()).allocate(threads) as allocation:
         command = [
-            "ffmpeg", 
+            "ffmpeg", "-y", "-v", "error",
+            "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}",
             "-i", input_file,
-            # Watermark filter with moving text
-            "-vf", f"drawtext=text='{watermark_text}':font=Verdana:fontcolor=white:fontsize=24:"
-                  f"x='mod(t*0.5,w)':y='mod(t*0.2,h)'",
-            # Video encoding settings
-            "-c:v", reencode_codec,
-            *bitrate_option,
-            "-g", "60",              # Keyframe interval (1 sec at 60 FPS)
-            "-bufsize", "10M",       # Buffer size for rate control
-            "-maxrate", f"{video_bitrate}k" if video_bitrate else "1M",
-            "-c:a", "copy",          # Copy audio stream without re-encoding
-            "-map_metadata", "0",    # Copy global metadata
-            "-map_chapters", "0",    # Copy chapters
-            output_file
+            *image_inputs,
+            *filter_options,
+            "-map", video_map, "-an",
+            *encode_options,
+            "-threads", str(allocation.threads),
+            segment_file
         ]
+        run_ffmpeg(command, duration=end - start, progress_callback=progress_callback, allocation=allocation)
+
+def _copy_segment(input_file, segment_file, start, end):
+    command = [
+        "ffmpeg", "-y", "-v", "error",
+        "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}",
+        "-i", input_file,
+        "-map", "0:v:0", "-an",
+        "-c:v", "copy",
+        segment_file
+    ]
+    subprocess.run(command, check=True)
 
-        # Execute FFmpeg command
+def pieces_match(streams):
+    """
+    Returns True if the pieces' video streams (from `probe_video_stream`)
+    agree on every SMART_RENDER_PARAMETERS value, so their bitstreams can be
+    joined without re-encoding.
+    """
+    return all(
+        all(stream.get(name) == streams[0].get(name) for name in SMART_RENDER_PARAMETERS) for stream in streams
+    )
+
+def _render_pieces(input_file, output_file, pieces, watermark_text, encode_options, engine,
+                   audio_file, metadata_args, workers, windows=None, segment_ext=".mkv", progress_callback=None,
+                   scheduler=None, threads_per_worker=None):
+    """
+    Encodes or copies each (start, end, reencode) piece of the video in
+    parallel, joins them with the concat demuxer and muxes the audio back in.
+
+    When copied and re-encoded pieces are mixed, their stream parameters are
+    compared first (`pieces_match`); if they differ, the copied pieces are
+    re-encoded too rather than joining an inconsistent stream.
+    """
+    progress = _PiecesProgress(pieces, progress_callback)
+
+    def render(index, segment_file, start, end, reencode):
+        if reencode:
+            _encode_segment(input_file, segment_file, start, end, watermark_text, encode_options, engine,
+                            windows, progress.piece_callback(index), scheduler, threads_per_worker)
+        else:
+            _copy_segment(input_file, segment_file, start, end)
+        progress.finish(index)
+
+    def render_all(work):
+        # Each worker drives its own ffmpeg process
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render, *item) for item in work]
+            for future in futures:
+                future.result()
+
+    work_dir = tempfile.mkdtemp(prefix="wm_segments_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        segment_files = [os.path.join(work_dir, f"segment_{i:04d}{segment_ext}") for i in range(len(pieces))]
+
+        work = [(index, segment_file, start, end, reencode)
+                for index, (segment_file, (start, end, reencode)) in enumerate(zip(segment_files, pieces))]
+        render_all(work)
+
+        copied = [item for item in work if not item[4]]
+        if copied and len(copied) < len(work) and \
+                not pieces_match([probe_video_stream(segment_file) for segment_file in segment_files]):
+            # Strict players break on a stream whose parameter sets change midway
+            print("Re-encoded pieces do not match the source's stream parameters; re-encoding the copied pieces too")
+            render_all([(index, segment_file, start, end, True) for index, segment_file, start, end, _ in copied])
+
+        list_file = os.path.join(work_dir, "segments.txt")
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for segment_file in segment_files:
+                f.write(f"file '{segment_file}'\n")
+
+        metadata_options = metadata_args if metadata_args is not None else [
+            "-map_metadata", "1",    # Copy global metadata from the source
+            "-map_chapters", "1",    # Copy chapters from the source
+        ]
+        # Join the pieces and put the untouched audio back
+        command = [
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-i", audio_file or input_file,
+            "-map", "0:v:0", "-map", "1:a:0?",
+            "-c", "copy",
+            *metadata_options,
+            output_file
+        ]
         subprocess.run(command, check=True)
-        
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _add_moving_watermark_segmented(input_file, output_file, watermark_text, video_codec, video_bitrate,
+                                    audio_file, metadata_args, segments, workers, threads_per_worker, engine,
+                                    source_codec, encoder_profile, progress_callback, scheduler):
+    cpu_count = scheduler.cpu_budget
+    workers = workers or min(segments or cpu_count, cpu_count)
+    segments = segments or workers
+    threads_per_worker = threads_per_worker or max(1, cpu_count // workers)
+
+    duration = probe_duration(input_file)
+    pieces = [(start, end, True) for start, end in plan_segments(probe_keyframes(input_file), duration, segments)]
+    # Threads are set per piece from the CPU slots it gets
+    encode_options = build_video_encode_options(video_codec, video_bitrate, source_codec, encoder_profile)
+    _render_pieces(
+        input_file, output_file, pieces, watermark_text, encode_options, engine,
+        audio_file, metadata_args, workers, progress_callback=progress_callback,
+        scheduler=scheduler, threads_per_worker=threads_per_worker
+    )
+
+# Encoders that produce a bitstream compatible with stream-copied source GOPs
+SMART_RENDER_ENCODERS = {
+    'h264': 'libx264',
+    'vp9': 'libvpx-vp9',
+}
+
+# ffprobe's H.264 profile names -> libx264 -profile:v values
+H264_PROFILES = {
+    'Baseline': 'baseline',
+    'Constrained Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+def build_smart_render_options(source, encoder_profile=DEFAULT_PROFILE, video_bitrate=None):
+    """
+    Returns the encode options for re-encoded window pieces, matching the
+    source stream's profile, level and pixel format so the pieces can be
+    joined with the stream-copied ones.
+
+    Args:
+        source (dict): The source's video stream, from `probe_video_stream`
+
+    Raises:
+        ValueError: If the source is neither H.264 nor VP9
+    """
+    codec_name = source.get('codec_name')
+    if codec_name not in SMART_RENDER_ENCODERS:
+        raise ValueError(f"Watermark windows need an H.264 or VP9 source, got {codec_name}")
+    options = build_encoder_args(SMART_RENDER_ENCODERS[codec_name], encoder_profile, video_bitrate)
+    if source.get('pix_fmt'):
+        options += ["-pix_fmt", source['pix_fmt']]
+    profile = source.get('profile') or ""
+    if codec_name == 'h264':
+        if profile in H264_PROFILES:
+            options += ["-profile:v", H264_PROFILES[profile]]
+        # ffprobe reports H.264 levels times ten, e.g. 31 for level 3.1
+        if isinstance(source.get('level'), int) and source['level'] > 0:
+            options += ["-level:v", f"{source['level'] / 10:.1f}"]
+    elif profile.startswith("Profile "):
+        options += ["-profile:v", profile.split()[-1]]
+    return options
+
+def _add_moving_watermark_windowed(input_file, output_file, watermark_text, video_bitrate,
+                                   audio_file, metadata_args, windows, workers, threads_per_worker, engine,
+                                   encoder_profile, progress_callback, scheduler):
+    source = probe_video_stream(input_file)
+    # Re-encoded GOPs must match the copied ones: same codec, profile, level and pixel format
+    encode_options = build_smart_render_options(source, encoder_profile, video_bitrate)
+    codec_name = source['codec_name']
+
+    window, period = windows
+    duration = probe_duration(input_file)
+    pieces = plan_watermark_windows(probe_keyframes(input_file), duration, window, period)
+
+    cpu_count = scheduler.cpu_budget
+    reencoded = sum(1 for piece in pieces if piece[2])
+    workers = workers or max(1, min(reencoded, cpu_count))
+    threads_per_worker = threads_per_worker or max(1, cpu_count // workers)
+
+    # MPEG-TS keeps H.264 parameter sets in-band, so pieces from different encoders join cleanly
+    segment_ext = ".ts" if codec_name == 'h264' else ".mkv"
+    _render_pieces(
+        input_file, output_file, pieces, watermark_text, encode_options, engine,
+        audio_file, metadata_args, workers, windows=windows, segment_ext=segment_ext,
+        progress_callback=progress_callback, scheduler=scheduler, threads_per_worker=threads_per_worker
+    )
+
+def build_watermark_command(input_file, output_file, watermark_text, video_codec="libx264", video_bitrate=None,
+                            audio_file=None, metadata_args=None, engine="drawtext", source_codec=None,
+                            encoder_profile=DEFAULT_PROFILE, threads=None):
+    """
+    Returns the ffmpeg command for a single-pass watermark encode (the path
+    `add_moving_watermark` takes when the video is not split).
+
+    Args:
+        threads (int, optional): ffmpeg encoder threads, normally the slots of a `CpuAllocation`
+
+    See `add_moving_watermark` for the other arguments.
+    """
+    # Read audio from its own file when the streams were downloaded separately
+    if audio_file:
+        input_options = ["-i", input_file, "-i", audio_file]
+        audio_map = "1:a:0"
+    else:
+        input_options = ["-i", input_file]
+        audio_map = "0:a:0?"
+    image_inputs, filter_options, video_map = build_watermark_graph(
+        watermark_text, engine, image_input_index=len(input_options) // 2
+    )
+
+    # Either tag the output explicitly or carry over the input's metadata
+    metadata_options = metadata_args if metadata_args is not None else [
+        "-map_metadata", "0",    # Copy global metadata
+        "-map_chapters", "0",    # Copy chapters
+    ]
+
+    return [
+        # Overwrite: a resumed job may find a partial output from an interrupted run
+        "ffmpeg", "-y",
+        *input_options,
+        *image_inputs,
+        # Watermark filter with moving text
+        *filter_options,
+        "-map", video_map,
+        "-map", audio_map,
+        # Video encoding settings, threaded to the slots we were given
+        *build_video_encode_options(video_codec, video_bitrate, source_codec, encoder_profile, threads=threads),
+        "-c:a", "copy",          # Copy audio stream without re-encoding
+        *metadata_options,
+        output_file
+    ]
+
+def add_moving_watermark(input_file, output_file, watermark_text, video_codec="libx264", video_bitrate=None, audio_file=None, metadata_args=None,
+                         segments=None, workers=None, threads_per_worker=None, engine="drawtext", windows=None,
+                         source_codec=None, encoder_profile=DEFAULT_PROFILE, progress_callback=None, scheduler=None):
+    """
+    Adds a moving watermark to the input video using FFmpeg and saves it to the output file.
+
+    Args:
+        input_file (str): Path to the input video file
+        output_file (str): Path where the watermarked video will be saved
+        watermark_text (str): Text to be used as watermark
+        video_codec (str): Encoder to use (default: "libx264"), normally the one
+            picked by `select_video_codec`
+        video_bitrate (int, optional): Video bitrate in kbps. If None, uses quality-based rate control
+        audio_file (str, optional): Separate audio stream to mux in. When given,
+            the video stream is taken from input_file and the audio from this
+            file, so merging and watermarking happen in one pass
+        metadata_args (list, optional): Output metadata options to use instead
+            of copying the input's metadata and chapters
+        segments (int, optional): Split the video at keyframes into this many
+            pieces and encode them in parallel, then join them
+        workers (int, optional): Pieces encoded at the same time (default: one
+            per CPU core, capped by segments). Setting it enables segmented mode
+        threads_per_worker (int, optional): ffmpeg threads for each piece, or
+            for the whole encode when it is not split (default: the CPU budget
+            divided by workers, or the scheduler's threads per job)
+        engine (str): "drawtext" draws the text on every frame; "overlay"
+            renders it once to an image and composites that instead
+        windows (tuple, optional): (window, period) in seconds, e.g. (10, 60)
+            to show the watermark for 10 s of every minute. Only the GOPs
+            around those windows are re-encoded, with the source's codec
+            settings; the rest of the video is stream-copied
+        source_codec (str, optional): Codec of the input video stream, used by
+            the encoder policy (see `encoder_policy.choose_encoder`)
+        encoder_profile (str): "fast", "balanced" or "archival"
+        progress_callback (function, optional): Called while encoding with
+            percent, fps, speed and ETA (see `run_ffmpeg`)
+        scheduler (EncodeScheduler, optional): Hands out the CPU slots each
+            ffmpeg process runs on (default: the shared host-wide scheduler)
+
+    Raises:
+        RuntimeError: If FFmpeg fails to add the watermark, or has the
+            filters of neither engine (see `choose_engine`)
+        ValueError: If windows is not a valid (window, period) pair
+    """
+    scheduler = scheduler or get_encode_scheduler()
+    if windows:
+        windows = validate_windows(windows)
+    engine = choose_engine(engine, watermark_text)
+    try:
+        if windows:
+            _add_moving_watermark_windowed(
+                input_file, output_file, watermark_text, video_bitrate,
+                audio_file, metadata_args, windows, workers, threads_per_worker, engine,
+                encoder_profile, progress_callback, scheduler
+            )
+            return
+
+        if segments or workers:
+            _add_moving_watermark_segmented(
+                input_file, output_file, watermark_text, video_codec, video_bitrate,
+                audio_file, metadata_args, segments, workers, threads_per_worker, engine,
+                source_codec, encoder_profile, progress_callback, scheduler
+            )
+            return
+
+        duration = probe_duration(input_file) if progress_callback else None
+
+        # Waits for CPU slots when other encodes are using the budget
+        with scheduler.allocate(threads_per_worker) as allocation:
+            # Build FFmpeg command with optimized settings
+            command = build_watermark_command(
+                input_file, output_file, watermark_text, video_codec, video_bitrate, audio_file, metadata_args,
+                engine, source_codec, encoder_profile, threads=allocation.threads
+            )
+
+            # Execute FFmpeg command
+            run_ffmpeg(command, duration=duration, progress_callback=progress_callback, allocation=allocation)
+
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Failed to add watermark: {e}")